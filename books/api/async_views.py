@@ -0,0 +1,153 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.authentication import CSRFCheck
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from books.cache import abook_cache_key, aget_or_compute, alist_cache_key
+from books.idempotency import idempotent
+from books.inventory import InsufficientStock, purchase_book
+from books.models import Book
+from books.pagination import EstimatedCountPagination
+from books.purchase_queue import reserve_purchase
+from .filters import BookSearchFilter
+from .mixins import project, requested_fields
+from .serializers import BookSerializer, RestockEventSerializer
+
+# Native async counterparts of the book list/detail and purchase endpoints,
+# for deployments served by an ASGI server. They answer with the same JSON
+# as the DRF views, but a slow client only holds a coroutine, never a thread.
+
+
+def _json(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def _not_found():
+    return _json({'detail': 'Not found.'}, status=404)
+
+
+class AsyncBookListView(View):
+    """
+    GET /api/async/books/ -> list all books, paginated, filtered, searched
+    and projected like BookListCreateAPIView (?limit=, ?offset=, ?author=,
+    ?search=, ?fields=, ?omit=, ?cursor=), read through the catalog cache
+    """
+    queryset = Book.objects.select_related('inventory').with_shard_totals().order_by('id')
+    keyset_ordering = ('id',)
+    search_fields = ['title', 'author']
+
+    async def get(self, request):
+        try:
+            fields = requested_fields(request.GET, BookSerializer, BookSerializer.Meta.list_fields)
+        except ValidationError as exc:
+            return _json(exc.detail, status=400)
+        try:
+            data = await aget_or_compute(await alist_cache_key(request), lambda: self.page(request, fields))
+        except ValidationError as exc:
+            return _json(exc.detail, status=400)
+        except NotFound as exc:
+            return _json({'detail': exc.detail}, status=404)
+        return _json(data)
+
+    async def page(self, request, fields):
+        queryset = project(self.queryset.all(), BookSerializer, fields)
+        if 'author' in request.GET:
+            queryset = queryset.filter(author=request.GET['author'])
+
+        # Searching may look up pg_trgm and counting may EXPLAIN the
+        # query: run both in a worker thread
+        paginator = EstimatedCountPagination()
+        books = await sync_to_async(self.search_and_paginate)(paginator, queryset, Request(request))
+        return paginator.get_paginated_response(BookSerializer(books, many=True, fields=fields).data).data
+
+    def search_and_paginate(self, paginator, queryset, request):
+        queryset = BookSearchFilter().filter_queryset(request, queryset, self)
+        return paginator.paginate_queryset(queryset, request, self)
+
+
+class AsyncBookDetailView(View):
+    """
+    GET /api/async/books/{pk}/ -> retrieve a book (?fields=, ?omit=), read
+    through the catalog cache
+    """
+    queryset = Book.objects.select_related('inventory').with_shard_totals()
+
+    async def get(self, request, pk):
+        try:
+            fields = requested_fields(request.GET, BookSerializer)
+        except ValidationError as exc:
+            return _json(exc.detail, status=400)
+        key = f'{await abook_cache_key(pk)}:{",".join(fields)}'
+        try:
+            data = await aget_or_compute(key, lambda: self.book(pk, fields))
+        except Book.DoesNotExist:
+            return _not_found()
+        return _json(data)
+
+    async def book(self, pk, fields):
+        book = await project(self.queryset, BookSerializer, fields).aget(pk=pk)
+        return BookSerializer(book, fields=fields).data
+
+
+def _purchase(pk, quantity):
+    book, event = purchase_book(pk, quantity)
+    return {
+        'book_id': book.pk,
+        'purchased': quantity,
+        'remaining_stock': book.stock,
+        'restock_event': RestockEventSerializer(event).data,
+    }
+
+
+def _reserve(pk, quantity):
+    order, remaining = reserve_purchase(pk, quantity)
+    return {'book_id': pk, 'purchased': quantity, 'remaining_stock': remaining, 'order': order}
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(idempotent, name='post')
+class AsyncPurchaseBookView(View):
+    """
+    POST /api/async/book/buy/{pk}/ -> purchase a book (reduces stock,
+    schedules restock). As with DRF's session authentication, CSRF is only
+    enforced for logged-in users. With PURCHASE_WRITE_BEHIND the purchase
+    is queued and answered with 202, like PurchaseBookAPIView. Retries
+    carrying the same Idempotency-Key header get the original response
+    back (see books.idempotency).
+    """
+
+    async def post(self, request, pk):
+        if (await request.auser()).is_authenticated:
+            check = CSRFCheck(lambda request: None)
+            check.process_request(request)
+            reason = check.process_view(request, None, (), {})
+            if reason:
+                return _json({'detail': f'CSRF Failed: {reason}'}, status=403)
+
+        try:
+            if request.content_type == 'application/json':
+                data = json.loads(request.body or b'{}')
+            else:
+                data = request.POST
+            quantity = max(1, int(data.get('quantity', 1)))
+        except (TypeError, ValueError, AttributeError):
+            return _json({'detail': 'Quantity must be a positive integer.'}, status=400)
+
+        # The stock decrement and the restock event share one transaction,
+        # which the async ORM cannot span: run it in a worker thread
+        write_behind = settings.PURCHASE_WRITE_BEHIND
+        try:
+            data = await sync_to_async(_reserve if write_behind else _purchase)(pk, quantity)
+        except Book.DoesNotExist:
+            return _not_found()
+        except InsufficientStock:
+            return _json({'detail': 'Insufficient stock available.'}, status=400)
+        return _json(data, status=202 if write_behind else 201)
@@ -0,0 +1,113 @@
+from operator import itemgetter
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+from .serializers import BookSerializer, RestockEventSerializer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+# Fast path for large list pages (API_FAST_SERIALIZATION). Rows are read
+# with values() and turned into the serializers' output directly, without
+# model instances or field-by-field serialization; prices and datetimes
+# go through the serializers' own fields, so the output is identical.
+
+
+def _nullable(field):
+    """
+    The to_representation() of a serializer field, passing None through
+    as the serializer does.
+    """
+    to_representation = field.to_representation
+    return lambda value: None if value is None else to_representation(value)
+
+
+class BookRowSerializer:
+    """
+    BookSerializer's representation of the rows of a Book queryset
+    annotated by with_shard_totals(), for all fields or `fields`.
+    """
+    # Annotations read besides BookSerializer.columns()
+    field_annotations = {
+        'stock': ('shard_stock',),
+        'pending_restock_quantity': ('shard_pending',),
+    }
+
+    def rows(self, queryset, fields=None):
+        fields = fields or BookSerializer.Meta.fields
+        annotations = [name for field in fields for name in self.field_annotations.get(field, ())]
+        # The id is always read: keyset pagination needs it
+        return queryset.values(*dict.fromkeys(['id', *BookSerializer.columns(fields), *annotations]))
+
+    def to_representation(self, rows, fields=None):
+        serializer_fields = BookSerializer().fields
+        price = serializer_fields['price'].to_representation
+        next_restock_at = _nullable(serializer_fields['next_restock_at'])
+        last_restocked_at = _nullable(serializer_fields['last_restocked_at'])
+        build = {
+            'price': lambda row: price(row['price']),
+            'stock': lambda row: row['stock'] + (row['shard_stock'] if row['stock_shards'] else 0),
+            'pending_restock_quantity': lambda row: (
+                (row['inventory__pending_quantity'] or 0)
+                + (row['shard_pending'] if row['stock_shards'] else 0)
+            ),
+            'next_restock_at': lambda row: next_restock_at(row['inventory__next_restock_at']),
+            'last_restocked_at': lambda row: last_restocked_at(row['inventory__last_restocked_at']),
+        }
+        # Other fields are plain columns, copied as they are
+        getters = [(name, build.get(name, itemgetter(name))) for name in fields or BookSerializer.Meta.fields]
+        return [{name: get(row) for name, get in getters} for row in rows]
+
+
+class RestockEventRowSerializer:
+    """
+    RestockEventSerializer's representation of the rows of a RestockEvent
+    queryset.
+    """
+    columns = ('id', 'book_id', 'book__title', 'quantity', 'scheduled_for', 'executed', 'executed_at')
+
+    def rows(self, queryset):
+        return queryset.values(*self.columns)
+
+    def to_representation(self, rows):
+        fields = RestockEventSerializer().fields
+        scheduled_for = fields['scheduled_for'].to_representation
+        executed_at = _nullable(fields['executed_at'])
+        return [{
+            'id': row['id'],
+            'book': row['book_id'],
+            'book_title': row['book__title'],
+            'quantity': row['quantity'],
+            'scheduled_for': scheduled_for(row['scheduled_for']),
+            'executed': row['executed'],
+            'executed_at': executed_at(row['executed_at']),
+        } for row in rows]
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer rendering compact output with orjson when it is installed
+    and API_FAST_SERIALIZATION is on, byte for byte as the json module
+    would. Indented output (browsable API, ?indent) and data orjson cannot
+    encode fall back to JSONRenderer.
+    """
+    options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or not settings.API_FAST_SERIALIZATION
+            or not (api_settings.COMPACT_JSON and api_settings.UNICODE_JSON)
+            or self.get_indent(accepted_media_type or '', renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            # Datetimes and other non-JSON types go through DRF's encoder
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer too: they end a line in JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,62 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F, Q
+from rest_framework.filters import SearchFilter
+
+
+_trigram_available = None
+
+
+def trigram_available():
+    """
+    Whether the pg_trgm extension is installed (checked once per process).
+    """
+    global _trigram_available
+    if _trigram_available is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trigram_available = cursor.fetchone() is not None
+    return _trigram_available
+
+
+class BookSearchFilter(SearchFilter):
+    """
+    Ranked full-text search on the `?search=` parameter.
+
+    On PostgreSQL every search word is matched as a prefix against the
+    trigger-maintained `search_vector` column (GIN indexed) and, when
+    pg_trgm is installed, also by trigram word similarity on title and
+    author so that typos still find the book. Results are ordered by
+    relevance. Other databases fall back to DRF's SearchFilter, i.e.
+    ILIKE on `search_fields`.
+    """
+    search_config = 'english'
+
+    def filter_queryset(self, request, queryset, view):
+        if connection.vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+
+        terms = ' '.join(self.get_search_terms(request))
+        words = re.findall(r'\w+', terms)
+        if not words:
+            return queryset
+
+        query = SearchQuery(
+            ' & '.join(f'{word}:*' for word in words),
+            search_type='raw',
+            config=self.search_config,
+        )
+        matches = Q(search_vector=query)
+        rank = SearchRank(F('search_vector'), query)
+        if trigram_available():
+            matches |= Q(title__trigram_word_similar=terms) | Q(author__trigram_word_similar=terms)
+            rank = rank + TrigramWordSimilarity(terms, 'title') + TrigramWordSimilarity(terms, 'author')
+
+        ordering = queryset.query.order_by or ['pk']
+        return (
+            queryset.filter(matches)
+            .annotate(search_rank=rank)
+            .order_by('-search_rank', *ordering)
+        )
@@ -0,0 +1,229 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from books.cache import book_cache_key, get_or_compute, list_cache_key
+
+
+def _validators(*parts, last_modified=None):
+    """
+    Return (etag, last_modified timestamp) for a resource described by
+    `parts` and its last modification datetime.
+    """
+    digest = hashlib.sha1(repr((*parts, last_modified)).encode()).hexdigest()
+    return f'"{digest}"', last_modified and int(last_modified.timestamp())
+
+
+def _latest(datetimes):
+    """
+    Return the latest of the given datetimes, ignoring missing ones.
+    """
+    return max(filter(None, datetimes), default=None)
+
+
+def _query_digest(request):
+    """
+    Short digest of the query string, which selects the representation
+    of a single book (e.g. ?fields=).
+    """
+    return hashlib.sha1(request.GET.urlencode().encode()).hexdigest()[:16]
+
+
+def _conditional_response(request, etag, last_modified, respond):
+    """
+    Answer with 304 Not Modified when the client's validators still match,
+    otherwise build the response with `respond()`. Validators are sent in
+    both cases and clients are asked to revalidate before reusing a copy.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = respond()
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def requested_fields(params, serializer_class, default=None):
+    """
+    The serializer fields asked for in the query parameters, in the
+    serializer's order: ?fields=a,b selects those (and the id, `*` for
+    all of them), ?omit=a,b every field but those. Without either, the
+    `default` fields, or all of them. Raises ValidationError for unknown
+    fields.
+    """
+    available = list(serializer_class.Meta.fields)
+    fields, omit = params.get('fields'), params.get('omit')
+    if fields and omit:
+        raise ValidationError({'fields': 'Use either fields or omit, not both.'})
+    names = [name.strip() for name in (fields or omit or '').split(',') if name.strip()]
+    if names == ['*'] and fields:
+        return available
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}."})
+    if fields:
+        selected = {'id', *names}
+    elif omit:
+        selected = set(available) - set(names)
+    else:
+        selected = set(default or available)
+    return [name for name in available if name in selected]
+
+
+def project(queryset, serializer_class, fields):
+    """
+    Restrict `queryset` to the columns needed to serialize `fields`
+    (only()), following only the relations they are read from.
+    """
+    columns = serializer_class.columns(fields)
+    if queryset.query.select_related:
+        relations = {column.split('__')[0] for column in columns if '__' in column}
+        queryset = queryset.select_related(None).select_related(*relations)
+    return queryset.only(*columns)
+
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets on GET (see requested_fields()): the serializer
+    outputs only the requested fields and only their columns are loaded,
+    so omitted fields such as a long description cost no I/O either.
+    `default_fields` is the projection without parameters (None: all).
+    """
+    default_fields = None
+
+    def get_field_names(self):
+        if not hasattr(self, '_field_names'):
+            self._field_names = requested_fields(
+                self.request.query_params, self.serializer_class, self.default_fields
+            )
+        return self._field_names
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in ('GET', 'HEAD'):
+            return queryset
+        return project(queryset, self.serializer_class, self.get_field_names())
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method in ('GET', 'HEAD'):
+            kwargs['fields'] = self.get_field_names()
+        return super().get_serializer(*args, **kwargs)
+
+
+class CachedListMixin:
+    """
+    Serve list responses through the versioned catalog cache. Entries are
+    invalidated whenever any book changes (see books.cache).
+    """
+
+    def list(self, request, *args, **kwargs):
+        data = get_or_compute(
+            list_cache_key(request),
+            lambda: super(CachedListMixin, self).list(request, *args, **kwargs).data,
+        )
+        return Response(data)
+
+
+class CachedRetrieveMixin:
+    """
+    Serve single-book responses through the versioned catalog cache. Entries
+    are invalidated whenever that book changes (see books.cache).
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        data = get_or_compute(
+            f'{book_cache_key(pk)}:{_query_digest(request)}',
+            lambda: super(CachedRetrieveMixin, self).retrieve(request, *args, **kwargs).data,
+        )
+        return Response(data)
+
+
+class ConditionalListMixin:
+    """
+    ETag / Last-Modified support for book lists. The validators are
+    derived from the latest of `last_modified_fields` (shard_updated_at
+    comes from Book.objects.with_shard_totals()), the row count and
+    the full URL (filters and pagination), and memoized in the versioned
+    catalog cache, so an unchanged list is answered with 304 before the
+    serializer runs.
+    """
+    last_modified_fields = ('updated_at', 'inventory__updated_at', 'shard_updated_at')
+
+    def list(self, request, *args, **kwargs):
+        def validators():
+            stats = (
+                self.filter_queryset(self.get_queryset())
+                .order_by()
+                .aggregate(
+                    count=Count('pk'),
+                    **{f'max_{i}': Max(name) for i, name in enumerate(self.last_modified_fields)},
+                )
+            )
+            count = stats.pop('count')
+            return _validators(
+                request.build_absolute_uri(), count,
+                last_modified=_latest(stats.values()),
+            )
+
+        etag, last_modified = get_or_compute(
+            f'{list_cache_key(request)}:validators', validators, counted=False
+        )
+        return _conditional_response(
+            request, etag, last_modified,
+            lambda: super(ConditionalListMixin, self).list(request, *args, **kwargs),
+        )
+
+
+class ConditionalRetrieveMixin:
+    """
+    ETag / Last-Modified support for a single book, derived from the
+    latest of its `last_modified_fields` and memoized in the versioned
+    catalog cache.
+    """
+    last_modified_fields = ('updated_at', 'inventory__updated_at', 'shard_updated_at')
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+
+        def validators():
+            row = self.get_queryset().filter(pk=pk).values_list(*self.last_modified_fields).first()
+            # Unknown books are not cached: let retrieve() answer 404
+            return row and _validators('book', pk, request.GET.urlencode(), last_modified=_latest(row))
+
+        def respond():
+            return super(ConditionalRetrieveMixin, self).retrieve(request, *args, **kwargs)
+
+        validated = get_or_compute(
+            f'{book_cache_key(pk)}:{_query_digest(request)}:validators', validators, counted=False
+        )
+        if not validated:
+            return respond()
+        etag, last_modified = validated
+        return _conditional_response(request, etag, last_modified, respond)
+
+
+class FastListMixin:
+    """
+    Serialize list pages from values() rows with `fast_serializer` (see
+    books.api.fastpath) instead of model instances and the serializer,
+    when API_FAST_SERIALIZATION is on. The output is the same.
+    """
+    fast_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        if not settings.API_FAST_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+        fields = self.get_field_names() if isinstance(self, SparseFieldsMixin) else None
+        queryset = self.fast_serializer.rows(self.filter_queryset(self.get_queryset()), fields)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.fast_serializer.to_representation(page, fields))
+        return Response(self.fast_serializer.to_representation(queryset, fields))
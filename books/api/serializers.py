@@ -1,14 +1,64 @@
 from rest_framework import serializers
-from books.models import Book, RestockEvent
+from books.models import Book, RestockDailySummary, RestockEvent, RestockRun
+from books.shards import set_stock
 
 
 class BookSerializer(serializers.ModelSerializer):
     """
-    Serializer for Book model: exposes basic fields.
+    Serializer for Book model: exposes basic fields and the restock
+    figures of the book's inventory summary (read-only). The stock of a
+    sharded book is the total of its shards. Pass `fields` to serialize a
+    subset of the fields.
     """
+    pending_restock_quantity = serializers.IntegerField(read_only=True)
+    next_restock_at = serializers.DateTimeField(source='inventory.next_restock_at', read_only=True, default=None)
+    last_restocked_at = serializers.DateTimeField(source='inventory.last_restocked_at', read_only=True, default=None)
+
+    # Columns each field is read from, when not the field itself
+    field_columns = {
+        'stock': ('stock', 'stock_shards'),
+        'pending_restock_quantity': ('stock_shards', 'inventory__pending_quantity'),
+        'next_restock_at': ('inventory__next_restock_at',),
+        'last_restocked_at': ('inventory__last_restocked_at',),
+    }
+
     class Meta:
         model = Book
-        fields = ['id', 'title', 'author', 'description', 'price', 'stock']
+        fields = [
+            'id', 'title', 'author', 'description', 'price', 'stock',
+            'pending_restock_quantity', 'next_restock_at', 'last_restocked_at',
+        ]
+        # Default projection of the list endpoints
+        list_fields = ['id', 'title', 'author', 'price', 'stock']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def columns(cls, fields):
+        """
+        The model columns to load to serialize `fields`.
+        """
+        return list(dict.fromkeys(
+            column for name in fields for column in cls.field_columns.get(name, (name,))
+        ))
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'stock' in data:
+            data['stock'] = instance.available_stock
+        return data
+
+    def update(self, instance, validated_data):
+        stock = validated_data.pop('stock', None) if instance.stock_shards else None
+        instance = super().update(instance, validated_data)
+        if stock is not None:
+            set_stock(instance.pk, stock)
+            instance.shard_stock = stock
+        return instance
 
 
 class RestockEventSerializer(serializers.ModelSerializer):
@@ -18,4 +68,47 @@ class RestockEventSerializer(serializers.ModelSerializer):
     book_title = serializers.CharField(source='book.title', read_only=True)
     class Meta:
         model = RestockEvent
-        fields = ['id', 'book', 'book_title', 'quantity', 'scheduled_for', 'executed', 'executed_at']
\ No newline at end of file
+        fields = ['id', 'book', 'book_title', 'quantity', 'scheduled_for', 'executed', 'executed_at']
+
+class RestockDailySummarySerializer(serializers.ModelSerializer):
+    """
+    Serializer for archived restock events rolled up per book and day.
+    """
+    book_title = serializers.CharField(source='book.title', read_only=True)
+    class Meta:
+        model = RestockDailySummary
+        fields = ['id', 'book', 'book_title', 'day', 'events', 'quantity']
+
+
+class RestockRunSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the telemetry of one run of the restock executor.
+    """
+    lag_mean = serializers.FloatField(read_only=True)
+    class Meta:
+        model = RestockRun
+        fields = [
+            'id', 'task', 'started_at', 'duration', 'processed', 'chunks',
+            'lag_mean', 'lag_max', 'backlog', 'oldest_overdue_at', 'wakeups', 'failed',
+        ]
+
+
+class PurchaseLineSerializer(serializers.Serializer):
+    """
+    Serializer for one line of a batch purchase.
+    """
+    book = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class BatchPurchaseSerializer(serializers.Serializer):
+    """
+    Serializer for a batch purchase: a list of lines and the fill mode.
+    """
+    MODE_ALL_OR_NOTHING = 'all_or_nothing'
+    MODE_PARTIAL = 'partial'
+
+    lines = PurchaseLineSerializer(many=True, allow_empty=False, max_length=100)
+    mode = serializers.ChoiceField(
+        choices=[MODE_ALL_OR_NOTHING, MODE_PARTIAL], default=MODE_ALL_OR_NOTHING
+    )
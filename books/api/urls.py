@@ -1,20 +1,36 @@
 from django.urls import path
+from .async_views import AsyncBookDetailView, AsyncBookListView, AsyncPurchaseBookView
 from .views import (
     BookListCreateAPIView,
     BookDetailAPIView,
     PurchaseBookAPIView,
+    BatchPurchaseAPIView,
     RestockEventListAPIView,
-    BookRetrieveUpdateDestroyAPIView,
-    BookListAPIView,
+    PendingRestockEventListAPIView,
+    ExecutedRestockEventListAPIView,
+    RestockArchiveListAPIView,
+    RestockRunListAPIView,
+    CatalogCacheStatsAPIView,
 )
 
 app_name = 'books_api'
 
 urlpatterns = [
-    path('books/', BookListCreateAPIView.as_view(), name='books-list-create'),    path('books/<int:pk>/', BookDetailAPIView.as_view(), name='books-detail'),
-    path('books/', BookListAPIView.as_view(), name='books-list'),
-    path('books/<int:pk>/', BookRetrieveUpdateDestroyAPIView.as_view(), name='books-detail-update-delete'),
+    path('books/', BookListCreateAPIView.as_view(), name='books-list-create'),
     path('books/<int:pk>/', BookDetailAPIView.as_view(), name='books-detail'),
+    # Former names of the two routes above, still accepted by reverse()
+    path('books/', BookListCreateAPIView.as_view(), name='books-list'),
+    path('books/<int:pk>/', BookDetailAPIView.as_view(), name='books-detail-update-delete'),
     path('book/buy/<int:pk>/', PurchaseBookAPIView.as_view(), name='book-buy-api'),
+    path('book/buy/', BatchPurchaseAPIView.as_view(), name='book-buy-batch-api'),
     path('events/', RestockEventListAPIView.as_view(), name='events-list'),
+    path('events/pending/', PendingRestockEventListAPIView.as_view(), name='events-pending'),
+    path('events/executed/', ExecutedRestockEventListAPIView.as_view(), name='events-executed'),
+    path('events/archive/', RestockArchiveListAPIView.as_view(), name='events-archive'),
+    path('events/runs/', RestockRunListAPIView.as_view(), name='events-runs'),
+    path('cache/stats/', CatalogCacheStatsAPIView.as_view(), name='cache-stats'),
+    # Native async endpoints (serve with an ASGI server)
+    path('async/books/', AsyncBookListView.as_view(), name='async-books-list'),
+    path('async/books/<int:pk>/', AsyncBookDetailView.as_view(), name='async-books-detail'),
+    path('async/book/buy/<int:pk>/', AsyncPurchaseBookView.as_view(), name='async-book-buy'),
 ]
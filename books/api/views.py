@@ -1,63 +1,84 @@
-from django.shortcuts import get_object_or_404
-from django.utils import timezone
 from django.conf import settings
+from django.http import Http404
+from django.urls import reverse
+from django.utils.decorators import method_decorator
 
 from rest_framework import generics, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.pagination import replace_query_param
+from rest_framework.renderers import BrowsableAPIRenderer
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter
 
 
-from books.models import Book, RestockEvent
-from .serializers import BookSerializer, RestockEventSerializer
+from books.cache import cache_stats
+from books.idempotency import idempotent
+from books.inventory import PURCHASED, InsufficientStock, purchase_book, purchase_lines
+from books.models import Book, RestockDailySummary, RestockEvent, RestockRun
+from books.pagination import KeysetPagination, keyset_page
+from books.purchase_queue import reserve_purchase
+from .fastpath import BookRowSerializer, FastJSONRenderer, RestockEventRowSerializer
+from .filters import BookSearchFilter
+from .mixins import (
+    CachedListMixin,
+    CachedRetrieveMixin,
+    ConditionalListMixin,
+    ConditionalRetrieveMixin,
+    FastListMixin,
+    SparseFieldsMixin,
+)
+from .serializers import (
+    BatchPurchaseSerializer,
+    BookSerializer,
+    RestockDailySummarySerializer,
+    RestockEventSerializer,
+    RestockRunSerializer,
+)
 
 
-class BookListAPIView(generics.ListAPIView):
+class BookDetailAPIView(
+    SparseFieldsMixin, ConditionalRetrieveMixin, CachedRetrieveMixin, generics.RetrieveUpdateDestroyAPIView
+):
     """
-    GET /api/books/  -> list all books
-    """
-    queryset = Book.objects.all()
-    serializer_class = BookSerializer
-    permission_classes = [permissions.AllowAny]
-    
-
-class BookDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
-    """
-    GET    /api/books/{pk}/    Retrieve
+    GET    /api/books/{pk}/    Retrieve (?fields= / ?omit=, see SparseFieldsMixin)
     PUT    /api/books/{pk}/    Update
     PATCH  /api/books/{pk}/    Partial update
     DELETE /api/books/{pk}/    Delete
     """
-    queryset = Book.objects.all()
+    queryset = Book.objects.select_related('inventory').with_shard_totals()
     serializer_class = BookSerializer
     
 
+@method_decorator(idempotent, name='dispatch')
 class PurchaseBookAPIView(APIView):
     """
     POST /api/book/buy/<id>/ -> purchase a book (reduces stock, schedules restock)
+
+    A retry carrying the same Idempotency-Key header gets the original
+    response back instead of buying again (see books.idempotency).
+
+    With PURCHASE_WRITE_BEHIND the purchase is reserved and queued, and
+    answered with 202 Accepted; the stock and the restock event are
+    written by the next flush (see books.purchase_queue).
     """
     permission_classes = [permissions.AllowAny]
 
     def post(self, request, pk):
-        book = get_object_or_404(Book, pk=pk)
         try:
             quantity = max(1, int(request.data.get('quantity', 1)))
         except (TypeError, ValueError):
             return Response({'detail': 'Quantity must be a positive integer.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Validate stock
-        if book.stock < quantity:
-            return Response({'detail': 'Insufficient stock available.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Reduce stock
-        book.stock -= quantity
-        book.save()
+        if settings.PURCHASE_WRITE_BEHIND:
+            return self.reserve(pk, quantity)
 
-        # Schedule restock
-        delay = int(settings.RESTOCK_DELAY_DAYS)
-        scheduled = timezone.now() + timezone.timedelta(days=delay)
-        ev = RestockEvent.objects.create(book=book, scheduled_for=scheduled, quantity=quantity)
+        # Reduce stock and schedule restock atomically
+        try:
+            book, ev = purchase_book(pk, quantity)
+        except Book.DoesNotExist:
+            raise Http404
+        except InsufficientStock:
+            return Response({'detail': 'Insufficient stock available.'}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
             'book_id': book.pk,
@@ -66,38 +87,171 @@ class PurchaseBookAPIView(APIView):
             'restock_event': RestockEventSerializer(ev).data
         }, status=status.HTTP_201_CREATED)
 
+    def reserve(self, pk, quantity):
+        try:
+            order, remaining = reserve_purchase(pk, quantity)
+        except Book.DoesNotExist:
+            raise Http404
+        except InsufficientStock:
+            return Response({'detail': 'Insufficient stock available.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'book_id': pk,
+            'purchased': quantity,
+            'remaining_stock': remaining,
+            'order': order,
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class BatchPurchaseAPIView(APIView):
+    """
+    POST /api/book/buy/ -> purchase several books at once
+
+    Body: {"lines": [{"book": <id>, "quantity": <n>}, ...],
+           "mode": "all_or_nothing" | "partial"}
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        serializer = BatchPurchaseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        partial = data['mode'] == BatchPurchaseSerializer.MODE_PARTIAL
+
+        results = purchase_lines(
+            [(line['book'], line['quantity']) for line in data['lines']],
+            partial=partial,
+        )
+        for result in results:
+            if 'restock_event' in result:
+                result['restock_event'] = result['restock_event'].pk
+
+        purchased = sum(1 for result in results if result['status'] == PURCHASED)
+        if not purchased:
+            return Response({
+                'detail': 'No line could be purchased.',
+                'mode': data['mode'],
+                'lines': results,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'mode': data['mode'],
+            'purchased_lines': purchased,
+            'lines': results,
+        }, status=status.HTTP_201_CREATED)
+
+
+class PendingRestockEventListAPIView(generics.ListAPIView):
+    """
+    GET /api/events/pending/ -> pending restock events, oldest first,
+    cursor-paginated on (scheduled_for, id)
+    """
+    queryset = RestockEvent.objects.filter(executed=False).select_related('book')
+    serializer_class = RestockEventSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = KeysetPagination
+    ordering = ('scheduled_for', 'id')
+
+
+class ExecutedRestockEventListAPIView(generics.ListAPIView):
+    """
+    GET /api/events/executed/ -> executed restock events, newest first,
+    cursor-paginated on (executed_at, id)
+    """
+    queryset = RestockEvent.objects.filter(executed=True).select_related('book')
+    serializer_class = RestockEventSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = KeysetPagination
+    ordering = ('-executed_at', '-id')
+
+
+class RestockArchiveListAPIView(generics.ListAPIView):
+    """
+    GET /api/events/archive/ -> archived restock events rolled up per book
+    and day, newest first. Filters: ?book=<id>&day__gte=<date>&day__lte=<date>
+    """
+    queryset = RestockDailySummary.objects.select_related('book')
+    serializer_class = RestockDailySummarySerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = KeysetPagination
+    ordering = ('-day', '-id')
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = {'book': ['exact'], 'day': ['exact', 'gte', 'lte']}
+
+
+class RestockRunListAPIView(generics.ListAPIView):
+    """
+    GET /api/events/runs/ -> telemetry of the restock executor runs,
+    newest first. Filter: ?task=sweep|wakeup
+    """
+    queryset = RestockRun.objects.all()
+    serializer_class = RestockRunSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = KeysetPagination
+    ordering = ('-started_at', '-id')
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['task']
+
 
 class RestockEventListAPIView(APIView):
     """
-    GET /api/events/ -> returns both pending and executed restock events
+    GET /api/events/ -> returns the first page of both pending and executed
+    restock events, with links to the next page of each feed
     """
     permission_classes = [permissions.AllowAny]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    feeds = (
+        ('pending', PendingRestockEventListAPIView, 'books_api:events-pending'),
+        ('executed', ExecutedRestockEventListAPIView, 'books_api:events-executed'),
+    )
 
     def get(self, request):
-        pending = RestockEvent.objects.filter(executed=False).order_by('scheduled_for')
-        executed = RestockEvent.objects.filter(executed=True).order_by('-executed_at')
-        return Response({
-            'pending_events': RestockEventSerializer(pending, many=True).data,
-            'executed_events': RestockEventSerializer(executed, many=True).data,
-        })
+        fast_serializer = RestockEventRowSerializer() if settings.API_FAST_SERIALIZATION else None
+        data = {}
+        for name, feed, url_name in self.feeds:
+            paginator = KeysetPagination()
+            queryset = feed.queryset.all()
+            if fast_serializer:
+                queryset = fast_serializer.rows(queryset)
+            events, next_cursor = keyset_page(
+                queryset, feed.ordering, page_size=paginator.get_page_size(request)
+            )
+            if fast_serializer:
+                data[f'{name}_events'] = fast_serializer.to_representation(events)
+            else:
+                data[f'{name}_events'] = RestockEventSerializer(events, many=True).data
+            data[f'{name}_next'] = next_cursor and replace_query_param(
+                request.build_absolute_uri(reverse(url_name)),
+                paginator.cursor_query_param,
+                next_cursor,
+            )
+        return Response(data)
 
-class BookListCreateAPIView(generics.ListCreateAPIView):
+
+class BookListCreateAPIView(
+    SparseFieldsMixin, ConditionalListMixin, CachedListMixin, FastListMixin, generics.ListCreateAPIView
+):
     """
-    GET  /api/books/      List all books
+    GET  /api/books/      List all books (id, title, author, price and stock
+                          unless ?fields= / ?omit= say otherwise); ?cursor=
+                          pages through them by id (see EstimatedCountPagination)
     POST /api/books/      Create a new book
     """
-    queryset = Book.objects.all().order_by('id')
+    queryset = Book.objects.select_related('inventory').with_shard_totals().order_by('id')
     serializer_class = BookSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    keyset_ordering = ('id',)
+    default_fields = BookSerializer.Meta.list_fields
+    fast_serializer = BookRowSerializer()
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    filter_backends = [DjangoFilterBackend, BookSearchFilter]
     filterset_fields = ['author']
     search_fields = ['title', 'author']
 
 
-class BookRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class CatalogCacheStatsAPIView(APIView):
     """
-    GET    /api/books/{pk}/    Retrieve a book
-    PUT    /api/books/{pk}/    Update a book
-    DELETE /api/books/{pk}/    Delete a book
+    GET /api/cache/stats/ -> catalog cache hits, misses and hit rate (staff only)
     """
-    queryset = Book.objects.all()
-    serializer_class = BookSerializer
\ No newline at end of file
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(cache_stats())
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import RestockDailySummary, RestockEvent
+
+
+def archive_executed_events(older_than_days=None, chunk_size=None, now=None):
+    """
+    Roll executed RestockEvents older than `older_than_days` (default
+    RESTOCK_RETENTION_DAYS) up into per-book daily summaries and delete
+    them from the events table, in chunks of `chunk_size` events (default
+    RESTOCK_BATCH_SIZE). Returns the number of events archived.
+    """
+    days = settings.RESTOCK_RETENTION_DAYS if older_than_days is None else older_than_days
+    cutoff = (now or timezone.now()) - timezone.timedelta(days=int(days))
+    chunk_size = int(chunk_size or settings.RESTOCK_BATCH_SIZE)
+    archived = 0
+    while True:
+        count = _archive_chunk(cutoff, chunk_size)
+        archived += count
+        if count < chunk_size:
+            return archived
+
+
+def _archive_chunk(cutoff, chunk_size):
+    """
+    Archive up to `chunk_size` events executed before `cutoff` in a single
+    transaction: claim them, add their counts to the daily summaries with
+    one INSERT ... ON CONFLICT DO UPDATE (in (book_id, day) order), and
+    delete them.
+    """
+    with transaction.atomic():
+        ids = list(
+            RestockEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(executed=True, executed_at__lt=cutoff)
+            .order_by('-executed_at', '-id')
+            .values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return 0
+
+        rows = (
+            RestockEvent.objects
+            .filter(pk__in=ids)
+            .annotate(day=TruncDate('executed_at'))
+            .values('book_id', 'day')
+            .annotate(events=Count('id'), quantity=Sum('quantity'))
+            .order_by()
+        )
+        _add_to_summaries([(r['book_id'], r['day'], r['events'], r['quantity']) for r in rows])
+        RestockEvent.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def _add_to_summaries(rows):
+    """
+    Add (book_id, day, events, quantity) rows to the daily summaries,
+    creating the missing ones.
+    """
+    # Summary rows are locked in (book_id, day) order, whoever writes
+    # them: concurrent archivers then queue on a row instead of deadlocking
+    rows = sorted(rows)
+    table = connection.ops.quote_name(RestockDailySummary._meta.db_table)
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} AS s (book_id, day, events, quantity) VALUES {values} "
+            f"ON CONFLICT (book_id, day) DO UPDATE SET "
+            f"events = s.events + EXCLUDED.events, quantity = s.quantity + EXCLUDED.quantity",
+            [value for row in rows for value in row],
+        )
@@ -0,0 +1,439 @@
+import asyncio
+import json
+import random
+import subprocess
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, connections
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.http import HttpResponse
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Book, RestockEvent
+from .restock import execute_due_events
+from .shards import shard_book
+from .summary import check_summaries
+
+SEED_BATCH_SIZE = 5000
+
+
+def percentile(samples, p):
+    """
+    Nearest-rank percentile of a sorted list of samples.
+    """
+    if not samples:
+        return None
+    index = max(0, min(len(samples) - 1, round(p / 100 * len(samples)) - 1))
+    return samples[index]
+
+
+def summarize(latencies, queries, elapsed, errors=0):
+    """
+    Throughput, latency percentiles (milliseconds) and queries per call of
+    a batch of timed calls that took `elapsed` seconds of wall time
+    (`queries` is None when they were not counted).
+    """
+    latencies = sorted(latencies)
+    calls = len(latencies)
+    return {
+        'calls': calls,
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'throughput': round(calls / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / calls * 1000, 3) if calls else None,
+            **{f'p{p}': percentile(latencies, p) and round(percentile(latencies, p) * 1000, 3)
+               for p in (50, 95, 99)},
+            'max': round(latencies[-1] * 1000, 3) if calls else None,
+        },
+        'queries_per_call': round(sum(queries) / calls, 2) if calls and queries is not None else None,
+    }
+
+
+def _bulk_create(model, objects):
+    objects = iter(objects)
+    while batch := list(islice(objects, SEED_BATCH_SIZE)):
+        model.objects.bulk_create(batch)
+
+
+def seed_catalog(books, stock=1_000_000):
+    """
+    Create `books` synthetic books with a large stock and their inventory
+    summaries. Returns the new book ids.
+    """
+    start = Book.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    _bulk_create(Book, (
+        Book(title=f'Benchmark book {n}', author=f'Author {n % 100}', price=10, stock=stock)
+        for n in range(books)
+    ))
+    book_ids = list(Book.objects.filter(pk__gt=start).order_by('pk').values_list('pk', flat=True))
+    check_summaries(rebuild=True)
+    return book_ids
+
+
+def seed_due_events(book_ids, count, now, rng):
+    """
+    Create `count` pending restock events spread over the hour before `now`.
+    """
+    _bulk_create(RestockEvent, (
+        RestockEvent(
+            book_id=rng.choice(book_ids),
+            quantity=rng.randint(1, 5),
+            scheduled_for=now - timezone.timedelta(seconds=rng.randint(1, 3600)),
+        )
+        for _ in range(count)
+    ))
+    check_summaries(rebuild=True)
+
+
+def run_concurrently(calls, threads, client_class=Client):
+    """
+    Run the `calls` (functions taking a client and returning a response)
+    over `threads` threads, each with its own `client_class` client and
+    database connection. Returns summarize() of the run; queries are only
+    counted with the test Client, which keeps its connection open.
+    """
+    counted = client_class is Client
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+
+    def worker(share):
+        client = client_class()
+        local_latencies, local_queries, local_errors = [], [], 0
+        try:
+            for call in share:
+                with CaptureQueriesContext(connection) if counted else nullcontext() as ctx:
+                    started = time.perf_counter()
+                    response = call(client)
+                    local_latencies.append(time.perf_counter() - started)
+                if counted:
+                    local_queries.append(len(ctx.captured_queries))
+                local_errors += response.status_code >= 400
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            errors.append(local_errors)
+
+    shares = [calls[n::threads] for n in range(threads)]
+    started = time.perf_counter()
+    if threads == 1:
+        worker(shares[0])
+    else:
+        workers = [threading.Thread(target=worker, args=(share,)) for share in shares]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    return summarize(latencies, queries if counted else None, time.perf_counter() - started, sum(errors))
+
+
+class WSGIServerClient:
+    """
+    Calls the project's WSGI application the way a WSGI server does.
+    Unlike the test client, database connections are closed at the end of
+    each request (CONN_MAX_AGE permitting), as in production.
+    """
+
+    def __init__(self, application=None):
+        self.application = application or get_wsgi_application()
+
+    def request(self, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        environ = RequestFactory().generic(method, path, body, 'application/json').environ
+        status = []
+        response = self.application(environ, lambda code, headers, exc_info=None: status.append(code))
+        try:
+            b''.join(response)
+        finally:
+            response.close()
+        response.status_code = int(status[0].split()[0])
+        return response
+
+    def get(self, path, data=None):
+        return self.request('GET', path)
+
+    def post(self, path, data=None):
+        return self.request('POST', path, data)
+
+
+class ASGIServerClient:
+    """
+    Calls the project's ASGI application the way an ASGI server does:
+    every request runs in its own thread-sensitive context (the test
+    AsyncClient funnels every request through one thread) and its
+    database connection is closed when it finishes.
+    """
+
+    def __init__(self, application=None):
+        self.application = application or get_asgi_application()
+
+    async def request(self, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'headers': [
+                (b'host', b'testserver'),
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 0),
+        }
+        received = asyncio.Event()
+        messages = []
+
+        async def receive():
+            if not received.is_set():
+                received.set()
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # The client never disconnects: wait until the handler gives up listening
+            await asyncio.Future()
+
+        async def send(message):
+            messages.append(message)
+
+        await self.application(scope, receive, send)
+        start = next(m for m in messages if m['type'] == 'http.response.start')
+        response = HttpResponse(
+            b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body'),
+            status=start['status'],
+        )
+        return response
+
+    async def get(self, path, data=None):
+        return await self.request('GET', path)
+
+    async def post(self, path, data=None):
+        return await self.request('POST', path, data)
+
+
+@contextmanager
+def non_persistent_connections():
+    """
+    Under ASGI every request runs on a thread of its own, so a persistent
+    connection would never be reused nor closed: as `manage.py serve
+    --asgi` does, close connections at the end of each request (they go
+    back to the pool when DB_POOL_MAX_SIZE is set).
+    """
+    previous = {alias: connections.settings[alias]['CONN_MAX_AGE'] for alias in connections}
+    for alias in connections:
+        connections.settings[alias]['CONN_MAX_AGE'] = 0
+    try:
+        yield
+    finally:
+        for alias, max_age in previous.items():
+            connections.settings[alias]['CONN_MAX_AGE'] = max_age
+
+
+def run_concurrently_async(calls, concurrency):
+    """
+    Run the async `calls` (coroutine functions taking an ASGIServerClient
+    and returning a response) on one event loop, at most `concurrency` at
+    a time. Returns summarize() of the run; queries are not counted.
+    """
+    async def main():
+        client = ASGIServerClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def timed(call):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await call(client)
+                latencies.append(time.perf_counter() - started)
+                return response.status_code >= 400
+
+        started = time.perf_counter()
+        errors = sum(await asyncio.gather(*map(timed, calls)))
+        return summarize(latencies, None, time.perf_counter() - started, errors)
+
+    with non_persistent_connections():
+        return asyncio.run(main())
+
+
+def bench_purchase(book_ids, requests, threads, rng):
+    """
+    POST /api/book/buy/<id>/ for random books from `threads` threads.
+    """
+    def purchase(url):
+        return lambda client: client.post(url, {'quantity': 1})
+
+    calls = [
+        purchase(reverse('books_api:book-buy-api', args=[rng.choice(book_ids)]))
+        for _ in range(requests)
+    ]
+    return {'threads': threads, **run_concurrently(calls, threads)}
+
+
+def bench_hot_title(book_ids, requests, threads, shards):
+    """
+    Flash sale: every purchase goes to the same title, first with a single
+    stock counter, then with the title's stock split over `shards` shards.
+    """
+    single, sharded = book_ids[:2]
+    shard_book(sharded, shards)
+
+    def purchase(url):
+        return lambda client: client.post(url, {'quantity': 1})
+
+    results = {'threads': threads, 'shards': shards}
+    for name, book_id in (('single', single), ('sharded', sharded)):
+        url = reverse('books_api:book-buy-api', args=[book_id])
+        results[name] = run_concurrently([purchase(url)] * requests, threads)
+    return results
+
+
+def bench_restock(book_ids, events, chunk_size, rng):
+    """
+    Seed `events` due restock events and time process_restock_events'
+    executor draining them.
+    """
+    now = timezone.now()
+    seed_due_events(book_ids, events, now, rng)
+    with CaptureQueriesContext(connection) as ctx:
+        started = time.perf_counter()
+        processed = execute_due_events(now=now, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - started
+    return {
+        'events': processed,
+        'chunk_size': chunk_size,
+        'seconds': round(elapsed, 4),
+        'events_per_second': round(processed / elapsed, 2) if elapsed else None,
+        'queries': len(ctx.captured_queries),
+    }
+
+
+def bench_events_feed(requests, threads, pages):
+    """
+    GET /api/events/, then walk `pages` pages of the executed feed.
+    """
+    first_page = run_concurrently(
+        [lambda client: client.get(reverse('books_api:events-list'))] * requests, threads
+    )
+
+    def walk(client):
+        response = client.get(reverse('books_api:events-list'))
+        url = response.status_code == 200 and response.json()['executed_next']
+        for _ in range(pages):
+            if not url:
+                break
+            response = client.get(url)
+            url = response.status_code == 200 and response.json()['next']
+        return response
+
+    deep_pages = run_concurrently([walk] * max(1, requests // pages), threads)
+    return {'threads': threads, 'first_page': first_page, f'walk_{pages}_pages': deep_pages}
+
+
+def bench_asgi(book_ids, requests, threads, concurrency, rng):
+    """
+    Compare the DRF views served by the WSGI application (`threads`
+    threads) with their native async counterparts served by the ASGI
+    application (`concurrency` requests in flight on one event loop), for
+    the book list, book detail and purchase endpoints. Both applications
+    are called directly, as a server would, without sockets.
+    """
+    endpoints = {
+        'list': ('books_api:books-list-create', 'books_api:async-books-list', 'get', False),
+        'detail': ('books_api:books-detail', 'books_api:async-books-detail', 'get', True),
+        'purchase': ('books_api:book-buy-api', 'books_api:async-book-buy', 'post', True),
+    }
+    results = {'threads': threads, 'concurrency': concurrency, 'wsgi': {}, 'asgi': {}}
+    for name, (sync_name, async_name, method, by_book) in endpoints.items():
+        args = [[rng.choice(book_ids)] if by_book else [] for _ in range(requests)]
+        data = {'quantity': 1} if method == 'post' else {}
+
+        def request(url):
+            return lambda client: getattr(client, method)(url, data)
+
+        results['wsgi'][name] = run_concurrently(
+            [request(reverse(sync_name, args=a)) for a in args], threads, WSGIServerClient
+        )
+        results['asgi'][name] = run_concurrently_async(
+            [request(reverse(async_name, args=a)) for a in args], concurrency
+        )
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=settings.BASE_DIR, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scenarios, books, purchases, threads, events, feed_requests,
+                   feed_pages, chunk_size, concurrency=64, shards=8, seed=0, log=None):
+    """
+    Seed a synthetic catalog and run the requested scenarios ('purchase',
+    'hot', 'restock', 'events', 'asgi'). `events` is a list of event history sizes: for
+    each one, that many due events are executed and the events feed is
+    measured against the grown history. Returns a JSON-serializable dict.
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    log(f'Seeding {books} books')
+    book_ids = seed_catalog(books)
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'started_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'books': books,
+            'threads': threads,
+            'concurrency': concurrency,
+            'shards': shards,
+            'seed': seed,
+        },
+        'scenarios': {},
+    }
+
+    if 'purchase' in scenarios:
+        log(f'Purchase: {purchases} requests over {threads} threads')
+        results['scenarios']['purchase'] = bench_purchase(book_ids, purchases, threads, rng)
+
+    if 'hot' in scenarios:
+        log(f'Hot title: {purchases} requests on one book over {threads} threads, '
+            f'single counter then {shards} shards')
+        results['scenarios']['hot'] = bench_hot_title(book_ids, purchases, threads, shards)
+
+    if 'asgi' in scenarios:
+        log(f'ASGI: {purchases} requests per endpoint, WSGI over {threads} threads, '
+            f'ASGI with {concurrency} in flight')
+        results['scenarios']['asgi'] = bench_asgi(book_ids, purchases, threads, concurrency, rng)
+
+    history = 0
+    for size in events if {'restock', 'events'} & set(scenarios) else ():
+        log(f'Restock: executing {size} due events')
+        restock = bench_restock(book_ids, size, chunk_size, rng)
+        history += restock['events']
+        if 'restock' in scenarios:
+            results['scenarios'][f'restock_{size}'] = restock
+        if 'events' in scenarios:
+            log(f'Events feed: {feed_requests} requests, {history} executed events')
+            results['scenarios'][f'events_feed_{history}'] = {
+                'history': history,
+                **bench_events_feed(feed_requests, threads, feed_pages),
+            }
+    return results
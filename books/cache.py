@@ -0,0 +1,178 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Every key below is namespaced with the version token it depends on, so
+# invalidating a book or the whole catalog only means replacing a token:
+# stale entries are never read again and simply expire.
+CATALOG_VERSION_KEY = 'catalog:version'
+BOOK_VERSION_KEY = 'catalog:book:{pk}:version'
+HITS_KEY = 'catalog:stats:hits'
+MISSES_KEY = 'catalog:stats:misses'
+# Write-behind stock counters (see books.purchase_queue)
+STOCK_COUNTER_KEY = 'purchases:stock:{pk}'
+
+
+def _new_token():
+    return uuid.uuid4().hex[:16]
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = _new_token()
+        if not cache.add(key, version, None):
+            # Another process created the token first: use theirs
+            version = cache.get(key) or version
+    return version
+
+
+async def _aget_version(key):
+    version = await cache.aget(key)
+    if version is None:
+        version = _new_token()
+        if not await cache.aadd(key, version, None):
+            version = await cache.aget(key) or version
+    return version
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+async def _acount(key):
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        if not await cache.aadd(key, 1, None):
+            await cache.aincr(key)
+
+
+def invalidate_books(pks):
+    """
+    Invalidate the cached representations of the given books and every
+    cached catalog list, with a single cache round trip.
+    """
+    versions = {BOOK_VERSION_KEY.format(pk=pk): _new_token() for pk in pks}
+    versions[CATALOG_VERSION_KEY] = _new_token()
+    cache.set_many(versions, None)
+
+
+def invalidate_books_on_commit(pks):
+    """
+    Invalidate the given books once the current transaction commits, so
+    that no reader can cache the old rows under the new version.
+    """
+    pks = list(pks)
+    if not pks:
+        return
+    transaction.on_commit(lambda: invalidate_books(pks))
+
+
+def evict_stock_counters(pks):
+    """
+    Drop the write-behind stock counters of the given books, to be
+    reloaded from the database by their next purchase. Needed when their
+    stock changes outside the purchase queue (restocks, edits, direct
+    purchases); the queue's own flushes keep the counters right.
+    """
+    if settings.PURCHASE_WRITE_BEHIND:
+        cache.delete_many([STOCK_COUNTER_KEY.format(pk=pk) for pk in pks])
+
+
+def evict_stock_counters_on_commit(pks):
+    """
+    Evict the given books' stock counters once the current transaction
+    commits: a counter reloaded before that reads the old stock.
+    """
+    pks = list(pks)
+    if pks and settings.PURCHASE_WRITE_BEHIND:
+        transaction.on_commit(lambda: evict_stock_counters(pks))
+
+
+def list_cache_key(request):
+    """
+    Cache key of a catalog list response: the catalog version plus a hash
+    of the full URL (path, query parameters and host, which appears in the
+    pagination links).
+    """
+    url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+    return f'catalog:list:{_get_version(CATALOG_VERSION_KEY)}:{url}'
+
+
+def book_cache_key(pk):
+    """
+    Cache key of a single book representation.
+    """
+    return f'catalog:book:{pk}:{_get_version(BOOK_VERSION_KEY.format(pk=pk))}'
+
+
+async def alist_cache_key(request):
+    """
+    Async version of list_cache_key().
+    """
+    url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+    return f'catalog:list:{await _aget_version(CATALOG_VERSION_KEY)}:{url}'
+
+
+async def abook_cache_key(pk):
+    """
+    Async version of book_cache_key().
+    """
+    return f'catalog:book:{pk}:{await _aget_version(BOOK_VERSION_KEY.format(pk=pk))}'
+
+
+def get_or_compute(key, compute, counted=True):
+    """
+    Read-through helper: return the cached value for `key`, or compute,
+    store and return it. Hits and misses are counted unless `counted` is
+    False.
+    """
+    value = cache.get(key)
+    if value is not None:
+        if counted:
+            _count(HITS_KEY)
+        return value
+    if counted:
+        _count(MISSES_KEY)
+    value = compute()
+    cache.set(key, value, settings.CATALOG_CACHE_TIMEOUT)
+    return value
+
+
+async def aget_or_compute(key, compute, counted=True):
+    """
+    Async version of get_or_compute(): `compute` is a coroutine function.
+    """
+    value = await cache.aget(key)
+    if value is not None:
+        if counted:
+            await _acount(HITS_KEY)
+        return value
+    if counted:
+        await _acount(MISSES_KEY)
+    value = await compute()
+    await cache.aset(key, value, settings.CATALOG_CACHE_TIMEOUT)
+    return value
+
+
+def cache_stats():
+    """
+    Return the catalog cache hit and miss counters and the hit rate.
+    """
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = counters.get(HITS_KEY, 0)
+    misses = counters.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else None,
+    }
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+# Idempotency-Key support for the purchase endpoints. The first request
+# carrying a key claims it in the 'idempotency' cache and, once answered,
+# stores its response there for IDEMPOTENCY_TTL seconds: a retry with the
+# same key gets that response back without running the view, and a
+# duplicate arriving while the first request runs waits for its answer.
+IN_PROGRESS = 'in-progress'
+MAX_KEY_LENGTH = 255
+# A claim outlives any request (see the server timeout) but not a crashed
+# worker for long: the key can then be used again
+CLAIM_TIMEOUT = 60
+POLL_INTERVAL = 0.05
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+
+
+def _cache_key(user, path, key):
+    # Keys are chosen by clients: scope them to the user and the URL
+    user = user.pk if user.is_authenticated else 'anonymous'
+    return 'key:' + hashlib.sha256(f'{user}:{path}:{key}'.encode()).hexdigest()
+
+
+def _error(detail, status):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+def _replay(entry):
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers'].items():
+        response[header] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _invalid_key(key):
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return _error(f'Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters long.', 400)
+    return None
+
+
+def _answer(entry, fingerprint, deadline):
+    """
+    The response to a duplicate of the request holding `entry`, or None
+    while it is still running and may be waited for.
+    """
+    if entry['fingerprint'] != fingerprint:
+        return _error('This Idempotency-Key was already used for a different request.', 422)
+    if entry['status'] != IN_PROGRESS:
+        return _replay(entry)
+    if time.monotonic() >= deadline:
+        response = _error('A request with this Idempotency-Key is still in progress.', 409)
+        response['Retry-After'] = '1'
+        return response
+    return None
+
+
+def _stored(response, fingerprint):
+    """
+    The entry replaying `response`, or None when it is not an answer worth
+    keeping (a server error, a stream) and the client should retry.
+    """
+    if response.status_code >= 500 or response.streaming:
+        return None
+    return {
+        'status': response.status_code,
+        'fingerprint': fingerprint,
+        'headers': {header: response[header] for header in REPLAYED_HEADERS if response.has_header(header)},
+        'content': response.content,
+    }
+
+
+def idempotent(view):
+    """
+    Make a POST view idempotent for requests carrying an Idempotency-Key
+    header: the response to the first request with a given key (unless a
+    server error) is replayed to every later request with the same key and
+    body, while a different body gets 422. A duplicate of a request still
+    running waits up to IDEMPOTENCY_WAIT seconds for its response, then
+    gets 409. Requests without the header are not affected. Async views
+    get an async wrapper using the cache's async API.
+    """
+    if iscoroutinefunction(view):
+        return _async_idempotent(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if request.method != 'POST' or key is None:
+            return view(request, *args, **kwargs)
+        invalid = _invalid_key(key)
+        if invalid:
+            return invalid
+
+        store = caches['idempotency']
+        cache_key = _cache_key(request.user, request.path, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        while not store.add(cache_key, {'status': IN_PROGRESS, 'fingerprint': fingerprint}, CLAIM_TIMEOUT):
+            entry = store.get(cache_key)
+            if entry is None:
+                # Released or expired meanwhile: claim it again
+                continue
+            answer = _answer(entry, fingerprint, deadline)
+            if answer:
+                return answer
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+        except BaseException:
+            store.delete(cache_key)
+            raise
+        entry = _stored(response, fingerprint)
+        if entry is None:
+            store.delete(cache_key)
+        else:
+            store.set(cache_key, entry, settings.IDEMPOTENCY_TTL)
+        return response
+
+    return wrapper
+
+
+def _async_idempotent(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if request.method != 'POST' or key is None:
+            return await view(request, *args, **kwargs)
+        invalid = _invalid_key(key)
+        if invalid:
+            return invalid
+
+        store = caches['idempotency']
+        cache_key = _cache_key(await request.auser(), request.path, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        while not await store.aadd(
+            cache_key, {'status': IN_PROGRESS, 'fingerprint': fingerprint}, CLAIM_TIMEOUT
+        ):
+            entry = await store.aget(cache_key)
+            if entry is None:
+                continue
+            answer = _answer(entry, fingerprint, deadline)
+            if answer:
+                return answer
+            await asyncio.sleep(POLL_INTERVAL)
+
+        try:
+            response = await view(request, *args, **kwargs)
+        except BaseException:
+            await store.adelete(cache_key)
+            raise
+        entry = _stored(response, fingerprint)
+        if entry is None:
+            await store.adelete(cache_key)
+        else:
+            await store.aset(cache_key, entry, settings.IDEMPOTENCY_TTL)
+        return response
+
+    return wrapper
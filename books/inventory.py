@@ -0,0 +1,210 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import evict_stock_counters_on_commit, invalidate_books_on_commit
+from .models import Book
+from .restock import schedule_restock, schedule_restocks
+from .shards import decrement_shards
+
+# Per-line outcomes of a batch purchase
+PURCHASED = 'purchased'
+INSUFFICIENT_STOCK = 'insufficient_stock'
+NOT_FOUND = 'not_found'
+CANCELLED = 'cancelled'
+
+
+class InsufficientStock(Exception):
+    """
+    Raised when a purchase asks for more units than the book has in stock.
+    """
+
+
+def decrement_stock(book_id, quantity):
+    """
+    Atomically subtract `quantity` from the stock of a book if, and only if,
+    enough units are available.
+
+    Runs a single conditional UPDATE (stock = stock - q WHERE stock >= q),
+    so concurrent buyers never oversell and no row is read and rewritten
+    from Python. Sharded books are left alone by that UPDATE, without
+    waiting for their row, and served by books.shards.decrement_shards;
+    the same statement reports whether the book is sharded, so a plain
+    book out of stock costs that one query.
+    Returns a partially loaded Book (id, title, stock) with the new total
+    stock, or None when the book is missing or out of stock.
+    """
+    book_table = connection.ops.quote_name(Book._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"WITH updated AS (UPDATE {book_table} SET stock = stock - %s, updated_at = %s "
+            f"WHERE id = %s AND stock >= %s AND stock_shards = 0 RETURNING title, stock) "
+            f"SELECT updated.title, updated.stock, b.stock_shards FROM {book_table} AS b "
+            f"LEFT JOIN updated ON true WHERE b.id = %s",
+            [quantity, timezone.now(), book_id, quantity, book_id],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    title, stock, shards = row
+    if title is None:
+        if not shards:
+            return None
+        row = decrement_shards(book_id, quantity)
+        if row is None:
+            return None
+        title, stock = row
+    else:
+        invalidate_books_on_commit([book_id])
+    return Book.from_db(connection.alias, ['id', 'title', 'stock'], [book_id, title, stock])
+
+
+def purchase_book(book_id, quantity):
+    """
+    Sell `quantity` units of a book and schedule their restock.
+
+    The stock decrement and the event insert run in one short transaction;
+    the book row is only locked between the UPDATE and the COMMIT.
+    Returns (book, restock_event). Raises Book.DoesNotExist for an unknown
+    book and InsufficientStock when there are not enough units.
+    """
+    with transaction.atomic():
+        book = decrement_stock(book_id, quantity)
+        if book is not None:
+            # Bought past the write-behind counter, if any
+            evict_stock_counters_on_commit([book_id])
+            return book, schedule_restock(book, quantity)
+
+    if not Book.objects.filter(pk=book_id).exists():
+        raise Book.DoesNotExist
+    raise InsufficientStock
+
+
+def _decrement_stocks(totals, sharded=()):
+    """
+    Set-based variant of decrement_stock: subtract every {book_id: quantity}
+    in `totals` with a single UPDATE ... FROM (VALUES ...), skipping books
+    without enough stock. The `sharded` books are decremented one by one
+    with books.shards.decrement_shards. Returns {book_id: new_stock} for
+    updated books.
+    """
+    book_table = connection.ops.quote_name(Book._meta.db_table)
+    values = ', '.join(['(%s, %s)'] * len(totals))
+    params = [timezone.now()]
+    for book_id, quantity in totals.items():
+        params += [book_id, quantity]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {book_table} AS b SET stock = b.stock - v.quantity, updated_at = %s "
+            f"FROM (VALUES {values}) AS v(id, quantity) "
+            f"WHERE b.id = v.id AND b.stock >= v.quantity AND b.stock_shards = 0 "
+            f"RETURNING b.id, b.stock",
+            params,
+        )
+        remaining = dict(cursor.fetchall())
+    invalidate_books_on_commit(remaining)
+    for book_id in sorted(sharded):
+        row = decrement_shards(book_id, totals[book_id])
+        if row is not None:
+            remaining[book_id] = row[1]
+    return remaining
+
+
+def _fill_lines(lines, books):
+    """
+    Partial fulfilment for purchase_lines(): with the `books` ({book_id:
+    (stock, stock_shards)}) locked, take each book's lines in order while
+    its stock lasts, so that a line too many does not cancel the lines that
+    fit. Plain books are then decremented with one set-based UPDATE,
+    sharded books line by line. Returns (whether each line was filled,
+    {book_id: new_stock}).
+    """
+    available = {book_id: stock for book_id, (stock, shards) in books.items() if not shards}
+    totals = defaultdict(int)
+    remaining = {}
+    filled = []
+    for book_id, quantity in lines:
+        if book_id in available:
+            ok = quantity <= available[book_id]
+            if ok:
+                available[book_id] -= quantity
+                totals[book_id] += quantity
+        elif book_id in books:
+            row = decrement_shards(book_id, quantity)
+            ok = row is not None
+            if ok:
+                remaining[book_id] = row[1]
+        else:
+            ok = False
+        filled.append(ok)
+    if totals:
+        remaining.update(_decrement_stocks(totals))
+    return filled, remaining
+
+
+def purchase_lines(lines, partial=False, queued=False):
+    """
+    Sell several (book_id, quantity) lines at once and schedule their
+    restocks.
+
+    Quantities are summed per book and checked and decremented with
+    set-based statements, then the restock events of the purchased lines
+    are inserted with one bulk INSERT. By default the order is
+    all-or-nothing: if any book is unknown or lacks stock nothing is sold
+    and the other lines are reported as cancelled. With `partial=True`
+    every line is filled on its own, in order, while its book's stock
+    lasts (see _fill_lines). `queued` lines are write-behind orders
+    already reserved on the books' stock counters, which are then kept
+    (see books.purchase_queue); other purchases evict them.
+
+    Returns one result dict per line, in input order.
+    """
+    totals = defaultdict(int)
+    for book_id, quantity in lines:
+        totals[book_id] += quantity
+
+    with transaction.atomic():
+        # Lock the books in primary key order so overlapping orders cannot
+        # deadlock; this also tells unknown books from sold-out ones.
+        books = {
+            pk: (stock, shards) for pk, stock, shards in
+            Book.objects.select_for_update()
+            .filter(pk__in=totals)
+            .order_by('pk')
+            .values_list('pk', 'stock', 'stock_shards')
+        }
+        sold_out = set()
+        if partial:
+            filled, remaining = _fill_lines(lines, books)
+        else:
+            sharded = [book_id for book_id, (_, shards) in books.items() if shards]
+            remaining = _decrement_stocks(totals, sharded) if books else {}
+            sold_out = books.keys() - remaining.keys()
+            filled = [book_id in remaining for book_id, _ in lines]
+        if not partial and not all(filled):
+            transaction.set_rollback(True)
+            filled = [False] * len(lines)
+            events = iter(())
+        else:
+            events = iter(schedule_restocks([line for line, ok in zip(lines, filled) if ok]))
+            if not queued:
+                evict_stock_counters_on_commit(remaining)
+
+    results = []
+    for (book_id, quantity), ok in zip(lines, filled):
+        result = {'book': book_id, 'quantity': quantity}
+        if ok:
+            result.update(
+                status=PURCHASED,
+                remaining_stock=remaining[book_id],
+                restock_event=next(events),
+            )
+        elif book_id not in books:
+            result['status'] = NOT_FOUND
+        elif partial or book_id in sold_out:
+            result['status'] = INSUFFICIENT_STOCK
+        else:
+            result['status'] = CANCELLED
+        results.append(result)
+    return results
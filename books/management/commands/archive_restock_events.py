@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from books.archive import archive_executed_events
+
+
+class Command(BaseCommand):
+    help = "Roll executed restock events up into per-book daily summaries."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.RESTOCK_RETENTION_DAYS,
+            help="Archive events executed more than this many days ago.",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.RESTOCK_BATCH_SIZE,
+            help="Events archived per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        archived = archive_executed_events(options['days'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} restock events."))
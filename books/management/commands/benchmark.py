@@ -0,0 +1,101 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from books.benchmark import run_benchmarks
+
+SCENARIOS = ('purchase', 'hot', 'restock', 'events', 'asgi')
+
+
+def _sizes(value):
+    try:
+        sizes = [int(size) for size in value.split(',')]
+    except ValueError:
+        sizes = None
+    if not sizes or min(sizes) < 1:
+        raise CommandError(f"Invalid event counts: {value!r}")
+    return sizes
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the purchase API, the restock executor, the events feed and "
+        "the async (ASGI) endpoints against a synthetic catalog, and print the "
+        "results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', action='append', choices=SCENARIOS, dest='scenarios',
+            help="Scenario to run (repeatable, default: all).",
+        )
+        parser.add_argument('--books', type=int, default=1000, help="Books in the synthetic catalog.")
+        parser.add_argument('--purchases', type=int, default=1000, help="Purchase requests to send.")
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent client threads.")
+        parser.add_argument(
+            '--concurrency', type=int, default=64,
+            help="Requests in flight on the event loop for the ASGI scenario.",
+        )
+        parser.add_argument(
+            '--shards', type=int, default=8,
+            help="Stock shards of the sharded title in the hot scenario.",
+        )
+        parser.add_argument(
+            '--events', default='10000,100000',
+            help="Comma separated restock event counts, e.g. 10000,100000,1000000. "
+                 "Each count is executed in turn, growing the event history.",
+        )
+        parser.add_argument('--feed-requests', type=int, default=200, help="Events feed requests per history size.")
+        parser.add_argument('--feed-pages', type=int, default=10, help="Executed feed pages walked per request.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.RESTOCK_BATCH_SIZE,
+            help="Restock events applied per transaction.",
+        )
+        parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+        parser.add_argument(
+            '--use-existing-database', action='store_true',
+            help="Seed and run against the configured database instead of a "
+                 "throwaway test database. The synthetic data is left behind.",
+        )
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['concurrency'] < 1 or options['shards'] < 1:
+            raise CommandError("--threads, --concurrency and --shards must be at least 1.")
+        events = _sizes(options['events'])
+        log = lambda message: self.stderr.write(message)
+        throwaway = not options['use_existing_database']
+        if throwaway:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # Requests are sent through Django's test client
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                results = run_benchmarks(
+                    scenarios=options['scenarios'] or SCENARIOS,
+                    books=options['books'],
+                    purchases=options['purchases'],
+                    threads=options['threads'],
+                    concurrency=options['concurrency'],
+                    shards=options['shards'],
+                    events=events,
+                    feed_requests=options['feed_requests'],
+                    feed_pages=options['feed_pages'],
+                    chunk_size=options['chunk_size'],
+                    seed=options['seed'],
+                    log=log,
+                )
+        finally:
+            if throwaway:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from books.summary import check_summaries
+
+
+class Command(BaseCommand):
+    help = "Verify the per-book inventory summaries against the restock events."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help="Rewrite the summaries that drifted instead of failing.",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Books checked per query.",
+        )
+
+    def handle(self, *args, **options):
+        drifted = check_summaries(rebuild=options['rebuild'], chunk_size=options['chunk_size'])
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("Inventory summaries are up to date."))
+        elif options['rebuild']:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(drifted)} inventory summaries."))
+        else:
+            raise CommandError(
+                f"{len(drifted)} inventory summaries drifted (books {', '.join(map(str, drifted[:20]))}). "
+                f"Run with --rebuild to fix them."
+            )
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from books.purchase_queue import flush_purchases, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the queued write-behind purchases to the database, and optionally "
+        "check the stock counters against it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.PURCHASE_FLUSH_BATCH_SIZE,
+            help="Orders applied per transaction.",
+        )
+        parser.add_argument(
+            '--reconcile', action='store_true',
+            help="Then drop the stock counters that differ from the database.",
+        )
+
+    def handle(self, *args, **options):
+        applied = flush_purchases(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Applied {applied} queued purchases."))
+        if options['reconcile']:
+            drifted = reconcile_counters()
+            self.stdout.write(self.style.SUCCESS(
+                f"Reloading {len(drifted)} stock counters."
+                + (f" (books {', '.join(map(str, drifted[:20]))})" if drifted else "")
+            ))
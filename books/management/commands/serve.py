@@ -0,0 +1,100 @@
+import glob
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def cpu_count():
+    """
+    CPUs available to this process (honours affinity / container cpusets).
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the production server: gunicorn (WSGI) or uvicorn (ASGI) with "
+        "workers sized to the CPU count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--asgi', action='store_true',
+            help="Serve the ASGI application with uvicorn instead of the WSGI one with gunicorn.",
+        )
+        parser.add_argument('--bind', default='0.0.0.0:8000', help="host:port to listen on.")
+        parser.add_argument(
+            '--workers', type=int,
+            help="Worker processes (default: 2 x CPUs + 1 for WSGI, one per CPU for ASGI).",
+        )
+        parser.add_argument(
+            '--threads', type=int, default=1,
+            help="Threads per WSGI worker (more than one uses gunicorn's gthread workers).",
+        )
+        parser.add_argument('--timeout', type=int, default=30, help="Worker timeout in seconds (WSGI).")
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Print the server command line instead of running it.",
+        )
+
+    def handle(self, *args, **options):
+        host, _, port = options['bind'].rpartition(':')
+        if not host or not port.isdigit():
+            raise CommandError(f"Invalid --bind address: {options['bind']!r}")
+        workers = options['workers'] or (cpu_count() if options['asgi'] else 2 * cpu_count() + 1)
+        if workers < 1 or options['threads'] < 1:
+            raise CommandError("--workers and --threads must be at least 1.")
+
+        if options['asgi']:
+            argv = [
+                'uvicorn', 'bookstore_manager.asgi:application',
+                '--host', host, '--port', port, '--workers', str(workers),
+                '--proxy-headers',
+            ]
+        else:
+            argv = [
+                'gunicorn', 'bookstore_manager.wsgi:application',
+                '--config', 'python:bookstore_manager.gunicorn_conf',
+                '--bind', options['bind'], '--workers', str(workers),
+                '--threads', str(options['threads']), '--timeout', str(options['timeout']),
+                '--access-logfile', '-',
+            ]
+        env = self.environment(options['asgi'], workers)
+
+        if options['dry_run']:
+            self.stdout.write(' '.join([*(f'{key}={value}' for key, value in env.items()), *argv]))
+            return
+
+        metrics_dir = env.get('PROMETHEUS_MULTIPROC_DIR')
+        if metrics_dir:
+            # Start from empty metrics: the files of previous runs are stale
+            os.makedirs(metrics_dir, exist_ok=True)
+            for path in glob.glob(os.path.join(metrics_dir, '*.db')):
+                os.remove(path)
+        self.stderr.write(f"Starting {argv[0]} with {workers} workers on {options['bind']}")
+        os.environ.update(env)
+        os.execvp(argv[0], argv)
+
+    def environment(self, asgi, workers):
+        """
+        Environment variables to set for the server processes.
+        """
+        env = {}
+        if asgi and not settings.DB_POOL_MAX_SIZE:
+            # Each ASGI request runs on its own thread: a persistent
+            # connection would never be reused. Set DB_POOL_MAX_SIZE to pool them.
+            env['DB_CONN_MAX_AGE'] = '0'
+            self.stderr.write(self.style.WARNING(
+                "Serving ASGI without DB_POOL_MAX_SIZE: one database connection per request."
+            ))
+        if workers > 1:
+            # Aggregate the metrics of every worker on /metrics
+            env['PROMETHEUS_MULTIPROC_DIR'] = os.environ.get(
+                'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'bookstore-metrics')
+            )
+        return env
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from books.models import Book
+from books.shards import shard_book
+
+
+class Command(BaseCommand):
+    help = (
+        "Split the stock of hot books across several counter rows so that "
+        "concurrent purchases do not queue on one row (--shards 0 merges them back)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='+', type=int, help="Books to (un)shard.")
+        parser.add_argument(
+            '--shards', type=int, default=8,
+            help="Stock shards per book, 0 for a single counter.",
+        )
+
+    def handle(self, *args, **options):
+        if not 0 <= options['shards'] <= 256:
+            raise CommandError("--shards must be between 0 and 256.")
+        for book_id in options['book_ids']:
+            try:
+                book = shard_book(book_id, options['shards'])
+            except Book.DoesNotExist:
+                raise CommandError(f"Book {book_id} does not exist.")
+            mode = f"{book.stock_shards} shards" if book.stock_shards else "a single counter"
+            self.stdout.write(self.style.SUCCESS(f"“{book.title}” now uses {mode}."))
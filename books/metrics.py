@@ -0,0 +1,266 @@
+import hmac
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import timezone
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Requests are labelled with the resolved URL name (e.g. 'books_api:events-list'),
+# never with the raw path, to keep the number of series bounded.
+UNRESOLVED = '<unresolved>'
+
+REQUESTS = Counter(
+    'bookstore_http_requests_total',
+    'HTTP requests by URL name, method and status code.',
+    ['view', 'method', 'status'],
+)
+REQUEST_DURATION = Histogram(
+    'bookstore_http_request_duration_seconds',
+    'Time spent handling a request, by URL name and method.',
+    ['view', 'method'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    'bookstore_http_request_queries',
+    'SQL queries executed per request, by URL name.',
+    ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+REQUEST_DB_DURATION = Histogram(
+    'bookstore_http_request_db_duration_seconds',
+    'Time spent in SQL queries per request, by URL name.',
+    ['view'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+
+# Restock executor, recorded by the process running it (see books.telemetry)
+RESTOCK_RUNS = Counter(
+    'bookstore_restock_runs_total',
+    'Runs of the restock executor, by task.',
+    ['task'],
+)
+RESTOCK_RUN_FAILURES = Counter(
+    'bookstore_restock_run_failures_total',
+    'Runs of the restock executor stopped by an error, by task and exception.',
+    ['task', 'exception'],
+)
+RESTOCK_EVENTS = Counter(
+    'bookstore_restock_events_processed_total',
+    'Restock events executed, by task.',
+    ['task'],
+)
+RESTOCK_RUN_DURATION = Histogram(
+    'bookstore_restock_run_duration_seconds',
+    'Duration of a run of the restock executor, by task.',
+    ['task'],
+    buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900),
+)
+RESTOCK_BATCH_SIZE = Histogram(
+    'bookstore_restock_batch_size',
+    'Restock events executed per transaction.',
+    buckets=(1, 5, 10, 50, 100, 250, 500, 1000, 5000),
+)
+RESTOCK_LAG = Histogram(
+    'bookstore_restock_lag_seconds',
+    'Delay between the scheduled time of a restock event and its execution.',
+    buckets=(.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600, 21600, 86400),
+)
+
+
+class RestockBacklogCollector:
+    """
+    Restock executor health, read from the database at scrape time so that
+    any web process reports it: the due events still pending, the age of
+    the oldest one, and when each executor task last ran. The figures are
+    kept METRICS_CACHE_TIMEOUT seconds in the default cache, so frequent
+    or concurrent scrapes query the database once per interval.
+    """
+    cache_key = 'metrics:restock'
+
+    def describe(self):
+        return self._families()
+
+    def collect(self):
+        backlog, oldest, last_run, last_lag = self._families()
+        figures = cache.get_or_set(self.cache_key, self._figures, settings.METRICS_CACHE_TIMEOUT)
+        now = timezone.now()
+        backlog.add_metric([], figures['backlog'])
+        oldest_at = figures['oldest_at']
+        oldest.add_metric([], max((now - oldest_at).total_seconds(), 0) if oldest_at else 0)
+        for task, (ended, lag_max) in figures['runs'].items():
+            last_run.add_metric([task], ended)
+            last_lag.add_metric([task], lag_max)
+        return [backlog, oldest, last_run, last_lag]
+
+    def _figures(self):
+        from .models import RestockRun
+        from .telemetry import restock_backlog
+
+        count, oldest_at = restock_backlog()
+        runs = {}
+        for task, _ in RestockRun.TASK_CHOICES:
+            run = RestockRun.objects.filter(task=task).order_by('-started_at', '-id').first()
+            if run:
+                runs[task] = (run.started_at.timestamp() + run.duration, run.lag_max or 0)
+        return {'backlog': count, 'oldest_at': oldest_at, 'runs': runs}
+
+    def _families(self):
+        return [
+            GaugeMetricFamily(
+                'bookstore_restock_backlog', 'Due restock events not executed yet.'
+            ),
+            GaugeMetricFamily(
+                'bookstore_restock_oldest_overdue_seconds',
+                'Age of the oldest due restock event not executed yet (0 when none).',
+            ),
+            GaugeMetricFamily(
+                'bookstore_restock_last_run_timestamp_seconds',
+                'End time of the last run of the restock executor, by task.', labels=['task'],
+            ),
+            GaugeMetricFamily(
+                'bookstore_restock_last_run_lag_max_seconds',
+                'Largest scheduling lag of the last run of the restock executor, by task.',
+                labels=['task'],
+            ),
+        ]
+
+
+REGISTRY.register(RestockBacklogCollector())
+
+
+class QueryTimer:
+    """
+    Counts the queries of a request and the time spent in them. Unlike
+    connection.queries it needs no DEBUG and keeps no SQL around.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+# Timer of the request being handled. A context variable rather than a
+# per-request execute_wrapper: under ASGI the queries run on another
+# thread, with another connection, than the middleware, but in a copy of
+# its context.
+_request_timer = ContextVar('request_timer', default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every database connection: reports the
+    query to the current request's QueryTimer, if any.
+    """
+    timer = _request_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record the duration, SQL query count and SQL time of every request
+    per resolved URL name. With METRICS_DEBUG_HEADERS the figures are also
+    returned to the client in a Server-Timing header. Runs natively under
+    both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        token = _request_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timer.reset(token)
+        return self.record(request, response, time.perf_counter() - started, timer)
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        token = _request_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timer.reset(token)
+        return self.record(request, response, time.perf_counter() - started, timer)
+
+    def record(self, request, response, duration, timer):
+        match = request.resolver_match
+        view = match.view_name if match and match.view_name else UNRESOLVED
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        REQUEST_DURATION.labels(view, request.method).observe(duration)
+        REQUEST_QUERIES.labels(view).observe(timer.count)
+        REQUEST_DB_DURATION.labels(view).observe(timer.duration)
+
+        if settings.METRICS_DEBUG_HEADERS:
+            response['Server-Timing'] = (
+                f'app;dur={duration * 1000:.2f}, '
+                f'db;dur={timer.duration * 1000:.2f};desc="{timer.count} queries"'
+            )
+        return response
+
+
+def _may_scrape(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode()):
+            return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def metrics_view(request):
+    """
+    GET /metrics -> the request and restock metrics in Prometheus text
+    format, for staff users and for scrapers sending METRICS_TOKEN as a
+    bearer token. When PROMETHEUS_MULTIPROC_DIR is set (several server or
+    worker processes), the figures of every process are aggregated.
+    """
+    if not _may_scrape(request):
+        return HttpResponseForbidden()
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(RestockBacklogCollector())
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
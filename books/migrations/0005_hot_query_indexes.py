@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_restockevent_quantity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', 'id'], name='book_author_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restockevent',
+            index=models.Index(condition=models.Q(('executed', False)), fields=['scheduled_for', 'id'], name='restock_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restockevent',
+            index=models.Index(condition=models.Q(('executed', True)), fields=['-executed_at', '-id'], name='restock_executed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restockevent',
+            index=models.Index(fields=['book', 'executed'], name='restock_book_executed_idx'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:13
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The search vector is maintained by a trigger so that every write path
+# (ORM saves, bulk updates, raw SQL) keeps it in sync with title/author.
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}title, '')), 'A') ||
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}author, '')), 'B')
+"""
+
+CREATE_TRIGGER_SQL = f"""
+CREATE FUNCTION books_book_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR_SQL.format(row='NEW.')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER books_book_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, author ON books_book
+    FOR EACH ROW EXECUTE FUNCTION books_book_search_vector_update();
+
+UPDATE books_book SET search_vector = {SEARCH_VECTOR_SQL.format(row='')};
+
+CREATE INDEX book_search_vector_idx ON books_book USING gin (search_vector);
+"""
+
+DROP_TRIGGER_SQL = """
+DROP INDEX IF EXISTS book_search_vector_idx;
+DROP TRIGGER IF EXISTS books_book_search_vector_trigger ON books_book;
+DROP FUNCTION IF EXISTS books_book_search_vector_update();
+"""
+
+# pg_trgm powers typo-tolerant matching; it is optional, as not every
+# PostgreSQL installation ships the contrib extensions.
+CREATE_TRIGRAM_SQL = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX book_title_trgm_idx ON books_book USING gin (title gin_trgm_ops);
+CREATE INDEX book_author_trgm_idx ON books_book USING gin (author gin_trgm_ops);
+"""
+
+DROP_TRIGRAM_SQL = """
+DROP INDEX IF EXISTS book_title_trgm_idx;
+DROP INDEX IF EXISTS book_author_trgm_idx;
+"""
+
+
+def create_search_objects(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_TRIGGER_SQL)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone():
+            schema_editor.execute(CREATE_TRIGRAM_SQL)
+
+
+def drop_search_objects(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_TRIGRAM_SQL)
+    schema_editor.execute(DROP_TRIGGER_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='book',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_objects, drop_search_objects),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_restockorderline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestockDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('events', models.PositiveIntegerField(default=0)),
+                ('quantity', models.PositiveBigIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='restock_summaries', to='books.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-day', '-id'], name='restock_summary_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'day'), name='restock_summary_book_day_uniq')],
+            },
+        ),
+    ]
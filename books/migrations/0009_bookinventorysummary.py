@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+BACKFILL_SQL = """
+INSERT INTO books_bookinventorysummary
+    (book_id, pending_quantity, next_restock_at, last_restocked_at, updated_at)
+SELECT b.id,
+       COALESCE(SUM(e.quantity) FILTER (WHERE NOT e.executed), 0),
+       MIN(e.scheduled_for) FILTER (WHERE NOT e.executed),
+       MAX(e.executed_at) FILTER (WHERE e.executed),
+       CURRENT_TIMESTAMP
+FROM books_book AS b
+LEFT JOIN books_restockevent AS e ON e.book_id = b.id
+GROUP BY b.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_restockdailysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookInventorySummary',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='inventory', serialize=False, to='books.book')),
+                ('pending_quantity', models.PositiveBigIntegerField(default=0)),
+                ('next_restock_at', models.DateTimeField(blank=True, null=True)),
+                ('last_restocked_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='restockevent',
+            name='restock_book_executed_idx',
+        ),
+        migrations.AddIndex(
+            model_name='restockevent',
+            index=models.Index(condition=models.Q(('executed', False)), fields=['book', 'scheduled_for'], name='restock_book_pending_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
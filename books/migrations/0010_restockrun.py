@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_bookinventorysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestockRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(choices=[('sweep', 'Periodic sweep'), ('wakeup', 'ETA wake-up')], max_length=20)),
+                ('started_at', models.DateTimeField()),
+                ('duration', models.FloatField(default=0)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('chunks', models.PositiveIntegerField(default=0)),
+                ('lag_max', models.FloatField(blank=True, null=True)),
+                ('lag_total', models.FloatField(default=0)),
+                ('backlog', models.PositiveIntegerField(default=0)),
+                ('oldest_overdue_at', models.DateTimeField(blank=True, null=True)),
+                ('wakeups', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-started_at', '-id'], name='restock_run_started_idx')],
+            },
+        ),
+    ]
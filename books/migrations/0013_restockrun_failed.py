@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_purchasequeuecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restockrun',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,4 +1,28 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+class BookQuerySet(models.QuerySet):
+    def with_shard_totals(self):
+        """
+        Annotate the stock, pending restock quantity and last update held by
+        the shards of sharded books (see StockShard), in the same query.
+        """
+        def shards(aggregate):
+            return Subquery(
+                StockShard.objects.filter(book=OuterRef('pk'))
+                .order_by().values('book').annotate(value=aggregate).values('value')
+            )
+
+        return self.annotate(
+            shard_stock=Coalesce(shards(Sum('stock')), 0),
+            shard_pending=Coalesce(shards(Sum('pending_quantity')), 0),
+            shard_updated_at=shards(Max('updated_at')),
+        )
+
 
 class Book(models.Model):
     """
@@ -9,12 +33,60 @@ class Book(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
+    # Number of StockShard rows holding the stock (0: the stock is the
+    # `stock` column above, which then stays at 0). See books.shards.
+    stock_shards = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Weighted title/author tsvector, maintained by a database trigger
+    # (see migration 0006) and used by books.api.filters.BookSearchFilter
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # BookListCreateAPIView: filter on author, ordered by id
+            models.Index(fields=['author', 'id'], name='book_author_id_idx'),
+            # Full-text search on title and author
+            GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.author}"
 
+    def shard_totals(self):
+        """
+        Return (stock, pending restock quantity) summed over the shards of
+        the book, from the with_shard_totals() annotations when available.
+        """
+        if not self.stock_shards:
+            return 0, 0
+        if getattr(self, 'shard_stock', None) is None:
+            totals = self.shards.aggregate(
+                stock=Coalesce(Sum('stock'), 0), pending=Coalesce(Sum('pending_quantity'), 0)
+            )
+            self.shard_stock, self.shard_pending = totals['stock'], totals['pending']
+        return self.shard_stock, self.shard_pending
+
+    @property
+    def available_stock(self):
+        """
+        Units in stock, whether held by the book row or by its shards.
+        """
+        return self.stock + self.shard_totals()[0]
+
+    @property
+    def pending_restock_quantity(self):
+        """
+        Units ordered and not restocked yet (inventory summary plus shards).
+        """
+        try:
+            pending = self.inventory.pending_quantity
+        except BookInventorySummary.DoesNotExist:
+            pending = 0
+        return pending + self.shard_totals()[1]
+
 
 class RestockEvent(models.Model):
     """
@@ -26,7 +98,153 @@ class RestockEvent(models.Model):
     executed = models.BooleanField(default=False)
     created_at = models.DateTimeField(null=True, blank=True)
     executed_at = models.DateTimeField(null=True, blank=True)
-    
+
+    class Meta:
+        indexes = [
+            # Due-event scan of the executor and the pending events feed
+            models.Index(
+                fields=['scheduled_for', 'id'],
+                condition=models.Q(executed=False),
+                name='restock_pending_idx',
+            ),
+            # Executed events feed, newest first
+            models.Index(
+                fields=['-executed_at', '-id'],
+                condition=models.Q(executed=True),
+                name='restock_executed_idx',
+            ),
+            # Pending events of one book, earliest first (BookDetailView and
+            # the next restock date of BookInventorySummary)
+            models.Index(
+                fields=['book', 'scheduled_for'],
+                condition=models.Q(executed=False),
+                name='restock_book_pending_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"Restock {self.quantity}x {self.book.title} scheduled for {self.scheduled_for}"
-    
\ No newline at end of file
+    
+
+class BookInventorySummary(models.Model):
+    """
+    Model holding denormalized restock figures of a book, maintained in the
+    same transaction as the events they summarize (see books.summary).
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='inventory')
+    pending_quantity = models.PositiveBigIntegerField(default=0)
+    next_restock_at = models.DateTimeField(null=True, blank=True)
+    last_restocked_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Inventory summary of {self.book_id}"
+
+
+class StockShard(models.Model):
+    """
+    Model holding one slice of the stock of a book in sharded-counter mode,
+    and the restock quantity ordered through it until the executor moves it
+    to the inventory summary (see books.shards).
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+    pending_quantity = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'shard'], name='stock_shard_book_shard_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Stock shard {self.shard} of {self.book_id}: {self.stock}"
+
+
+class RestockOrderLine(models.Model):
+    """
+    Model recording one order merged into a coalesced RestockEvent
+    (only written when RESTOCK_COALESCE_WINDOW is enabled).
+    """
+    event = models.ForeignKey(RestockEvent, on_delete=models.CASCADE, related_name='order_lines')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Order of {self.quantity} for restock event {self.event_id}"
+
+
+class RestockDailySummary(models.Model):
+    """
+    Model archiving executed restock events: one row per book and day of
+    execution (see books.archive).
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='restock_summaries')
+    day = models.DateField()
+    events = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'day'], name='restock_summary_book_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['-day', '-id'], name='restock_summary_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.events} restocks ({self.quantity}x) of {self.book_id} on {self.day}"
+
+
+class RestockRun(models.Model):
+    """
+    Model recording the telemetry of one run of the restock executor
+    (see books.telemetry).
+    """
+    TASK_SWEEP = 'sweep'
+    TASK_WAKEUP = 'wakeup'
+    TASK_CHOICES = [(TASK_SWEEP, 'Periodic sweep'), (TASK_WAKEUP, 'ETA wake-up')]
+
+    task = models.CharField(max_length=20, choices=TASK_CHOICES)
+    started_at = models.DateTimeField()
+    # Seconds
+    duration = models.FloatField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    chunks = models.PositiveIntegerField(default=0)
+    # Scheduling lag (executed_at - scheduled_for) of the processed events, in seconds
+    lag_max = models.FloatField(null=True, blank=True)
+    lag_total = models.FloatField(default=0)
+    # Due events still pending when the run finished, and the oldest one
+    backlog = models.PositiveIntegerField(default=0)
+    oldest_overdue_at = models.DateTimeField(null=True, blank=True)
+    wakeups = models.PositiveIntegerField(default=0)
+    # The run stopped on an error: the figures cover the chunks done before
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-started_at', '-id'], name='restock_run_started_idx'),
+        ]
+
+    @property
+    def lag_mean(self):
+        return self.lag_total / self.processed if self.processed else None
+
+    def __str__(self):
+        return f"Restock {self.task} at {self.started_at}: {self.processed} events"
+
+
+class PurchaseQueueCheckpoint(models.Model):
+    """
+    Model recording the last write-behind purchase order applied to the
+    database (see books.purchase_queue). It is advanced in the same
+    transaction as the orders, so replaying the queue never applies an
+    order twice.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    last_seq = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Purchase queue {self.name} flushed up to {self.last_seq}"
@@ -0,0 +1,269 @@
+import base64
+import json
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, LimitOffsetPagination, replace_query_param
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a keyset cursor cannot be decoded.
+    """
+
+
+def encode_cursor(values):
+    """
+    Encode the ordering values of the last row of a page as an opaque cursor.
+    """
+    payload = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor, model, ordering):
+    """
+    Decode a cursor produced by encode_cursor back into Python values,
+    using the model fields named in `ordering`.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(payload, list) or len(payload) != len(ordering):
+            raise ValueError
+        return [
+            model._meta.get_field(name.lstrip('-')).to_python(value)
+            for name, value in zip(ordering, payload)
+        ]
+    except Exception as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the Q object selecting the rows strictly after `values` in
+    `ordering`, e.g. for ('scheduled_for', 'id'):
+
+        scheduled_for >= v0 AND (scheduled_for > v0 OR (scheduled_for = v0 AND id > v1))
+
+    The leading range condition lets the database seek straight into an
+    index on the first ordering column instead of scanning from the start.
+    """
+    names = [name.lstrip('-') for name in ordering]
+    after = Q()
+    for i, name in enumerate(ordering):
+        op = 'lt' if name.startswith('-') else 'gt'
+        after |= Q(**dict(zip(names[:i], values[:i])), **{f'{names[i]}__{op}': values[i]})
+    op = 'lte' if ordering[0].startswith('-') else 'gte'
+    return Q(**{f'{names[0]}__{op}': values[0]}) & after
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=50):
+    """
+    Return (items, next_cursor) for the page of `queryset` following
+    `cursor` in `ordering`. Only page_size + 1 rows are fetched, whatever
+    the depth of the page, and no COUNT(*) is run. Items are model
+    instances, or dicts for a values() queryset holding the ordering fields.
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, ordering)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    items = list(queryset[:page_size + 1])
+    if len(items) <= page_size:
+        return items, None
+    items = items[:page_size]
+    last = items[-1]
+    get = last.get if isinstance(last, dict) else lambda name: getattr(last, name)
+    return items, encode_cursor([get(name.lstrip('-')) for name in ordering])
+
+
+def cursor_url(request, param, cursor):
+    """
+    Return the current URL with the `param` query parameter set to `cursor`.
+    """
+    params = request.GET.copy()
+    params[param] = cursor
+    return f"{request.path}?{urlencode(sorted(params.items()))}"
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a composite key.
+
+    The ordering is taken from the view's `ordering` attribute and must end
+    with a unique column (usually the primary key), e.g.
+    ('scheduled_for', 'id'). Pages are fetched with a keyset condition
+    instead of OFFSET, so deep pages cost the same as the first one.
+    """
+    ordering = ('id',)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        ordering = getattr(view, 'ordering', None) or self.ordering
+        cursor = request.query_params.get(self.cursor_query_param)
+        try:
+            items, self.next_cursor = keyset_page(
+                queryset, ordering, cursor, self.get_page_size(request)
+            )
+        except InvalidCursor:
+            raise NotFound(self.invalid_cursor_message)
+        return items
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def estimate_count(queryset):
+    """
+    The query planner's estimate of the number of rows of `queryset`:
+    pg_class.reltuples for a whole table, the row estimate of EXPLAIN for
+    a filtered queryset. None on other databases or for a table that was
+    never analyzed.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPagination(LimitOffsetPagination):
+    """
+    LimitOffsetPagination for large tables.
+
+    Rows are counted up to API_COUNT_ESTIMATE_THRESHOLD only (a COUNT(*)
+    over a LIMITed subquery); beyond it `count` is the query planner's
+    estimate (see estimate_count()) and `count_estimated` is true. The
+    next link does not depend on the count: one extra row is fetched.
+
+    Views setting `keyset_ordering` (ending with a unique column, e.g.
+    ('id',)) also offer a keyset mode: ?cursor= (empty for the first page)
+    returns the rows in that order after the cursor, with next links
+    carrying the following cursor, so a deep page costs the same as the
+    first one instead of scanning `offset` rows. Only the first page is
+    counted (`count` is null on the following ones), and the keyset order
+    cannot be combined with a ranked ?search= (400).
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    cursor_with_search_message = 'Cannot be combined with search, whose results are ranked by relevance.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        keyset_ordering = getattr(view, 'keyset_ordering', None)
+        self.cursor = request.query_params.get(self.cursor_query_param) if keyset_ordering else None
+        if self.cursor is not None and getattr(view, 'search_fields', None) and request.query_params.get(
+            api_settings.SEARCH_PARAM
+        ):
+            raise ValidationError({self.cursor_query_param: self.cursor_with_search_message})
+        if self.cursor:
+            self.count = self.count_estimated = None
+        else:
+            self.count, self.count_estimated = self.get_count(queryset)
+
+        if self.cursor is not None:
+            try:
+                items, self.next_cursor = keyset_page(queryset, keyset_ordering, self.cursor or None, self.limit)
+            except InvalidCursor:
+                raise NotFound(self.invalid_cursor_message)
+            return items
+
+        self.offset = self.get_offset(request)
+        items = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(items) > self.limit
+        return items[:self.limit]
+
+    def get_count(self, queryset):
+        """
+        Return (count, whether it is estimated).
+        """
+        threshold = settings.API_COUNT_ESTIMATE_THRESHOLD
+        if not threshold:
+            return super().get_count(queryset), False
+        count = super().get_count(queryset[:threshold + 1])
+        if count <= threshold:
+            return count, False
+        estimate = estimate_count(queryset)
+        if estimate is None:
+            return super().get_count(queryset), False
+        return max(estimate, count), True
+
+    def get_next_link(self):
+        url = self.request.build_absolute_uri()
+        if self.cursor is not None:
+            return self.next_cursor and replace_query_param(url, self.cursor_query_param, self.next_cursor)
+        if not self.has_next:
+            return None
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_previous_link(self):
+        if self.cursor is not None:
+            return None
+        return super().get_previous_link()
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'count_estimated': self.count_estimated,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count']['nullable'] = True
+        response_schema['properties']['count_estimated'] = {'type': 'boolean', 'nullable': True, 'example': False}
+        return response_schema
@@ -0,0 +1,262 @@
+import logging
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache import STOCK_COUNTER_KEY, evict_stock_counters
+from .inventory import PURCHASED, InsufficientStock, purchase_lines
+from .models import Book, PurchaseQueueCheckpoint
+
+logger = logging.getLogger(__name__)
+
+# Write-behind purchases (PURCHASE_WRITE_BEHIND). A purchase is answered
+# from a stock counter kept in the cache and appended to a queue of
+# numbered orders, also in the cache; flush_purchases() applies the queue
+# to the database in group commits and records the last order applied in
+# the same transaction (PurchaseQueueCheckpoint), so a flush interrupted
+# at any point is simply replayed.
+#
+# An order is queued *before* its stock is reserved: a counter loaded
+# from the database meanwhile (stock minus the orders not applied yet)
+# then counts it, and can only be too low, never too high.
+SEQ_KEY = 'purchases:seq'
+ORDER_KEY = 'purchases:order:{seq}'
+STALLED_KEY = 'purchases:stalled:{seq}'
+FLUSH_LOCK_KEY = 'purchases:flush:lock'
+CHECKPOINT = 'purchases'
+
+# Order statuses
+PENDING = 'pending'
+ACCEPTED = 'accepted'
+REJECTED = 'rejected'
+FAILED = 'failed'
+
+# An order still pending after this many seconds belongs to a request
+# that died while reserving: the flush skips it
+ORDER_GRACE_SECONDS = 30
+# Orders the database could not apply are kept this long for inspection
+FAILED_ORDER_TIMEOUT = 7 * 86400
+SCAN_CHUNK_SIZE = 1000
+
+
+class QueueOutOfSync(Exception):
+    """
+    Raised by the flush when the order numbers in the cache are behind the
+    checkpoint in the database, i.e. the cache lost the queue's state.
+    """
+
+
+def _next_seq():
+    # A lost counter restarts after the last order applied, never below
+    # it: orders numbered at or below the checkpoint would never be flushed
+    try:
+        return cache.incr(SEQ_KEY)
+    except ValueError:
+        cache.add(SEQ_KEY, _checkpoint(), None)
+        return cache.incr(SEQ_KEY)
+
+
+def _checkpoint():
+    return (
+        PurchaseQueueCheckpoint.objects.filter(name=CHECKPOINT)
+        .values_list('last_seq', flat=True).first() or 0
+    )
+
+
+def queued_orders(start, end):
+    """
+    Return {seq: order} for the orders numbered `start` to `end` (included)
+    still in the queue.
+    """
+    orders = {}
+    for first in range(start, end + 1, SCAN_CHUNK_SIZE):
+        keys = {
+            ORDER_KEY.format(seq=seq): seq
+            for seq in range(first, min(first + SCAN_CHUNK_SIZE, end + 1))
+        }
+        orders.update((keys[key], order) for key, order in cache.get_many(keys).items())
+    return orders
+
+
+def unflushed_quantities(exclude=None):
+    """
+    Return {book_id: quantity} of the queued orders not applied to the
+    database yet that hold, or may still get, a reservation.
+    """
+    totals = defaultdict(int)
+    for seq, order in queued_orders(_checkpoint() + 1, cache.get(SEQ_KEY) or 0).items():
+        if seq != exclude and order['status'] in (PENDING, ACCEPTED):
+            totals[order['book']] += order['quantity']
+    return totals
+
+
+def _load_counter(book_id, seq):
+    # The queue is read before the stock: an order applied in between is
+    # then subtracted twice, which errs on the safe side
+    unflushed = unflushed_quantities(exclude=seq).get(book_id, 0)
+    book = Book.objects.with_shard_totals().only('stock', 'stock_shards').get(pk=book_id)
+    cache.add(STOCK_COUNTER_KEY.format(pk=book_id), book.available_stock - unflushed, None)
+
+
+def _reserve(book_id, quantity, seq):
+    key = STOCK_COUNTER_KEY.format(pk=book_id)
+    while True:
+        try:
+            remaining = cache.decr(key, quantity)
+            break
+        except ValueError:
+            # No counter yet, or the stock changed in the database
+            _load_counter(book_id, seq)
+    if remaining < 0:
+        try:
+            cache.incr(key, quantity)
+        except ValueError:
+            pass
+        return None
+    return remaining
+
+
+def reserve_purchase(book_id, quantity):
+    """
+    Accept the purchase of `quantity` units of a book without writing to
+    the database: queue the order and reserve its units on the book's
+    stock counter (loaded from the database when missing). Returns (order
+    number, remaining stock). Raises Book.DoesNotExist for an unknown book
+    and InsufficientStock when there are not enough units.
+    """
+    order = {'book': book_id, 'quantity': quantity, 'status': PENDING, 'created_at': time.time()}
+    while True:
+        seq = _next_seq()
+        key = ORDER_KEY.format(seq=seq)
+        # Only a reseeded counter can hand out a number still in the queue:
+        # never overwrite that order, take the next number instead
+        if cache.add(key, order, None):
+            break
+    remaining = None
+    try:
+        remaining = _reserve(book_id, quantity, seq)
+    finally:
+        cache.set(key, {**order, 'status': REJECTED if remaining is None else ACCEPTED}, None)
+    if remaining is None:
+        raise InsufficientStock
+    return seq, remaining
+
+
+def _stalled_since(seq, now):
+    key = STALLED_KEY.format(seq=seq)
+    cache.add(key, now, ORDER_GRACE_SECONDS * 10)
+    return cache.get(key, now)
+
+
+def _flush_batch(batch_size, grace):
+    """
+    Apply the next `batch_size` queued orders in one transaction and
+    return (orders consumed, orders applied). Stops early at an order
+    whose request is still reserving.
+    """
+    checkpoint = _checkpoint()
+    seq_head = cache.get(SEQ_KEY)
+    if seq_head is not None and seq_head < checkpoint:
+        logger.critical(
+            "Purchase queue numbering (%s) is behind its checkpoint (%s): orders are being lost",
+            seq_head, checkpoint,
+        )
+        raise QueueOutOfSync(f"Order number {seq_head} is behind checkpoint {checkpoint}")
+    head = min(seq_head or 0, checkpoint + batch_size)
+    orders = queued_orders(checkpoint + 1, head)
+    now = time.time()
+
+    last, accepted = checkpoint, []
+    for seq in range(checkpoint + 1, head + 1):
+        order = orders.get(seq)
+        if order is None or order['status'] == PENDING:
+            # Numbered but not written yet, or not reserved yet
+            since = order['created_at'] if order else _stalled_since(seq, now)
+            if now - since < grace:
+                break
+            logger.warning("Skipping purchase order %s abandoned by its request", seq)
+        elif order['status'] == ACCEPTED:
+            accepted.append(seq)
+        last = seq
+    if last == checkpoint:
+        return 0, 0
+
+    lines = {seq: (orders[seq]['book'], orders[seq]['quantity']) for seq in accepted}
+    with transaction.atomic():
+        # Orders are filled one by one, oldest first, while stock lasts
+        results = dict(zip(
+            lines, purchase_lines(list(lines.values()), partial=True, queued=True) if lines else ()
+        ))
+        PurchaseQueueCheckpoint.objects.update_or_create(
+            name=CHECKPOINT, defaults={'last_seq': last}
+        )
+
+    # Only possible if the stock was lowered in the database behind the
+    # counters' back: the order was confirmed to the client but not applied
+    failed = {seq for seq, result in results.items() if result['status'] != PURCHASED}
+    for seq in sorted(failed):
+        logger.error("Queued purchase order %s could not be applied: %s", seq, orders[seq])
+    cache.set_many(
+        {ORDER_KEY.format(seq=seq): {**orders[seq], 'status': FAILED} for seq in failed},
+        FAILED_ORDER_TIMEOUT,
+    )
+    # Applied orders leave the counters right (the stock and the queue
+    # both lost them): only the counters of books with failed orders drifted
+    evict_stock_counters({orders[seq]['book'] for seq in failed})
+    cache.delete_many([
+        key for seq in range(checkpoint + 1, last + 1) if seq not in failed
+        for key in (ORDER_KEY.format(seq=seq), STALLED_KEY.format(seq=seq))
+    ])
+    return last - checkpoint, len(accepted) - len(failed)
+
+
+def flush_purchases(batch_size=None, grace=ORDER_GRACE_SECONDS):
+    """
+    Apply the queued orders to the database, oldest first, in group
+    commits of up to `batch_size` (PURCHASE_FLUSH_BATCH_SIZE) orders: one
+    purchase_lines() call (one multi-row stock UPDATE, one bulk INSERT of
+    restock events) and the checkpoint update per transaction. Returns the
+    number of orders applied. Flushes never run concurrently.
+    """
+    batch_size = int(batch_size or settings.PURCHASE_FLUSH_BATCH_SIZE)
+    if not cache.add(FLUSH_LOCK_KEY, 1, 300):
+        return 0
+    try:
+        applied = 0
+        while True:
+            consumed, batch_applied = _flush_batch(batch_size, grace)
+            applied += batch_applied
+            if consumed < batch_size:
+                return applied
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+
+
+def reconcile_counters(chunk_size=1000):
+    """
+    Compare every stock counter with the database (stock minus the orders
+    not applied yet) and drop the counters that differ, to be reloaded by
+    the next purchase. Returns the ids of those books. A counter with
+    purchases in flight can be reported too; dropping it is always safe.
+    """
+    unflushed = unflushed_quantities()
+    drifted = []
+    last_pk = 0
+    while True:
+        books = list(
+            Book.objects.with_shard_totals().only('stock', 'stock_shards')
+            .filter(pk__gt=last_pk).order_by('pk')[:chunk_size]
+        )
+        if not books:
+            return drifted
+        last_pk = books[-1].pk
+        keys = {STOCK_COUNTER_KEY.format(pk=book.pk): book for book in books}
+        stale = [
+            key for key, counter in cache.get_many(keys).items()
+            if counter != keys[key].available_stock - unflushed.get(keys[key].pk, 0)
+        ]
+        cache.delete_many(stale)
+        drifted += [keys[key].pk for key in stale]
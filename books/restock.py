@@ -0,0 +1,232 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import TruncSecond
+from django.utils import timezone
+
+from .cache import evict_stock_counters_on_commit, invalidate_books_on_commit
+from .models import Book, RestockEvent, RestockOrderLine
+from .shards import restock_shards
+from .summary import add_pending, apply_executed
+from .telemetry import record_chunk
+
+
+def schedule_restock(book, quantity, now=None):
+    """
+    Create the RestockEvent replenishing `quantity` units of `book`
+    after RESTOCK_DELAY_DAYS (or merge the order into a pending one, see
+    schedule_restocks).
+    """
+    event = schedule_restocks([(book.pk, quantity)], now)[0]
+    event.book = book
+    return event
+
+
+def schedule_restocks(items, now=None):
+    """
+    Schedule the restock of several (book_id, quantity) orders with a
+    constant number of queries and return their events in order.
+
+    By default every order gets its own RestockEvent. When
+    RESTOCK_COALESCE_WINDOW is set, orders are merged into the pending
+    event of their book scheduled within that many seconds before their
+    own delivery date, by atomically incrementing its quantity; each order
+    is then recorded as a RestockOrderLine.
+    """
+    now = now or timezone.now()
+    delay = int(settings.RESTOCK_DELAY_DAYS)
+    scheduled = now + timezone.timedelta(days=delay)
+    window = int(settings.RESTOCK_COALESCE_WINDOW)
+    totals = defaultdict(int)
+    for book_id, quantity in items:
+        totals[book_id] += quantity
+
+    if not window:
+        with transaction.atomic(savepoint=False):
+            events = RestockEvent.objects.bulk_create([
+                RestockEvent(book_id=book_id, scheduled_for=scheduled, quantity=quantity, created_at=now)
+                for book_id, quantity in items
+            ])
+            add_pending(totals, scheduled)
+            invalidate_books_on_commit(totals)
+        if events:
+            wake_up_on_commit(scheduled, now)
+        return events
+
+    with transaction.atomic(savepoint=False):
+        # Latest open event per book within the window. Events locked by
+        # the executor (or another order) are skipped rather than waited
+        # for: the order then simply opens a new event.
+        open_events = {}
+        for event in (
+            RestockEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                book_id__in=totals,
+                executed=False,
+                scheduled_for__gt=scheduled - timezone.timedelta(seconds=window),
+                scheduled_for__lte=scheduled,
+            )
+            .order_by('scheduled_for', 'id')
+        ):
+            open_events[event.book_id] = event
+
+        if open_events:
+            increment = Case(
+                *[When(pk=ev.pk, then=Value(totals[ev.book_id])) for ev in open_events.values()],
+                output_field=IntegerField(),
+            )
+            RestockEvent.objects.filter(pk__in=[ev.pk for ev in open_events.values()]).update(
+                quantity=F('quantity') + increment,
+            )
+            for event in open_events.values():
+                event.quantity += totals[event.book_id]
+
+        new_events = RestockEvent.objects.bulk_create([
+            RestockEvent(book_id=book_id, scheduled_for=scheduled, quantity=total, created_at=now)
+            for book_id, total in totals.items() if book_id not in open_events
+        ])
+        open_events.update((event.book_id, event) for event in new_events)
+
+        RestockOrderLine.objects.bulk_create([
+            RestockOrderLine(event=open_events[book_id], quantity=quantity, created_at=now)
+            for book_id, quantity in items
+        ])
+        add_pending(totals, scheduled)
+        invalidate_books_on_commit(totals)
+        if new_events:
+            wake_up_on_commit(scheduled, now)
+    return [open_events[book_id] for book_id, _ in items]
+
+
+def request_wakeup(due):
+    """
+    Enqueue an ETA task that drains the due events at `due`, rounded up to
+    the next second. Wake-ups are deduplicated per second through the
+    cache, so a burst of orders due at the same time costs one task.
+
+    Tasks are only a latency optimisation: executing events is idempotent,
+    so a task delivered twice is harmless, and a task lost by the broker
+    is made up for by the periodic sweep (process_restock_events).
+    """
+    from .tasks import execute_due_restock_events
+
+    due = due.replace(microsecond=0) + timezone.timedelta(seconds=1)
+    key = f'restock:wakeup:{int(due.timestamp())}'
+    if cache.add(key, 1, settings.RESTOCK_SWEEP_INTERVAL * 2):
+        execute_due_restock_events.apply_async(eta=due)
+
+
+def wake_up_on_commit(due, now=None):
+    """
+    Request a wake-up at `due` once the current transaction commits, if it
+    falls before the next sweep; later events are picked up by the sweep.
+    Broker errors are logged and never fail the committed transaction.
+    """
+    now = now or timezone.now()
+    if due - now <= timezone.timedelta(seconds=settings.RESTOCK_SWEEP_INTERVAL):
+        transaction.on_commit(lambda: request_wakeup(due), robust=True)
+
+
+def schedule_upcoming_wakeups(now=None):
+    """
+    Request a wake-up for every distinct second at which pending events
+    fall due before the next sweep. Returns the number of wake-ups.
+    """
+    now = now or timezone.now()
+    horizon = now + timezone.timedelta(seconds=settings.RESTOCK_SWEEP_INTERVAL)
+    dues = (
+        RestockEvent.objects
+        .filter(executed=False, scheduled_for__gt=now, scheduled_for__lte=horizon)
+        .annotate(due=TruncSecond('scheduled_for'))
+        .order_by('due')
+        .values_list('due', flat=True)
+        .distinct()
+    )
+    dues = list(dues)
+    for due in dues:
+        request_wakeup(due)
+    return len(dues)
+
+
+def execute_due_events(now=None, chunk_size=None, run=None):
+    """
+    Apply every pending RestockEvent due at `now` in bounded chunks and
+    return the number of events executed by this worker. Each chunk is
+    recorded in `run` (a RestockRun, see books.telemetry) when given.
+    """
+    now = now or timezone.now()
+    chunk_size = int(chunk_size or settings.RESTOCK_BATCH_SIZE)
+    processed = 0
+    while True:
+        lags = _execute_chunk(now, chunk_size)
+        processed += len(lags)
+        if run is not None and lags:
+            record_chunk(run, lags)
+        if len(lags) < chunk_size:
+            return processed
+
+
+def _execute_chunk(now, chunk_size):
+    """
+    Execute up to `chunk_size` due events in a single transaction:
+    one SELECT claiming the chunk, one stock UPDATE for all affected books
+    (plus the shards of sharded books, see books.shards), one UPDATE
+    marking the events as executed and one UPDATE of the books' inventory
+    summaries. Returns the scheduling lag (seconds between scheduled_for
+    and execution) of every executed event.
+
+    The chunk is claimed with SELECT ... FOR UPDATE SKIP LOCKED, so
+    concurrent workers pick disjoint sets of events and each event is
+    applied exactly once.
+    """
+    with transaction.atomic():
+        rows = list(
+            RestockEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(executed=False, scheduled_for__lte=now)
+            .order_by('scheduled_for', 'id')
+            .values_list('id', 'book_id', 'quantity', 'scheduled_for')[:chunk_size]
+        )
+        if not rows:
+            return []
+
+        # Sum quantities per book so each book is updated exactly once
+        totals = defaultdict(int)
+        for _, book_id, quantity, _ in rows:
+            totals[book_id] += quantity
+
+        # Lock the books in primary key order so that workers touching
+        # overlapping sets of books cannot deadlock on the stock UPDATE
+        sharded = {
+            book_id for book_id, shards in
+            Book.objects.select_for_update()
+            .filter(pk__in=totals)
+            .order_by('pk')
+            .values_list('pk', 'stock_shards')
+            if shards
+        }
+
+        executed_at = timezone.now()
+        increment = Case(
+            *[When(pk=book_id, then=Value(total)) for book_id, total in totals.items()
+              if book_id not in sharded],
+            output_field=IntegerField(),
+        )
+        if len(sharded) < len(totals):
+            Book.objects.filter(pk__in=totals.keys() - sharded).update(
+                stock=F('stock') + increment,
+                updated_at=executed_at,
+            )
+        restock_shards({book_id: totals[book_id] for book_id in sharded})
+        RestockEvent.objects.filter(pk__in=[row[0] for row in rows]).update(
+            executed=True,
+            executed_at=executed_at,
+        )
+        apply_executed(totals, executed_at)
+        invalidate_books_on_commit(totals)
+        evict_stock_counters_on_commit(totals)
+    return [(executed_at - scheduled_for).total_seconds() for *_, scheduled_for in rows]
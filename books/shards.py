@@ -0,0 +1,179 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .cache import evict_stock_counters_on_commit, invalidate_books_on_commit
+from .models import Book, BookInventorySummary, StockShard
+
+# Sharded-counter mode for hot titles. The stock of a sharded book is split
+# across `Book.stock_shards` StockShard rows (the book's own stock column
+# stays at 0), so concurrent purchases of the same title lock different
+# rows instead of queueing on one. The restock quantity ordered by a
+# purchase is recorded on a shard too, which keeps the inventory summary
+# row out of the purchase path; the restock executor moves it back.
+
+
+def spread(total, shards):
+    """
+    Split `total` units as evenly as possible over `shards` counters.
+    """
+    base, extra = divmod(total, shards)
+    return [base + (n < extra) for n in range(shards)]
+
+
+def _write_stock(stocks, **updates):
+    """
+    Set the stock of every {shard_pk: stock} with one UPDATE.
+    """
+    StockShard.objects.filter(pk__in=stocks).update(
+        stock=Case(*[When(pk=pk, then=Value(stock)) for pk, stock in stocks.items()],
+                   output_field=IntegerField()),
+        updated_at=timezone.now(),
+        **updates,
+    )
+
+
+def shard_book(book_id, shards):
+    """
+    Switch a book to sharded-counter mode with `shards` shards, or back to
+    a single counter with shards=0. The current stock is spread evenly over
+    the new shards and the restock quantities pending on the old ones are
+    moved to the inventory summary. Returns the book.
+    """
+    with transaction.atomic():
+        book = Book.objects.select_for_update().get(pk=book_id)
+        current = list(StockShard.objects.select_for_update().filter(book=book).order_by('shard'))
+        stock = book.stock + sum(shard.stock for shard in current)
+        pending = sum(shard.pending_quantity for shard in current)
+
+        # Sharded purchases only touch the summary to move next_restock_at
+        # (see books.summary.add_pending): it must exist beforehand
+        BookInventorySummary.objects.get_or_create(book=book)
+        if pending:
+            BookInventorySummary.objects.filter(book=book).update(
+                pending_quantity=F('pending_quantity') + pending, updated_at=timezone.now()
+            )
+        StockShard.objects.filter(book=book).delete()
+        StockShard.objects.bulk_create([
+            StockShard(book=book, shard=n, stock=units)
+            for n, units in enumerate(spread(stock, shards) if shards else ())
+        ])
+        book.stock = 0 if shards else stock
+        book.stock_shards = shards
+        book.save(update_fields=['stock', 'stock_shards', 'updated_at'])
+    return book
+
+
+def set_stock(book_id, stock):
+    """
+    Set the total stock of a sharded book, spread evenly over its shards.
+    """
+    with transaction.atomic():
+        pks = list(
+            StockShard.objects.select_for_update()
+            .filter(book_id=book_id).order_by('shard').values_list('pk', flat=True)
+        )
+        if pks:
+            _write_stock(dict(zip(pks, spread(stock, len(pks)))))
+        invalidate_books_on_commit([book_id])
+        evict_stock_counters_on_commit([book_id])
+
+
+def decrement_shards(book_id, quantity):
+    """
+    Subtract `quantity` units from a sharded book, in the current
+    transaction.
+
+    Takes them from a random shard holding enough units, preferring shards
+    no concurrent purchase has locked (SKIP LOCKED), then waiting for one.
+    When no single shard holds enough, every shard is locked, in order,
+    and the remaining total is spread evenly again. Returns (title,
+    remaining stock) or None when the book is missing, not sharded or out
+    of stock.
+    """
+    table = connection.ops.quote_name(StockShard._meta.db_table)
+    book_table = connection.ops.quote_name(Book._meta.db_table)
+    with connection.cursor() as cursor:
+        for lock in ('FOR UPDATE SKIP LOCKED', ''):
+            # A shard that changed while it was being locked stays locked
+            # even when it no longer holds enough units: release it before
+            # waiting for other shards, or two buyers could deadlock.
+            savepoint = transaction.savepoint()
+            cursor.execute(
+                f"UPDATE {table} SET stock = stock - %s, updated_at = %s WHERE id = ("
+                f"SELECT id FROM {table} WHERE book_id = %s AND stock >= %s "
+                f"ORDER BY random() LIMIT 1 {lock}) AND stock >= %s RETURNING id",
+                [quantity, timezone.now(), book_id, quantity, quantity],
+            )
+            if cursor.fetchone():
+                transaction.savepoint_commit(savepoint)
+                break
+            transaction.savepoint_rollback(savepoint)
+        else:
+            if not _rebalance(book_id, quantity):
+                return None
+        cursor.execute(
+            f"SELECT b.title, (SELECT COALESCE(SUM(s.stock), 0) FROM {table} AS s "
+            f"WHERE s.book_id = b.id) FROM {book_table} AS b WHERE b.id = %s",
+            [book_id],
+        )
+        row = cursor.fetchone()
+    invalidate_books_on_commit([book_id])
+    return row
+
+
+def _rebalance(book_id, quantity):
+    """
+    No shard holds `quantity` units on its own: lock every shard of the
+    book, take the units from their total and spread the rest evenly.
+    Returns False when the book as a whole lacks the units.
+    """
+    shards = dict(
+        StockShard.objects.select_for_update()
+        .filter(book_id=book_id).order_by('shard').values_list('pk', 'stock')
+    )
+    total = sum(shards.values())
+    if not shards or total < quantity:
+        return False
+    _write_stock(dict(zip(shards, spread(total - quantity, len(shards)))))
+    return True
+
+
+def restock_shards(totals):
+    """
+    Add {book_id: quantity} restocked units to sharded books, with their
+    book rows locked: each book's new total is spread evenly over its
+    shards, which rebalances them, and the restock quantities pending on
+    the shards are moved to the inventory summaries, ready for
+    books.summary.apply_executed().
+    """
+    if not totals:
+        return
+    shards = defaultdict(dict)
+    pending = defaultdict(int)
+    for pk, book_id, stock, quantity in (
+        StockShard.objects.select_for_update()
+        .filter(book_id__in=totals).order_by('book_id', 'shard')
+        .values_list('pk', 'book_id', 'stock', 'pending_quantity')
+    ):
+        shards[book_id][pk] = stock
+        pending[book_id] += quantity
+
+    stocks = {}
+    for book_id, book_shards in shards.items():
+        total = sum(book_shards.values()) + totals[book_id]
+        stocks.update(zip(book_shards, spread(total, len(book_shards))))
+    if stocks:
+        _write_stock(stocks, pending_quantity=0)
+
+    pending = {book_id: quantity for book_id, quantity in pending.items() if quantity}
+    if pending:
+        BookInventorySummary.objects.filter(book_id__in=pending).update(
+            pending_quantity=F('pending_quantity') + Case(
+                *[When(book_id=book_id, then=Value(quantity)) for book_id, quantity in pending.items()],
+                output_field=IntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import evict_stock_counters_on_commit, invalidate_books_on_commit
+from .models import Book, BookInventorySummary
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_cached_book(sender, instance, update_fields=None, **kwargs):
+    """
+    Drop the cached representations of a book when it is saved or deleted,
+    and its write-behind stock counter when its stock may have changed.
+    """
+    invalidate_books_on_commit([instance.pk])
+    if update_fields is None or 'stock' in update_fields:
+        evict_stock_counters_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Book)
+def create_inventory_summary(sender, instance, created, **kwargs):
+    """
+    Give every new book an (empty) inventory summary.
+    """
+    if created:
+        BookInventorySummary.objects.get_or_create(book=instance)
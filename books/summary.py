@@ -0,0 +1,148 @@
+from django.db import connection
+from django.db.models import Max, Min, Q, Sum
+from django.utils import timezone
+
+from .cache import invalidate_books_on_commit
+from .models import Book, BookInventorySummary, RestockEvent, StockShard
+
+SUMMARY_FIELDS = ('pending_quantity', 'next_restock_at', 'last_restocked_at')
+
+
+def _values(rows):
+    return ', '.join(['(' + ', '.join(['%s'] * len(rows[0])) + ')'] * len(rows))
+
+
+def add_pending(totals, scheduled):
+    """
+    Record newly scheduled restocks: add {book_id: quantity} to the pending
+    quantities and move next_restock_at back to `scheduled` if earlier.
+    One INSERT ... ON CONFLICT DO UPDATE, rows in book order so that
+    concurrent writers always lock summaries in the same order.
+
+    For sharded books the quantity goes to one of their shards not locked
+    by another transaction instead (see books.shards), touching the
+    shard's updated_at, and the summary is only updated, if it exists,
+    when next_restock_at moves: concurrent purchases of a hot title then
+    do not queue on its summary row.
+    """
+    if not totals:
+        return
+    now = timezone.now()
+    rows = [(book_id, quantity, scheduled, now) for book_id, quantity in sorted(totals.items())]
+    table = connection.ops.quote_name(BookInventorySummary._meta.db_table)
+    shards = connection.ops.quote_name(StockShard._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"WITH v (book_id, quantity, scheduled, now) AS (VALUES {_values(rows)}), "
+            f"picked AS MATERIALIZED (SELECT p.id, v.quantity, v.now FROM v CROSS JOIN LATERAL ("
+            f"SELECT id FROM {shards} WHERE book_id = v.book_id "
+            f"ORDER BY random() LIMIT 1 FOR UPDATE SKIP LOCKED) AS p), "
+            f"sharded AS (UPDATE {shards} AS sh SET pending_quantity = sh.pending_quantity + picked.quantity, "
+            f"updated_at = picked.now FROM picked WHERE sh.id = picked.id RETURNING sh.book_id), "
+            f"moved AS (UPDATE {table} AS s SET next_restock_at = v.scheduled, updated_at = v.now "
+            f"FROM v WHERE s.book_id = v.book_id AND s.book_id IN (SELECT book_id FROM sharded) "
+            f"AND (s.next_restock_at IS NULL OR s.next_restock_at > v.scheduled)) "
+            f"INSERT INTO {table} AS s (book_id, pending_quantity, next_restock_at, updated_at) "
+            f"SELECT * FROM v WHERE v.book_id NOT IN (SELECT book_id FROM sharded) "
+            f"ORDER BY v.book_id ON CONFLICT (book_id) DO UPDATE SET "
+            f"pending_quantity = s.pending_quantity + EXCLUDED.pending_quantity, "
+            f"next_restock_at = LEAST(s.next_restock_at, EXCLUDED.next_restock_at), "
+            f"updated_at = EXCLUDED.updated_at",
+            [value for row in rows for value in row],
+        )
+
+
+def apply_executed(totals, executed_at):
+    """
+    Record executed restocks: subtract {book_id: quantity} from the pending
+    quantities, set last_restocked_at and recompute next_restock_at from
+    the remaining pending events. Must run after the events are marked
+    executed, in the same transaction.
+    """
+    if not totals:
+        return
+    rows = sorted(totals.items())
+    table = connection.ops.quote_name(BookInventorySummary._meta.db_table)
+    events = connection.ops.quote_name(RestockEvent._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} AS s SET "
+            f"pending_quantity = GREATEST(s.pending_quantity - v.quantity, 0), "
+            f"last_restocked_at = %s, updated_at = %s, "
+            f"next_restock_at = (SELECT MIN(e.scheduled_for) FROM {events} AS e "
+            f"WHERE e.book_id = s.book_id AND NOT e.executed) "
+            f"FROM (VALUES {_values(rows)}) AS v(book_id, quantity) "
+            f"WHERE s.book_id = v.book_id",
+            [executed_at, timezone.now(), *[value for row in rows for value in row]],
+        )
+
+
+def compute_summaries(book_ids):
+    """
+    Aggregate the summary figures of the given books from their events.
+    Returns {book_id: (pending_quantity, next_restock_at, last_restocked_at)}.
+    last_restocked_at is None when every executed event has been archived.
+    """
+    pending = Q(restock_events__executed=False)
+    rows = (
+        Book.objects.filter(pk__in=book_ids)
+        .annotate(
+            pending_quantity=Sum('restock_events__quantity', filter=pending),
+            next_restock_at=Min('restock_events__scheduled_for', filter=pending),
+            last_restocked_at=Max('restock_events__executed_at', filter=Q(restock_events__executed=True)),
+        )
+        .values_list('pk', *SUMMARY_FIELDS)
+    )
+    return {pk: (quantity or 0, next_at, last_at) for pk, quantity, next_at, last_at in rows}
+
+
+def check_summaries(rebuild=False, chunk_size=1000):
+    """
+    Compare every stored summary with the figures aggregated from the
+    events, chunk by chunk, and return the ids of the books that drifted.
+    With `rebuild`, missing and drifted summaries are rewritten and the
+    books' cached representations invalidated. The
+    quantities pending on the shards of sharded books count as stored.
+    """
+    drifted = []
+    last_pk = 0
+    while True:
+        book_ids = list(
+            Book.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not book_ids:
+            return drifted
+        last_pk = book_ids[-1]
+
+        expected = compute_summaries(book_ids)
+        stored = {
+            s.book_id: s for s in BookInventorySummary.objects.filter(book_id__in=book_ids)
+        }
+        on_shards = dict(
+            StockShard.objects.filter(book_id__in=book_ids)
+            .values('book_id').annotate(pending=Sum('pending_quantity'))
+            .values_list('book_id', 'pending')
+        )
+        fixes = []
+        for book_id, (quantity, next_at, last_at) in expected.items():
+            summary = stored.get(book_id)
+            # Archived events no longer tell when the book was last restocked
+            last_at = last_at or (summary and summary.last_restocked_at)
+            current = summary and (
+                summary.pending_quantity + on_shards.get(book_id, 0),
+                summary.next_restock_at, summary.last_restocked_at,
+            )
+            if current == (quantity, next_at, last_at):
+                continue
+            drifted.append(book_id)
+            fixes.append(BookInventorySummary(
+                book_id=book_id, pending_quantity=max(quantity - on_shards.get(book_id, 0), 0),
+                next_restock_at=next_at, last_restocked_at=last_at,
+            ))
+        if rebuild and fixes:
+            BookInventorySummary.objects.bulk_create(
+                fixes, update_conflicts=True, unique_fields=['book'],
+                update_fields=[*SUMMARY_FIELDS, 'updated_at'],
+            )
+            # Cached payloads and validators still hold the drifted figures
+            invalidate_books_on_commit([fix.book_id for fix in fixes])
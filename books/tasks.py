@@ -1,22 +1,55 @@
 from celery import shared_task
-from django.utils import timezone
-from .models import RestockEvent
+from .archive import archive_executed_events
+from .models import RestockRun
+from .purchase_queue import flush_purchases
+from .restock import execute_due_events, schedule_upcoming_wakeups
+from .telemetry import prune_runs, restock_run
 
 @shared_task
 def process_restock_events():
     """
-    Look for all pending RestockEvent whose date has arrived,
-    increases the stock of the book, and marks the event as executed.
-    """
-    now = timezone.now()
-    events = RestockEvent.objects.filter(executed=False, scheduled_for__lte=now)
-    for ev in events:
-        # Restock
-        book = ev.book
-        book.stock += ev.quantity
-        book.save()
-        # Mark event as executed
-        ev.executed = True
-        ev.executed_at = now
-        ev.save(update_fields=['executed', 'executed_at'])
-    return f"Processed {events.count()} restock events."
+    Periodic safety net (every RESTOCK_SWEEP_INTERVAL seconds): look for
+    all pending RestockEvent whose date has arrived, increases the stock
+    of the book, and marks the event as executed. Then enqueue precise
+    wake-ups for the events falling due before the next sweep.
+    Events are applied in chunks of RESTOCK_BATCH_SIZE (see books.restock).
+    Each run is recorded as a RestockRun (see books.telemetry).
+    """
+    with restock_run(RestockRun.TASK_SWEEP) as run:
+        processed = execute_due_events(run=run)
+        run.wakeups = schedule_upcoming_wakeups()
+    return f"Processed {processed} restock events. Scheduled {run.wakeups} wake-ups."
+
+
+@shared_task
+def execute_due_restock_events():
+    """
+    ETA task enqueued for the moment restock events fall due: executes
+    every pending event whose date has arrived.
+    """
+    with restock_run(RestockRun.TASK_WAKEUP) as run:
+        processed = execute_due_events(run=run)
+    return f"Processed {processed} restock events."
+
+
+@shared_task
+def archive_restock_events():
+    """
+    Daily task: roll executed restock events older than
+    RESTOCK_RETENTION_DAYS up into per-book daily summaries, and drop the
+    executor runs recorded before that.
+    """
+    archived = archive_executed_events()
+    pruned = prune_runs()
+    return f"Archived {archived} restock events. Pruned {pruned} restock runs."
+
+
+@shared_task
+def flush_purchase_queue():
+    """
+    Periodic task (every PURCHASE_FLUSH_INTERVAL seconds when
+    PURCHASE_WRITE_BEHIND is on): apply the queued write-behind purchases
+    to the database in group commits.
+    """
+    applied = flush_purchases()
+    return f"Applied {applied} queued purchases."
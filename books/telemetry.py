@@ -0,0 +1,88 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .metrics import (
+    RESTOCK_BATCH_SIZE,
+    RESTOCK_EVENTS,
+    RESTOCK_LAG,
+    RESTOCK_RUN_DURATION,
+    RESTOCK_RUN_FAILURES,
+    RESTOCK_RUNS,
+)
+from .models import RestockEvent, RestockRun
+
+logger = logging.getLogger(__name__)
+
+
+def restock_backlog(now=None):
+    """
+    Return the number of pending events due at `now` and the scheduled
+    time of the oldest one (None when the executor is up to date).
+    """
+    stats = RestockEvent.objects.filter(
+        executed=False, scheduled_for__lte=now or timezone.now()
+    ).aggregate(backlog=Count('id'), oldest=Min('scheduled_for'))
+    return stats['backlog'], stats['oldest']
+
+
+def record_chunk(run, lags):
+    """
+    Add a chunk of executed events, given by their scheduling lags in
+    seconds, to `run` and to the in-process metrics.
+    """
+    run.chunks += 1
+    run.processed += len(lags)
+    run.lag_total += sum(lags)
+    run.lag_max = max(run.lag_max or 0, *lags)
+    RESTOCK_BATCH_SIZE.observe(len(lags))
+    for lag in lags:
+        RESTOCK_LAG.observe(max(lag, 0))
+
+
+@contextmanager
+def restock_run(task):
+    """
+    Time a run of the restock executor. Yields a RestockRun to pass to
+    execute_due_events(); once the block exits, even on an error, the
+    remaining backlog is measured and the run is saved and exported. A
+    run stopped by an exception is saved as failed, counted in
+    RESTOCK_RUN_FAILURES, and the exception is re-raised.
+    """
+    run = RestockRun(task=task, started_at=timezone.now())
+    started = time.perf_counter()
+    try:
+        yield run
+    except Exception as exc:
+        run.failed = True
+        RESTOCK_RUN_FAILURES.labels(task, type(exc).__name__).inc()
+        raise
+    finally:
+        run.duration = time.perf_counter() - started
+        try:
+            run.backlog, run.oldest_overdue_at = restock_backlog()
+            run.save()
+        except DatabaseError:
+            # The database may be what failed the run: keep its error
+            if not run.failed:
+                raise
+            logger.exception("Could not record the failed %s run of the restock executor", task)
+        RESTOCK_RUNS.labels(task).inc()
+    RESTOCK_EVENTS.labels(task).inc(run.processed)
+    RESTOCK_RUN_DURATION.labels(task).observe(run.duration)
+
+
+def prune_runs(older_than_days=None, now=None):
+    """
+    Delete the runs started more than `older_than_days` (default
+    RESTOCK_RETENTION_DAYS) ago. Returns the number of runs deleted.
+    """
+    days = settings.RESTOCK_RETENTION_DAYS if older_than_days is None else older_than_days
+    cutoff = (now or timezone.now()) - timezone.timedelta(days=int(days))
+    deleted, _ = RestockRun.objects.filter(started_at__lt=cutoff).delete()
+    return deleted
@@ -1,10 +1,42 @@
-from django.test import TestCase, override_settings
+import io
+import json
+import threading
+import unittest
+from unittest import mock
+
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.auth.models import User
+from prometheus_client import REGISTRY
+from rest_framework.renderers import JSONRenderer
 
-from .models import Book, RestockEvent
-from .tasks import process_restock_events
+from .api.filters import trigram_available
+from .api.fastpath import BookRowSerializer, FastJSONRenderer, RestockEventRowSerializer
+from .api.serializers import BookSerializer, RestockEventSerializer
+from .archive import _add_to_summaries, archive_executed_events
+from .inventory import decrement_stock, purchase_book
+from .models import (
+    Book,
+    BookInventorySummary,
+    RestockDailySummary,
+    RestockEvent,
+    RestockOrderLine,
+    RestockRun,
+    PurchaseQueueCheckpoint,
+    StockShard,
+)
+from .purchase_queue import ORDER_KEY, SEQ_KEY, QueueOutOfSync, flush_purchases, reconcile_counters
+from .cache import STOCK_COUNTER_KEY
+from .restock import execute_due_events, request_wakeup, schedule_restock, schedule_upcoming_wakeups
+from .shards import shard_book
+from .summary import check_summaries
+from .tasks import execute_due_restock_events, process_restock_events
+from .telemetry import prune_runs
 
 
 @override_settings(RESTOCK_DELAY_DAYS="0")
@@ -22,6 +54,14 @@ class RestockLogicTests(TestCase):
             stock=5,
         )
 
+    def test_out_of_stock_plain_book_costs_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(decrement_stock(self.book.pk, 6))
+        with self.assertNumQueries(1):
+            self.assertIsNone(decrement_stock(self.book.pk + 1000, 1))
+        with self.assertNumQueries(1):
+            self.assertEqual(decrement_stock(self.book.pk, 5).stock, 0)
+
     def test_buy_stock_creates_event_without_reducing_stock(self):
         """
         POST to buy_stock should create a RestockEvent with the quantity and
@@ -78,6 +118,1057 @@ class RestockLogicTests(TestCase):
         self.assertIsNotNone(ev.executed_at)
         self.assertIn("Processed 1 restock events.", result)
 
+    def test_execute_due_events_in_chunks(self):
+        """
+        Due events are applied in chunks, quantities are summed per book and
+        events scheduled in the future are left untouched.
+        """
+        other = Book.objects.create(
+            title="Other Book", author="Other Author", price=3.00, stock=0
+        )
+        now = timezone.now()
+        for quantity in (1, 2, 3):
+            RestockEvent.objects.create(book=self.book, scheduled_for=now, quantity=quantity)
+        for quantity in (4, 5):
+            RestockEvent.objects.create(book=other, scheduled_for=now, quantity=quantity)
+        future = RestockEvent.objects.create(
+            book=self.book, scheduled_for=now + timezone.timedelta(days=1), quantity=100
+        )
+
+        processed = execute_due_events(now=now, chunk_size=2)
+
+        self.assertEqual(processed, 5)
+        self.book.refresh_from_db()
+        other.refresh_from_db()
+        future.refresh_from_db()
+        self.assertEqual(self.book.stock, 11)
+        self.assertEqual(other.stock, 9)
+        self.assertFalse(future.executed)
+        self.assertEqual(RestockEvent.objects.filter(executed=True).count(), 5)
+
+    def test_execute_due_events_query_count_is_independent_of_events(self):
+        """
+        A single chunk costs the same number of queries whatever its size.
+        """
+        now = timezone.now()
+        books = [
+            Book.objects.create(title=f"Book {i}", author="A", price=1.00, stock=0)
+            for i in range(10)
+        ]
+
+        def count_queries(events_per_book):
+            for book in books:
+                for _ in range(events_per_book):
+                    RestockEvent.objects.create(book=book, scheduled_for=now)
+            with CaptureQueriesContext(connection) as ctx:
+                execute_due_events(now=now, chunk_size=1000)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(1), count_queries(20))
+        self.assertEqual(sum(b.stock for b in Book.objects.filter(author="A")), 210)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "Query plans are PostgreSQL specific")
+class HotQueryIndexTests(TestCase):
+    """
+    Each hot query must be able to use its index. Sequential and bitmap
+    scans are disabled so that the planner picks the index scan even on
+    tiny test tables.
+    """
+
+    def setUp(self):
+        self.book = Book.objects.create(title="Plan", author="Planner", price=1.00)
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_bitmapscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        self.assertIn(index_name, queryset.explain())
+
+    def test_due_event_scan(self):
+        self.assertUsesIndex(
+            RestockEvent.objects.filter(executed=False, scheduled_for__lte=timezone.now())
+            .order_by("scheduled_for", "id").values_list("id", "book_id", "quantity")[:1000],
+            "restock_pending_idx",
+        )
+
+    def test_executed_feed(self):
+        self.assertUsesIndex(
+            RestockEvent.objects.filter(executed=True).order_by("-executed_at", "-id")[:10],
+            "restock_executed_idx",
+        )
+
+    def test_book_pending_events(self):
+        self.assertUsesIndex(
+            self.book.restock_events.filter(executed=False),
+            "restock_book_pending_idx",
+        )
+
+    def test_books_by_author(self):
+        self.assertUsesIndex(
+            Book.objects.filter(author="Planner").order_by("id")[:10],
+            "book_author_id_idx",
+        )
+
+
+class BookSearchAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.potter = Book.objects.create(
+            title="Harry Potter and the Philosopher's Stone", author="J. K. Rowling", price=10
+        )
+        self.dune = Book.objects.create(title="Dune", author="Frank Herbert", price=12)
+        self.about = Book.objects.create(
+            title="Reading Rowling", author="Harold Critic", price=8
+        )
+        self.url = reverse("books_api:books-list-create")
+
+    def search(self, term):
+        response = self.client.get(self.url, {"search": term})
+        self.assertEqual(response.status_code, 200)
+        return [book["id"] for book in response.json()["results"]]
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "Full-text search is PostgreSQL specific")
+    def test_search_vector_is_maintained_by_trigger(self):
+        self.dune.title = "Dune Messiah"
+        self.dune.save()
+        self.assertTrue(Book.objects.filter(search_vector="messiah").exists())
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "Full-text search is PostgreSQL specific")
+    def test_prefix_search_ranks_title_matches_first(self):
+        self.assertEqual(self.search("Harry Pott"), [self.potter.pk])
+        self.assertEqual(self.search("rowling"), [self.about.pk, self.potter.pk])
+        self.assertEqual(self.search("nothing"), [])
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "pg_trgm is PostgreSQL specific")
+    def test_search_tolerates_typos(self):
+        if not trigram_available():
+            self.skipTest("pg_trgm is not installed")
+        self.assertIn(self.potter.pk, self.search("Hary Poter"))
+
+    def test_fallback_search_on_other_databases(self):
+        with mock.patch.object(connection, "vendor", "sqlite"):
+            self.assertEqual(self.search("herb"), [self.dune.pk])
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title="Cached", author="A", price=4.50, stock=5)
+        self.list_url = reverse("books_api:books-list-create")
+        self.detail_url = reverse("books_api:books-detail", args=[self.book.pk])
+
+    def test_list_and_detail_are_served_from_cache(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        with self.assertNumQueries(0):
+            list_response = self.client.get(self.list_url)
+            detail_response = self.client.get(self.detail_url)
+        self.assertEqual(list_response.json()["results"][0]["title"], "Cached")
+        self.assertEqual(detail_response.json()["stock"], 5)
+
+    def test_former_route_names_reverse_to_the_cached_views(self):
+        self.assertEqual(reverse("books_api:books-list"), self.list_url)
+        self.assertEqual(reverse("books_api:books-detail-update-delete", args=[self.book.pk]), self.detail_url)
+
+    def test_query_parameters_are_part_of_the_key(self):
+        self.client.get(self.list_url, {"author": "A"})
+        response = self.client.get(self.list_url, {"author": "B"})
+        self.assertEqual(response.json()["results"], [])
+
+    def test_save_invalidates(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = "Renamed"
+            self.book.save()
+        self.assertEqual(self.client.get(self.list_url).json()["results"][0]["title"], "Renamed")
+        self.assertEqual(self.client.get(self.detail_url).json()["title"], "Renamed")
+
+    def test_purchase_and_restock_invalidate(self):
+        self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("book-buy-api", args=[self.book.pk]), {"quantity": 2},
+                content_type="application/json",
+            )
+        self.assertEqual(self.client.get(self.detail_url).json()["stock"], 3)
+
+        RestockEvent.objects.update(scheduled_for=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_due_events()
+        self.assertEqual(self.client.get(self.detail_url).json()["stock"], 5)
+
+    def test_delete_invalidates(self):
+        self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.delete()
+        self.assertEqual(self.client.get(self.detail_url).status_code, 404)
+
+    def test_stats(self):
+        self.client.get(self.detail_url)
+        self.client.get(self.detail_url)
+        self.client.get(self.detail_url)
+        url = reverse("books_api:cache-stats")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        admin = User.objects.create_superuser("admin", password="pass")
+        self.client.force_login(admin)
+        self.assertEqual(
+            self.client.get(url).json(), {"hits": 2, "misses": 1, "hit_rate": 2 / 3}
+        )
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title="Etag", author="A", price=1.00, stock=1)
+        self.list_url = reverse("books_api:books-list-create")
+        self.detail_url = reverse("books_api:books-detail", args=[self.book.pk])
+
+    def test_detail_not_modified_skips_serializer(self):
+        response = self.client.get(self.detail_url)
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+        cache.clear()
+        with mock.patch.object(BookSerializer, "to_representation") as to_representation:
+            with self.assertNumQueries(1):
+                response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        to_representation.assert_not_called()
+
+    def test_detail_if_modified_since(self):
+        response = self.client.get(self.detail_url)
+        response = self.client.get(
+            self.detail_url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_etag_changes_with_data_and_filters(self):
+        etag = self.client.get(self.list_url)["ETag"]
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.client.get(self.list_url, {"author": "B"})["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title="New", author="A", price=1.00)
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 2)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_unknown_book(self):
+        url = reverse("books_api:books-detail", args=[self.book.pk + 1000])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(RESTOCK_DELAY_DAYS="0", RESTOCK_SWEEP_INTERVAL=900)
+class RestockWakeupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title="Wake", author="A", price=1.00, stock=10)
+        patcher = mock.patch.object(execute_due_restock_events, "apply_async")
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def buy(self, quantity=1):
+        return self.client.post(
+            reverse("book-buy-api", args=[self.book.pk]), {"quantity": quantity},
+            content_type="application/json",
+        )
+
+    def test_purchase_enqueues_one_wakeup_per_second(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buy()
+        ev = RestockEvent.objects.get()
+        self.apply_async.assert_called_once()
+        eta = self.apply_async.call_args.kwargs["eta"]
+        self.assertGreaterEqual(eta, ev.scheduled_for)
+        self.assertLess(eta - ev.scheduled_for, timezone.timedelta(seconds=1))
+
+        request_wakeup(ev.scheduled_for)
+        self.apply_async.assert_called_once()
+
+    @override_settings(RESTOCK_DELAY_DAYS="3")
+    def test_far_events_are_left_to_the_sweep(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buy()
+        self.apply_async.assert_not_called()
+
+    def test_broker_errors_do_not_fail_the_purchase(self):
+        self.apply_async.side_effect = OSError("broker down")
+        with self.assertLogs(level="ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.buy()
+        self.assertEqual(response.status_code, 201)
+
+    def test_sweep_schedules_upcoming_wakeups(self):
+        now = timezone.now().replace(microsecond=0)
+        for offset in (10, 10, 300, 86400):
+            RestockEvent.objects.create(
+                book=self.book, scheduled_for=now + timezone.timedelta(seconds=offset)
+            )
+        self.assertEqual(schedule_upcoming_wakeups(now=now), 2)
+        etas = sorted(c.kwargs["eta"] for c in self.apply_async.call_args_list)
+        self.assertEqual(
+            etas,
+            [now + timezone.timedelta(seconds=11), now + timezone.timedelta(seconds=301)],
+        )
+
+    def test_wakeup_task_executes_due_events(self):
+        RestockEvent.objects.create(book=self.book, scheduled_for=timezone.now(), quantity=4)
+        self.assertEqual(execute_due_restock_events(), "Processed 1 restock events.")
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, 14)
+
+
+class RestockTelemetryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title="Watched", author="A", price=1.00, stock=0)
+        self.now = timezone.now()
+
+    def overdue(self, seconds, quantity=1):
+        return RestockEvent.objects.create(
+            book=self.book, quantity=quantity,
+            scheduled_for=self.now - timezone.timedelta(seconds=seconds),
+        )
+
+    @override_settings(RESTOCK_BATCH_SIZE=1)
+    def test_sweep_records_a_run(self):
+        self.overdue(60)
+        self.overdue(10)
+        lags = REGISTRY.get_sample_value("bookstore_restock_lag_seconds_count")
+        events = REGISTRY.get_sample_value(
+            "bookstore_restock_events_processed_total", {"task": "sweep"}
+        ) or 0
+
+        process_restock_events()
+
+        run = RestockRun.objects.get()
+        self.assertEqual((run.task, run.processed, run.chunks), (RestockRun.TASK_SWEEP, 2, 2))
+        self.assertGreaterEqual(run.lag_max, 60)
+        self.assertGreaterEqual(run.lag_mean, 35)
+        self.assertEqual((run.backlog, run.oldest_overdue_at), (0, None))
+        self.assertEqual(REGISTRY.get_sample_value("bookstore_restock_lag_seconds_count"), lags + 2)
+        self.assertEqual(
+            REGISTRY.get_sample_value("bookstore_restock_events_processed_total", {"task": "sweep"}),
+            events + 2,
+        )
+
+        results = self.client.get(reverse("books_api:events-runs"), {"task": "sweep"}).json()["results"]
+        self.assertEqual([r["processed"] for r in results], [2])
+
+    def test_failed_run_is_recorded(self):
+        self.overdue(60)
+        failures = REGISTRY.get_sample_value(
+            "bookstore_restock_run_failures_total", {"task": "sweep", "exception": "RuntimeError"}
+        ) or 0
+
+        with mock.patch("books.tasks.schedule_upcoming_wakeups", side_effect=RuntimeError("broker down")):
+            with self.assertRaises(RuntimeError):
+                process_restock_events()
+
+        run = RestockRun.objects.get()
+        self.assertTrue(run.failed)
+        self.assertEqual((run.processed, run.backlog), (1, 0))
+        self.assertGreater(run.duration, 0)
+        self.assertEqual(REGISTRY.get_sample_value(
+            "bookstore_restock_run_failures_total", {"task": "sweep", "exception": "RuntimeError"}
+        ), failures + 1)
+
+    def test_backlog_is_exported(self):
+        self.overdue(120)
+        self.overdue(30)
+        RestockEvent.objects.create(book=self.book, scheduled_for=self.now + timezone.timedelta(days=1))
+        execute_due_restock_events()
+        self.overdue(300)
+
+        self.assertEqual(REGISTRY.get_sample_value("bookstore_restock_backlog"), 1)
+        self.assertGreaterEqual(REGISTRY.get_sample_value("bookstore_restock_oldest_overdue_seconds"), 300)
+        self.assertIsNotNone(REGISTRY.get_sample_value(
+            "bookstore_restock_last_run_timestamp_seconds", {"task": "wakeup"}
+        ))
+        self.assertGreaterEqual(REGISTRY.get_sample_value(
+            "bookstore_restock_last_run_lag_max_seconds", {"task": "wakeup"}
+        ), 120)
+
+        # Scrapes within METRICS_CACHE_TIMEOUT reuse the figures
+        self.overdue(10)
+        with self.assertNumQueries(0):
+            self.assertEqual(REGISTRY.get_sample_value("bookstore_restock_backlog"), 1)
+        cache.clear()
+        self.assertEqual(REGISTRY.get_sample_value("bookstore_restock_backlog"), 2)
+
+    def test_old_runs_are_pruned(self):
+        for days_ago in (40, 1):
+            RestockRun.objects.create(
+                task=RestockRun.TASK_SWEEP, started_at=self.now - timezone.timedelta(days=days_ago)
+            )
+        self.assertEqual(prune_runs(30, now=self.now), 1)
+        self.assertEqual(RestockRun.objects.count(), 1)
+
+
+@override_settings(RESTOCK_DELAY_DAYS="1", RESTOCK_COALESCE_WINDOW=3600)
+class RestockCoalescingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coalescer", password="pass")
+        self.client.force_login(self.user)
+        self.book = Book.objects.create(title="Popular", author="A", price=1.00, stock=100)
+
+    def test_orders_are_merged_into_the_pending_event(self):
+        url = reverse("books:buy", args=[self.book.pk])
+        self.client.post(url, {"quantity": "2"})
+        self.client.post(url, {"quantity": "3"})
+        response = self.client.post(
+            reverse("book-buy-api", args=[self.book.pk]), {"quantity": 4},
+            content_type="application/json",
+        )
+        ev = RestockEvent.objects.get()
+        self.assertEqual(ev.quantity, 9)
+        self.assertEqual(response.json()["restock_event"]["quantity"], 9)
+        self.assertEqual(
+            sorted(ev.order_lines.values_list("quantity", flat=True)), [2, 3, 4]
+        )
+
+    def test_batch_orders_are_merged(self):
+        other = Book.objects.create(title="Other", author="A", price=1.00, stock=100)
+        lines = [
+            {"book": self.book.pk, "quantity": 1},
+            {"book": other.pk, "quantity": 2},
+            {"book": self.book.pk, "quantity": 3},
+        ]
+        url = reverse("books_api:book-buy-batch-api")
+        self.client.post(url, {"lines": lines}, content_type="application/json")
+        response = self.client.post(url, {"lines": lines}, content_type="application/json")
+        self.assertEqual(RestockEvent.objects.count(), 2)
+        self.assertEqual(RestockEvent.objects.get(book=self.book).quantity, 8)
+        self.assertEqual(RestockEvent.objects.get(book=other).quantity, 4)
+        self.assertEqual(RestockOrderLine.objects.count(), 6)
+        events = {line["restock_event"] for line in response.json()["lines"]}
+        self.assertEqual(len(events), 2)
+
+    def test_executed_and_out_of_window_events_are_not_merged(self):
+        now = timezone.now()
+        RestockEvent.objects.create(
+            book=self.book, scheduled_for=now + timezone.timedelta(days=1), executed=True
+        )
+        RestockEvent.objects.create(
+            book=self.book, scheduled_for=now + timezone.timedelta(hours=22)
+        )
+        self.client.post(reverse("books:buy", args=[self.book.pk]), {"quantity": "5"})
+        self.assertEqual(RestockEvent.objects.count(), 3)
+        self.assertEqual(RestockEvent.objects.latest("id").quantity, 5)
+
+
+@override_settings(RESTOCK_RETENTION_DAYS=30)
+class RestockArchiveTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title="Old", author="A", price=1.00)
+        self.other = Book.objects.create(title="Older", author="A", price=1.00)
+        self.now = timezone.now()
+
+    def executed(self, book, days_ago, quantity=1):
+        at = self.now - timezone.timedelta(days=days_ago)
+        return RestockEvent.objects.create(
+            book=book, scheduled_for=at, executed=True, executed_at=at, quantity=quantity
+        )
+
+    def test_old_events_are_rolled_up_and_removed(self):
+        for quantity in (1, 2, 3):
+            self.executed(self.book, 40, quantity)
+        self.executed(self.other, 40, 5)
+        self.executed(self.book, 41, 7)
+        recent = self.executed(self.book, 1)
+        pending = RestockEvent.objects.create(book=self.book, scheduled_for=self.now)
+
+        self.assertEqual(archive_executed_events(chunk_size=2, now=self.now), 5)
+
+        self.assertEqual(
+            set(RestockEvent.objects.values_list("id", flat=True)), {recent.pk, pending.pk}
+        )
+        summaries = {
+            (s.book_id, s.events, s.quantity) for s in RestockDailySummary.objects.all()
+        }
+        self.assertEqual(summaries, {(self.book.pk, 3, 6), (self.other.pk, 1, 5), (self.book.pk, 1, 7)})
+
+    def test_archiving_adds_to_existing_summaries(self):
+        self.executed(self.book, 40, 2)
+        archive_executed_events(now=self.now)
+        self.executed(self.book, 40, 3)
+        archive_executed_events(now=self.now)
+        summary = RestockDailySummary.objects.get()
+        self.assertEqual((summary.events, summary.quantity), (2, 5))
+
+    def test_summaries_are_written_in_key_order(self):
+        day, next_day = self.now.date(), (self.now + timezone.timedelta(days=1)).date()
+        rows = [(self.other.pk, day, 1, 1), (self.book.pk, next_day, 1, 1), (self.book.pk, day, 1, 1)]
+        inserted = []
+
+        def record(execute, sql, params, many, context):
+            inserted.extend(zip(*[iter(params)] * 4))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            _add_to_summaries(rows)
+        self.assertEqual(inserted, sorted(rows))
+
+    def test_management_command_and_api(self):
+        self.executed(self.book, 40, 2)
+        self.executed(self.other, 50, 3)
+        call_command("archive_restock_events", "--days", "30", stdout=mock.MagicMock())
+        self.assertFalse(RestockEvent.objects.exists())
+
+        url = reverse("books_api:events-archive")
+        results = self.client.get(url).json()["results"]
+        self.assertEqual([r["book_title"] for r in results], ["Old", "Older"])
+        results = self.client.get(url, {"book": self.other.pk}).json()["results"]
+        self.assertEqual([r["quantity"] for r in results], [3])
+
+
+@override_settings(RESTOCK_DELAY_DAYS="1")
+class InventorySummaryTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title="Summed", author="A", price=1.00, stock=10)
+        self.now = timezone.now()
+
+    def summary(self):
+        return BookInventorySummary.objects.get(book=self.book)
+
+    def test_new_books_get_an_empty_summary(self):
+        summary = self.summary()
+        self.assertEqual(summary.pending_quantity, 0)
+        self.assertIsNone(summary.next_restock_at)
+
+    def test_purchase_adds_pending_quantity(self):
+        self.client.post(reverse("books_api:book-buy-api", args=[self.book.pk]), {"quantity": 2})
+        self.client.post(reverse("books_api:book-buy-api", args=[self.book.pk]), {"quantity": 3})
+        first = RestockEvent.objects.order_by("scheduled_for").first()
+        self.assertEqual(self.summary().pending_quantity, 5)
+        self.assertEqual(self.summary().next_restock_at, first.scheduled_for)
+
+        data = self.client.get(reverse("books_api:books-detail", args=[self.book.pk])).json()
+        self.assertEqual(data["pending_restock_quantity"], 5)
+        self.assertIsNotNone(data["next_restock_at"])
+        self.assertIsNone(data["last_restocked_at"])
+
+    def test_execution_moves_pending_to_last_restocked(self):
+        schedule_restock(self.book, 2, now=self.now - timezone.timedelta(days=2))
+        later = schedule_restock(self.book, 3, now=self.now)
+        execute_due_events(now=self.now)
+
+        summary = self.summary()
+        self.assertEqual(summary.pending_quantity, 3)
+        self.assertEqual(summary.next_restock_at, later.scheduled_for)
+        self.assertEqual(
+            summary.last_restocked_at, RestockEvent.objects.get(executed=True).executed_at
+        )
+
+        execute_due_events(now=later.scheduled_for)
+        summary = self.summary()
+        self.assertEqual(summary.pending_quantity, 0)
+        self.assertIsNone(summary.next_restock_at)
+        self.assertEqual(check_summaries(), [])
+
+    def test_check_command_detects_and_rebuilds_drift(self):
+        schedule_restock(self.book, 4, now=self.now)
+        BookInventorySummary.objects.filter(book=self.book).update(pending_quantity=1)
+        BookInventorySummary.objects.filter(book=Book.objects.create(title="B", author="A", price=1)).delete()
+
+        with self.assertRaises(CommandError):
+            call_command("check_inventory_summaries", stdout=mock.MagicMock())
+        call_command("check_inventory_summaries", "--rebuild", stdout=mock.MagicMock())
+        self.assertEqual(check_summaries(), [])
+        self.assertEqual(self.summary().pending_quantity, 4)
+
+    def test_rebuild_invalidates_cached_books(self):
+        cache.clear()
+        schedule_restock(self.book, 4, now=self.now)
+        BookInventorySummary.objects.filter(book=self.book).update(pending_quantity=1)
+        url = reverse("books_api:books-detail", args=[self.book.pk])
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url).json()["pending_restock_quantity"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            check_summaries(rebuild=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["pending_restock_quantity"], 4)
+
+
+@override_settings(RESTOCK_DELAY_DAYS="0")
+class ShardedStockTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title="Bestseller", author="A", price=1.00, stock=10)
+        self.buy_url = reverse("books_api:book-buy-api", args=[self.book.pk])
+        self.detail_url = reverse("books_api:books-detail", args=[self.book.pk])
+        self.now = timezone.now()
+
+    def shard_stocks(self):
+        return list(StockShard.objects.filter(book=self.book).order_by("shard").values_list("stock", flat=True))
+
+    def test_command_spreads_and_merges_stock(self):
+        call_command("shard_stock", self.book.pk, "--shards", "4", stdout=io.StringIO())
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.stock, self.book.stock_shards), (0, 4))
+        self.assertEqual(self.shard_stocks(), [3, 3, 2, 2])
+        self.assertEqual(self.client.get(self.detail_url).json()["stock"], 10)
+
+        call_command("shard_stock", self.book.pk, "--shards", "0", stdout=io.StringIO())
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.stock, self.book.stock_shards), (10, 0))
+        self.assertEqual(self.shard_stocks(), [])
+        with self.assertRaises(CommandError):
+            call_command("shard_stock", self.book.pk + 1000, stdout=io.StringIO())
+
+    def test_purchase_takes_from_one_shard_and_leaves_the_book_row(self):
+        shard_book(self.book.pk, 4)
+        updated_at = Book.objects.get(pk=self.book.pk).updated_at
+        response = self.client.post(self.buy_url, {"quantity": 2})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["remaining_stock"], 8)
+        stocks = self.shard_stocks()
+        self.assertEqual(sum(stocks), 8)
+        self.assertEqual(sum(a != b for a, b in zip(stocks, [3, 3, 2, 2])), 1)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).updated_at, updated_at)
+
+        # The pending quantity went to a shard; reads add it back
+        self.assertEqual(BookInventorySummary.objects.get(book=self.book).pending_quantity, 0)
+        data = self.client.get(self.detail_url).json()
+        self.assertEqual((data["stock"], data["pending_restock_quantity"]), (8, 2))
+        self.assertIsNotNone(data["next_restock_at"])
+        self.assertEqual(check_summaries(), [])
+
+    def test_purchase_rebalances_when_no_shard_has_enough(self):
+        shard_book(self.book.pk, 4)
+        self.assertEqual(self.client.post(self.buy_url, {"quantity": 7}).status_code, 201)
+        self.assertEqual(self.shard_stocks(), [1, 1, 1, 0])
+        self.assertEqual(self.client.post(self.buy_url, {"quantity": 4}).status_code, 400)
+        self.assertEqual(self.client.post(self.buy_url, {"quantity": 3}).status_code, 201)
+        self.assertEqual(self.shard_stocks(), [0, 0, 0, 0])
+        self.assertEqual(RestockEvent.objects.filter(book=self.book).count(), 2)
+
+    def test_batch_purchase_of_sharded_book(self):
+        shard_book(self.book.pk, 2)
+        other = Book.objects.create(title="Other", author="A", price=1.00, stock=1)
+        response = self.client.post(
+            reverse("books_api:book-buy-batch-api"),
+            {"lines": [{"book": self.book.pk, "quantity": 6}, {"book": other.pk, "quantity": 1}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([line["remaining_stock"] for line in response.json()["lines"]], [4, 0])
+
+    def test_executor_restocks_and_rebalances_shards(self):
+        shard_book(self.book.pk, 2)
+        self.client.post(self.buy_url, {"quantity": 5})
+        execute_due_events(now=timezone.now())
+
+        self.assertEqual(self.shard_stocks(), [5, 5])
+        self.assertEqual(
+            list(StockShard.objects.filter(book=self.book).values_list("pending_quantity", flat=True)), [0, 0]
+        )
+        summary = BookInventorySummary.objects.get(book=self.book)
+        self.assertEqual(summary.pending_quantity, 0)
+        self.assertIsNotNone(summary.last_restocked_at)
+        self.assertEqual(check_summaries(), [])
+
+    def test_etag_changes_after_sharded_purchase(self):
+        shard_book(self.book.pk, 2)
+        etag = self.client.get(self.detail_url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.buy_url, {"quantity": 1})
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["stock"], 9)
+
+    def test_update_sets_total_stock(self):
+        shard_book(self.book.pk, 3)
+        admin = User.objects.create_superuser("admin", password="pass")
+        self.client.force_login(admin)
+        response = self.client.patch(self.detail_url, {"stock": 7}, content_type="application/json")
+        self.assertEqual(response.json()["stock"], 7)
+        self.assertEqual(self.shard_stocks(), [3, 2, 2])
+
+        url = reverse("books:update", args=[self.book.pk])
+        self.assertEqual(self.client.get(url).context["form"].initial["stock"], 7)
+        self.client.post(url, {"title": "Bestseller", "author": "A", "price": "1.00", "stock": 5})
+        self.assertEqual(self.shard_stocks(), [2, 2, 1])
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 0)
+
+
+class ShardedRestockOrderTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = shard_book(Book.objects.create(title="Hot", author="A", price=1.00, stock=10).pk, 2)
+        self.client.force_login(User.objects.create_user("watcher", password="pass"))
+
+    def test_every_restock_order_changes_the_validators(self):
+        detail_url = reverse("books_api:books-detail", args=[self.book.pk])
+        list_url = reverse("books_api:books-list-create")
+        schedule_restock(self.book, 5)
+        detail_etag = self.client.get(detail_url)["ETag"]
+        list_etag = self.client.get(list_url)["ETag"]
+        self.assertContains(self.client.get(reverse("books:list")), "Restocking 5")
+
+        # Only a shard's pending quantity changes: next_restock_at stays put
+        schedule_restock(self.book, 7)
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["pending_restock_quantity"], 12)
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+        self.assertContains(self.client.get(reverse("books:list")), "Restocking 12")
+
+
+@override_settings(RESTOCK_DELAY_DAYS="0", PURCHASE_WRITE_BEHIND=True)
+class WriteBehindPurchaseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title="Queued", author="A", price=1.00, stock=5)
+        self.url = reverse("books_api:book-buy-api", args=[self.book.pk])
+
+    def buy(self, quantity, pk=None):
+        url = reverse("books_api:book-buy-api", args=[pk]) if pk else self.url
+        return self.client.post(url, {"quantity": quantity}, content_type="application/json")
+
+    def test_purchases_are_queued_then_flushed_once(self):
+        first, second = self.buy(2), self.buy(1)
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual([r.json()["remaining_stock"] for r in (first, second)], [3, 2])
+        self.assertEqual([r.json()["order"] for r in (first, second)], [1, 2])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, 5)
+        self.assertFalse(RestockEvent.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush_purchases(), 2)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, 2)
+        self.assertEqual(sorted(RestockEvent.objects.values_list("quantity", flat=True)), [1, 2])
+        self.assertEqual(PurchaseQueueCheckpoint.objects.get().last_seq, 2)
+        self.assertEqual(flush_purchases(), 0)
+        self.assertEqual(RestockEvent.objects.count(), 2)
+
+        # The flush kept the counter, still in step with the database
+        self.assertEqual(cache.get(STOCK_COUNTER_KEY.format(pk=self.book.pk)), 2)
+        self.assertEqual(self.buy(2).json()["remaining_stock"], 0)
+        self.assertEqual(self.buy(1).status_code, 400)
+
+    def test_rejected_and_unknown_purchases(self):
+        self.assertEqual(self.buy(6).status_code, 400)
+        self.assertEqual(self.buy(1, pk=self.book.pk + 1000).status_code, 404)
+        self.assertEqual(flush_purchases(), 0)
+        self.assertEqual(PurchaseQueueCheckpoint.objects.get().last_seq, 2)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 5)
+
+    def test_pending_order_is_counted_and_holds_the_flush(self):
+        # A request that queued its order but has not reserved it yet
+        cache.set("purchases:seq", 1, None)
+        cache.set(ORDER_KEY.format(seq=1), {
+            "book": self.book.pk, "quantity": 3, "status": "pending", "created_at": timezone.now().timestamp(),
+        }, None)
+        self.assertEqual(self.buy(3).status_code, 400)
+        self.assertEqual(self.buy(2).json()["remaining_stock"], 0)
+
+        self.assertEqual(flush_purchases(), 0)
+        self.assertFalse(PurchaseQueueCheckpoint.objects.exists())
+        with self.assertLogs("books.purchase_queue", "WARNING"):
+            self.assertEqual(flush_purchases(grace=0), 1)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 3)
+
+    def test_reconcile_and_failed_orders(self):
+        self.buy(1)
+        counter = STOCK_COUNTER_KEY.format(pk=self.book.pk)
+        self.assertEqual(reconcile_counters(), [])
+        cache.set(counter, 99, None)
+        self.assertEqual(reconcile_counters(), [self.book.pk])
+        self.assertIsNone(cache.get(counter))
+
+        # A drifted counter accepts more than the database holds
+        cache.set(counter, 99, None)
+        self.buy(10)
+        out = io.StringIO()
+        with self.assertLogs("books.purchase_queue", "ERROR"):
+            call_command("flush_purchases", "--reconcile", stdout=out)
+        self.assertIn("Applied 1 queued purchases.", out.getvalue())
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 4)
+        self.assertEqual(cache.get(ORDER_KEY.format(seq=2))["status"], "failed")
+
+    def test_lost_numbering_restarts_after_the_checkpoint(self):
+        self.buy(1)
+        self.buy(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            flush_purchases()
+        cache.delete(SEQ_KEY)
+        self.assertEqual(self.buy(1).json()["order"], 3)
+        self.assertEqual(flush_purchases(), 1)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 2)
+
+        cache.set(SEQ_KEY, 1, None)
+        with self.assertLogs("books.purchase_queue", "CRITICAL"), self.assertRaises(QueueOutOfSync):
+            flush_purchases()
+
+    def test_stock_changes_outside_the_queue_drop_the_counter(self):
+        self.buy(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.stock = 20
+            self.book.save()
+        self.assertEqual(self.buy(1).json()["remaining_stock"], 18)
+
+        # A restock, and a purchase bypassing the queue
+        RestockEvent.objects.create(book=self.book, scheduled_for=timezone.now(), quantity=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_due_events()
+        self.assertEqual(self.buy(1).json()["remaining_stock"], 22)
+        with self.captureOnCommitCallbacks(execute=True):
+            purchase_book(self.book.pk, 2)
+        self.assertEqual(self.buy(1).json()["remaining_stock"], 19)
+
+    def test_failed_order_drops_only_its_counter(self):
+        other = Book.objects.create(title="Also queued", author="A", price=1.00, stock=5)
+        self.buy(1)
+        self.buy(1, pk=other.pk)
+        # The stock was lowered behind the counter's back
+        Book.objects.filter(pk=self.book.pk).update(stock=0)
+        with self.assertLogs("books.purchase_queue", "ERROR"):
+            flush_purchases()
+        self.assertIsNone(cache.get(STOCK_COUNTER_KEY.format(pk=self.book.pk)))
+        self.assertEqual(cache.get(STOCK_COUNTER_KEY.format(pk=other.pk)), 4)
+
+
+class ConcurrentRestockTests(TransactionTestCase):
+    def test_concurrent_workers_apply_each_event_once(self):
+        """
+        Several workers draining the same backlog claim disjoint chunks:
+        every event is executed once and the stock is incremented once.
+        """
+        books = [
+            Book.objects.create(title=f"Book {i}", author="A", price=1.00, stock=0)
+            for i in range(5)
+        ]
+        now = timezone.now()
+        RestockEvent.objects.bulk_create(
+            RestockEvent(book=books[i % len(books)], scheduled_for=now, quantity=2)
+            for i in range(400)
+        )
+
+        workers = 4
+        barrier = threading.Barrier(workers)
+        processed = []
+
+        def worker():
+            try:
+                barrier.wait()
+                processed.append(execute_due_events(now=now, chunk_size=10))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sum(processed), 400)
+        self.assertFalse(RestockEvent.objects.filter(executed=False).exists())
+        for book in books:
+            book.refresh_from_db()
+            self.assertEqual(book.stock, 160)
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+    def test_benchmark_reports_json(self):
+        out = io.StringIO()
+        call_command(
+            "benchmark", "--use-existing-database", "--books", "5", "--purchases", "6",
+            "--threads", "2", "--concurrency", "3", "--events", "20,30", "--feed-requests", "4", "--feed-pages", "2",
+            "--chunk-size", "10", stdout=out, stderr=io.StringIO(),
+        )
+        results = json.loads(out.getvalue())
+
+        scenarios = results["scenarios"]
+        self.assertEqual(
+            set(scenarios),
+            {"purchase", "hot", "restock_20", "restock_30", "events_feed_20", "events_feed_50", "asgi"},
+        )
+        for counter in ("single", "sharded"):
+            self.assertEqual((scenarios["hot"][counter]["calls"], scenarios["hot"][counter]["errors"]), (6, 0))
+        purchase = scenarios["purchase"]
+        self.assertEqual((purchase["calls"], purchase["errors"]), (6, 0))
+        self.assertEqual(set(purchase["latency_ms"]), {"mean", "p50", "p95", "p99", "max"})
+        self.assertGreater(purchase["queries_per_call"], 0)
+        self.assertEqual(scenarios["restock_30"]["events"], 30)
+        self.assertEqual(scenarios["events_feed_50"]["first_page"]["errors"], 0)
+        for side in ("wsgi", "asgi"):
+            self.assertEqual(
+                {name: result["errors"] for name, result in scenarios["asgi"][side].items()},
+                {"list": 0, "detail": 0, "purchase": 0},
+            )
+        # purchase + hot (single and sharded) + asgi (wsgi and asgi)
+        self.assertEqual(RestockEvent.objects.filter(executed=False).count(), 6 + 2 * 6 + 2 * 6)
+
+
+class BatchPurchaseAPITests(TestCase):
+    def setUp(self):
+        self.books = [
+            Book.objects.create(title=f"Cart Book {i}", author="A", price=1.00, stock=5)
+            for i in range(20)
+        ]
+        self.url = reverse("books_api:book-buy-batch-api")
+
+    def post(self, lines, mode="all_or_nothing"):
+        return self.client.post(
+            self.url, {"lines": lines, "mode": mode}, content_type="application/json"
+        )
+
+    def test_batch_purchase_success(self):
+        lines = [{"book": b.pk, "quantity": 2} for b in self.books]
+        response = self.post(lines)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data["purchased_lines"], 20)
+        for line in data["lines"]:
+            self.assertEqual(line["status"], "purchased")
+            self.assertEqual(line["remaining_stock"], 3)
+        self.assertEqual(RestockEvent.objects.filter(quantity=2).count(), 20)
+        self.assertEqual(set(Book.objects.values_list("stock", flat=True)), {3})
+
+    def test_batch_purchase_query_count_is_independent_of_lines(self):
+        with CaptureQueriesContext(connection) as small:
+            self.post([{"book": b.pk, "quantity": 1} for b in self.books[:2]])
+        with CaptureQueriesContext(connection) as large:
+            self.post([{"book": b.pk, "quantity": 1} for b in self.books])
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertLessEqual(len(large.captured_queries), 6)
+
+    def test_all_or_nothing_rolls_back(self):
+        first, second = self.books[:2]
+        response = self.post([
+            {"book": first.pk, "quantity": 1},
+            {"book": second.pk, "quantity": 6},
+        ])
+        self.assertEqual(response.status_code, 400)
+        statuses = [line["status"] for line in response.json()["lines"]]
+        self.assertEqual(statuses, ["cancelled", "insufficient_stock"])
+        first.refresh_from_db()
+        self.assertEqual(first.stock, 5)
+        self.assertFalse(RestockEvent.objects.exists())
+
+    def test_partial_fill(self):
+        first, second = self.books[:2]
+        response = self.post([
+            {"book": first.pk, "quantity": 3},
+            {"book": second.pk, "quantity": 6},
+            {"book": first.pk, "quantity": 1},
+            {"book": 999999, "quantity": 1},
+        ], mode="partial")
+        self.assertEqual(response.status_code, 201)
+        lines = response.json()["lines"]
+        self.assertEqual(
+            [line["status"] for line in lines],
+            ["purchased", "insufficient_stock", "purchased", "not_found"],
+        )
+        self.assertEqual(lines[0]["remaining_stock"], 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.stock, second.stock), (1, 5))
+        self.assertEqual(RestockEvent.objects.filter(book=first).count(), 2)
+
+    def test_partial_fill_checks_each_line(self):
+        # 4 + 3 units exceed the stock of 5, but the first line fits alone
+        plain, sharded = self.books[:2]
+        shard_book(sharded.pk, 2)
+        response = self.post([
+            {"book": plain.pk, "quantity": 4},
+            {"book": sharded.pk, "quantity": 4},
+            {"book": plain.pk, "quantity": 3},
+            {"book": sharded.pk, "quantity": 3},
+            {"book": plain.pk, "quantity": 1},
+        ], mode="partial")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [line["status"] for line in response.json()["lines"]],
+            ["purchased", "purchased", "insufficient_stock", "insufficient_stock", "purchased"],
+        )
+        self.assertEqual(Book.objects.get(pk=plain.pk).stock, 0)
+        self.assertEqual(sum(StockShard.objects.filter(book=sharded).values_list("stock", flat=True)), 1)
+        self.assertEqual(RestockEvent.objects.count(), 3)
+
+    def test_invalid_payload(self):
+        response = self.post([{"book": self.books[0].pk, "quantity": 0}])
+        self.assertEqual(response.status_code, 400)
+        response = self.post([])
+        self.assertEqual(response.status_code, 400)
+
+
+class ConcurrentPurchaseTests(TransactionTestCase):
+    def test_concurrent_purchases_never_oversell(self):
+        """
+        Concurrent buyers of the same title are served by the conditional
+        UPDATE: exactly `stock` purchases succeed and no update is lost.
+        """
+        book = Book.objects.create(title="Hot", author="A", price=1.00, stock=10)
+        url = reverse("book-buy-api", args=[book.pk])
+        buyers = 20
+        barrier = threading.Barrier(buyers)
+        statuses = []
+
+        def buyer():
+            try:
+                barrier.wait()
+                response = self.client_class().post(
+                    url, {"quantity": 1}, content_type="application/json"
+                )
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer) for _ in range(buyers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        book.refresh_from_db()
+        self.assertEqual(statuses.count(201), 10)
+        self.assertEqual(statuses.count(400), 10)
+        self.assertEqual(book.stock, 0)
+        self.assertEqual(RestockEvent.objects.filter(book=book).count(), 10)
+
+    def test_concurrent_purchases_of_sharded_book_never_oversell(self):
+        """
+        Buyers of a sharded title spread over its shards, rebalancing them
+        as they run dry: exactly `stock` units are sold.
+        """
+        book = Book.objects.create(title="Flash sale", author="A", price=1.00, stock=30)
+        shard_book(book.pk, 4)
+        url = reverse("book-buy-api", args=[book.pk])
+        buyers = 20
+        barrier = threading.Barrier(buyers)
+        statuses = []
+
+        def buyer():
+            try:
+                barrier.wait()
+                response = self.client_class().post(
+                    url, {"quantity": 2}, content_type="application/json"
+                )
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer) for _ in range(buyers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(statuses.count(201), 15)
+        self.assertEqual(statuses.count(400), 5)
+        self.assertEqual(Book.objects.get(pk=book.pk).shard_totals(), (0, 30))
+        self.assertEqual(check_summaries(), [])
+
 
 class EventListViewTests(TestCase):
     def setUp(self):
@@ -119,6 +1210,468 @@ class EventListViewTests(TestCase):
         content = response.content.decode()
         self.assertIn("Pending Restock Events", content)
         self.assertIn("Executed Restock Events", content)
+    def test_event_list_view_keyset_pagination(self):
+        now = timezone.now()
+        RestockEvent.objects.bulk_create(
+            RestockEvent(book=self.book, scheduled_for=now + timezone.timedelta(days=2))
+            for _ in range(60)
+        )
+        url = reverse("books:events")
+        response = self.client.get(url)
+        self.assertEqual(len(response.context["pending_events"]), 50)
+        next_url = response.context["pending_next_url"]
+        self.assertIsNotNone(next_url)
+        self.assertIsNone(response.context["executed_next_url"])
+
+        response = self.client.get(next_url)
+        self.assertEqual(len(response.context["pending_events"]), 11)
+        self.assertIsNone(response.context["pending_next_url"])
+        self.assertEqual(len(response.context["executed_events"]), 1)
+
+        response = self.client.get(url, {"pending": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+class BookListViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user("lister", password="pass"))
+        Book.objects.bulk_create(
+            Book(title=f"Book {n:03}", author="A", description="Long " * 100, price=2.00, stock=n % 3)
+            for n in range(60)
+        )
+        self.url = reverse("books:list")
+
+    def test_keyset_pages(self):
+        with CaptureQueriesContext(connection) as first_queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context["books"]), 50)
+        self.assertFalse(response.context["first_url"])
+        self.assertNotIn('"description"', " ".join(q["sql"] for q in first_queries.captured_queries))
+
+        with CaptureQueriesContext(connection) as next_queries:
+            response = self.client.get(response.context["next_url"])
+        self.assertEqual([book.title for book in response.context["books"]], [f"Book {n:03}" for n in range(50, 60)])
+        self.assertIsNone(response.context["next_url"])
+        self.assertContains(response, "First page")
+        self.assertEqual(len(next_queries), len(first_queries))
+
+        self.assertEqual(self.client.get(self.url, {"cursor": "garbage"}).status_code, 404)
+
+    def test_rows_are_cached_until_the_book_changes(self):
+        book = Book.objects.order_by("id").first()
+        self.assertContains(self.client.get(self.url), "Book 000")
+        Book.objects.filter(pk=book.pk).update(title="Renamed", stock=5)
+        self.assertContains(self.client.get(self.url), "Book 000")
+
+        purchase_book(book.pk, 2)
+        response = self.client.get(self.url)
+        self.assertContains(response, "<strong>Renamed</strong>")
+        self.assertContains(response, "Stock: 3")
+
+
+class EstimatedCountPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Book.objects.bulk_create(
+            Book(title=f"Counted {n}", author="Even" if n % 2 else "Odd", price=1.00, stock=1) for n in range(30)
+        )
+        self.url = reverse("books_api:books-list-create")
+        self.ids = list(Book.objects.order_by("id").values_list("id", flat=True))
+
+    def test_small_counts_are_exact(self):
+        data = self.client.get(self.url, {"limit": 10, "offset": 20}).json()
+        self.assertEqual((data["count"], data["count_estimated"], data["next"]), (30, False, None))
+        self.assertIsNotNone(data["previous"])
+
+    @override_settings(API_COUNT_ESTIMATE_THRESHOLD=5)
+    def test_large_counts_are_estimated(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE books_book")
+        for params in ({}, {"author": "Even"}):
+            with self.subTest(params=params):
+                cache.clear()
+                data = self.client.get(self.url, {**params, "limit": 10}).json()
+                self.assertTrue(data["count_estimated"])
+                self.assertGreater(data["count"], 5)
+                self.assertIsNotNone(data["next"])
+
+        # Past the last row there is no next page, whatever the estimate
+        cache.clear()
+        data = self.client.get(self.url, {"author": "Even", "limit": 10, "offset": 10}).json()
+        self.assertEqual(len(data["results"]), 5)
+        self.assertIsNone(data["next"])
+
+    def test_keyset_mode_walks_every_book_without_offset(self):
+        for url in (self.url, reverse("books_api:async-books-list")):
+            with self.subTest(url=url):
+                ids, counts, next_url, sql = [], [], f"{url}?cursor=&limit=7", []
+                while next_url:
+                    cache.clear()
+                    with CaptureQueriesContext(connection) as queries:
+                        data = self.client.get(next_url).json()
+                    sql += [query["sql"] for query in queries.captured_queries]
+                    self.assertIsNone(data["previous"])
+                    ids += [book["id"] for book in data["results"]]
+                    counts.append(data["count"])
+                    next_url = data["next"]
+                self.assertEqual(ids, self.ids)
+                # Only the first page is counted
+                self.assertEqual(counts, [30, None, None, None, None])
+                self.assertEqual(sum("COUNT(*)" in query for query in sql), 1)
+                self.assertFalse(any("OFFSET" in query for query in sql))
+                self.assertEqual(self.client.get(url, {"cursor": "garbage"}).status_code, 404)
+
+    def test_keyset_mode_rejects_search(self):
+        response = self.client.get(self.url, {"cursor": "", "search": "Counted"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cursor", response.json())
+        self.assertEqual(self.client.get(self.url, {"search": "Counted"}).status_code, 200)
+
+
+class RestockEventAPITests(TestCase):
+    def setUp(self):
+        self.books = [
+            Book.objects.create(title=f"Event Book {i}", author="A", price=1.00, stock=0)
+            for i in range(3)
+        ]
+        now = timezone.now()
+        # Several events share the same timestamps to exercise the id tie-breaker
+        RestockEvent.objects.bulk_create(
+            RestockEvent(
+                book=self.books[i % 3],
+                scheduled_for=now + timezone.timedelta(hours=i // 4),
+            )
+            for i in range(25)
+        )
+        RestockEvent.objects.bulk_create(
+            RestockEvent(
+                book=self.books[i % 3],
+                scheduled_for=now - timezone.timedelta(days=1),
+                executed=True,
+                executed_at=now - timezone.timedelta(hours=i // 4),
+            )
+            for i in range(25)
+        )
+
+    def collect(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url, {"limit": 7} if "?" not in url else None)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [ev["id"] for ev in data["results"]]
+            url = data["next"]
+        return ids
+
+    def test_pending_feed_walks_every_event_in_order(self):
+        ids = self.collect(reverse("books_api:events-pending"))
+        expected = list(
+            RestockEvent.objects.filter(executed=False)
+            .order_by("scheduled_for", "id").values_list("id", flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_executed_feed_walks_every_event_in_order(self):
+        ids = self.collect(reverse("books_api:events-executed"))
+        expected = list(
+            RestockEvent.objects.filter(executed=True)
+            .order_by("-executed_at", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_feed_has_no_n_plus_one(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("books_api:events-pending"), {"limit": 20})
+        self.assertEqual(len(response.json()["results"]), 20)
+        self.assertTrue(response.json()["results"][0]["book_title"].startswith("Event Book"))
+
+    def test_combined_events_first_pages(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("books_api:events-list"))
+        data = response.json()
+        self.assertEqual(len(data["pending_events"]), 10)
+        self.assertEqual(len(data["executed_events"]), 10)
+        self.assertIn("/api/events/pending/?cursor=", data["pending_next"])
+        self.assertIn("/api/events/executed/?cursor=", data["executed_next"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("books_api:events-pending"), {"cursor": "nope"})
+        self.assertEqual(response.status_code, 404)
+
+
+class FastSerializationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now().replace(microsecond=123456)
+        self.books = [
+            Book.objects.create(title="Plain", author="A", description="", price="12.50", stock=3),
+            Book.objects.create(title="Ünïcode \u2028 “quoted” \\ \"", author="B", price="0.10", stock=0),
+            Book.objects.create(title="Sharded", author="C", price="1000.00", stock=9),
+        ]
+        BookInventorySummary.objects.filter(book=self.books[0]).update(pending_quantity=4, next_restock_at=now)
+        BookInventorySummary.objects.filter(book=self.books[1]).update(last_restocked_at=now - timezone.timedelta(days=1))
+        shard_book(self.books[2].pk, 2)
+        orphan = Book.objects.create(title="No summary", author="D", price="5", stock=1)
+        BookInventorySummary.objects.filter(book=orphan).delete()
+        RestockEvent.objects.create(book=self.books[0], scheduled_for=now, quantity=4)
+        RestockEvent.objects.create(book=self.books[1], scheduled_for=now, executed=True, executed_at=now)
+
+    def test_rows_render_to_the_same_bytes_as_the_serializers(self):
+        books = Book.objects.select_related("inventory").with_shard_totals().order_by("id")
+        events = RestockEvent.objects.select_related("book").order_by("id")
+        cases = [
+            (BookSerializer(books, many=True).data, BookRowSerializer(), books),
+            (RestockEventSerializer(events, many=True).data, RestockEventRowSerializer(), events),
+        ]
+        for expected, fast, queryset in cases:
+            data = fast.to_representation(fast.rows(queryset))
+            self.assertEqual(data, expected)
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(expected))
+
+    def test_list_endpoints_answer_the_same_bytes(self):
+        urls = [
+            reverse("books_api:books-list-create"),
+            reverse("books_api:books-list-create") + "?limit=2&offset=1",
+            reverse("books_api:books-list-create") + "?search=sharded",
+            reverse("books_api:events-list"),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                cache.clear()
+                with override_settings(API_FAST_SERIALIZATION=False):
+                    expected = self.client.get(url)
+                cache.clear()
+                with mock.patch.object(BookSerializer, "to_representation", side_effect=AssertionError), \
+                        mock.patch.object(RestockEventSerializer, "to_representation", side_effect=AssertionError):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected.content)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(
+            title="Sparse", author="A", description="Long " * 1000, price="4.20", stock=7
+        )
+        self.list_url = reverse("books_api:books-list-create")
+        self.detail_url = reverse("books_api:books-detail", args=[self.book.pk])
+
+    def get(self, url, params=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, " ".join(query["sql"] for query in queries.captured_queries)
+
+    def test_list_defaults_to_the_compact_projection(self):
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(API_FAST_SERIALIZATION=fast):
+                response, sql = self.get(self.list_url)
+                self.assertEqual(
+                    response.json()["results"],
+                    [{"id": self.book.pk, "title": "Sparse", "author": "A", "price": "4.20", "stock": 7}],
+                )
+                self.assertNotIn('"description"', sql)
+                self.assertNotIn('"next_restock_at"', sql)
+
+    def test_fields_and_omit_select_the_columns(self):
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(API_FAST_SERIALIZATION=fast):
+                response, sql = self.get(self.list_url, {"fields": "next_restock_at,title"})
+                self.assertEqual(response.json()["results"], [{"id": self.book.pk, "title": "Sparse", "next_restock_at": None}])
+                self.assertNotIn('"price"', sql)
+
+                response, sql = self.get(self.list_url, {"omit": "description,last_restocked_at"})
+                self.assertEqual(list(response.json()["results"][0]), [
+                    "id", "title", "author", "price", "stock", "pending_restock_quantity", "next_restock_at",
+                ])
+                self.assertNotIn('"description"', sql)
+
+                response, _ = self.get(self.list_url, {"fields": "*"})
+                self.assertEqual(response.json()["results"][0]["description"], self.book.description)
+
+    def test_detail_projection_is_cached_per_field_set(self):
+        self.assertIn("description", self.client.get(self.detail_url).json())
+        self.assertEqual(self.client.get(self.detail_url, {"fields": "stock"}).json(), {"id": self.book.pk, "stock": 7})
+        self.assertIn("description", self.client.get(self.detail_url).json())
+        response, sql = self.get(self.detail_url, {"omit": "description"})
+        self.assertNotIn("description", response.json())
+        self.assertNotIn('"description"', sql)
+
+    def test_invalid_fields(self):
+        for params in ({"fields": "title,isbn"}, {"fields": "title", "omit": "stock"}):
+            for url in (self.list_url, self.detail_url, reverse("books_api:async-books-list")):
+                with self.subTest(params=params, url=url):
+                    response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn("fields", response.json())
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title="Measured", author="A", price=1.00, stock=5)
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_are_recorded_per_url_name(self):
+        view = "books_api:book-buy-api"
+        requests = self.sample("bookstore_http_requests_total", view=view, method="POST", status="201")
+        queries = self.sample("bookstore_http_request_queries_sum", view=view)
+        timed = self.sample("bookstore_http_request_db_duration_seconds_count", view=view)
+
+        self.client.post(reverse(view, args=[self.book.pk]), {"quantity": 1})
+
+        self.assertEqual(
+            self.sample("bookstore_http_requests_total", view=view, method="POST", status="201"),
+            requests + 1,
+        )
+        self.assertGreater(self.sample("bookstore_http_request_queries_sum", view=view), queries)
+        self.assertEqual(
+            self.sample("bookstore_http_request_db_duration_seconds_count", view=view), timed + 1
+        )
+        self.assertNotIn("Server-Timing", self.client.get(reverse("books_api:events-list")))
+
+    def test_unresolved_paths_share_one_label(self):
+        before = self.sample("bookstore_http_requests_total", view="<unresolved>", method="GET", status="404")
+        self.client.get("/no/such/page/")
+        self.client.get("/another/missing/page/")
+        self.assertEqual(
+            self.sample("bookstore_http_requests_total", view="<unresolved>", method="GET", status="404"),
+            before + 2,
+        )
+
+    @override_settings(METRICS_DEBUG_HEADERS=True)
+    def test_debug_headers_are_opt_in(self):
+        response = self.client.get(reverse("books_api:books-detail", args=[self.book.pk]))
+        self.assertRegex(response["Server-Timing"], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+
+    @override_settings(METRICS_TOKEN="scrape-me")
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("books_api:events-list"))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        wrong = self.client.get(reverse("metrics"), headers={"Authorization": "Bearer nope"})
+        self.assertEqual(wrong.status_code, 403)
+        self.client.force_login(User.objects.create_user("staff", password="pass", is_staff=True))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+        self.client.logout()
+
+        response = self.client.get(reverse("metrics"), headers={"Authorization": "Bearer scrape-me"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(
+            'bookstore_http_request_duration_seconds_count{method="GET",view="books_api:events-list"}',
+            response.content.decode(),
+        )
+
+
+class AsyncAPITests(TestCase):
+    def setUp(self):
+        for n in range(3):
+            Book.objects.create(title=f"Async {n}", author="Same" if n else "Other", price=3.50, stock=2)
+        self.book = Book.objects.get(title="Async 1")
+
+    async def test_list_and_detail_match_the_sync_views(self):
+        for params in ({}, {"limit": 1, "offset": 1}, {"author": "Same"}, {"search": "Async"}):
+            sync = await self.async_client.get(reverse("books_api:books-list-create"), params)
+            native = await self.async_client.get(reverse("books_api:async-books-list"), params)
+            self.assertEqual(native.status_code, 200)
+            self.assertEqual(
+                native.json(),
+                json.loads(sync.content.decode().replace("/api/books/", "/api/async/books/")),
+            )
+        native = await self.async_client.get(reverse("books_api:async-books-list"), {"search": "Async"})
+        self.assertEqual(native.json()["count"], 3)
+        native = await self.async_client.get(reverse("books_api:async-books-list"), {"search": "x", "cursor": ""})
+        self.assertEqual(native.status_code, 400)
+
+        sync = await self.async_client.get(reverse("books_api:books-detail", args=[self.book.pk]))
+        native = await self.async_client.get(reverse("books_api:async-books-detail", args=[self.book.pk]))
+        self.assertEqual(native.json(), sync.json())
+        missing = await self.async_client.get(reverse("books_api:async-books-detail", args=[0]))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_purchase(self):
+        url = reverse("books_api:async-book-buy", args=[self.book.pk])
+        response = await self.async_client.post(url, {"quantity": 2}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data["purchased"], data["remaining_stock"]), (2, 0))
+        self.assertEqual(data["restock_event"]["book_title"], "Async 1")
+        self.assertEqual(await RestockEvent.objects.filter(book_id=self.book.pk).acount(), 1)
+
+        response = await self.async_client.post(url, {"quantity": 1})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.post(url, {"quantity": "many"})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.post(reverse("books_api:async-book-buy", args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_csrf_is_enforced_for_logged_in_users(self):
+        user = await User.objects.acreate_user("async-buyer", password="pass")
+        client = self.async_client_class(enforce_csrf_checks=True)
+        await client.aforce_login(user)
+        response = await client.post(reverse("books_api:async-book-buy", args=[self.book.pk]))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_requests_are_measured(self):
+        view = "books_api:async-books-detail"
+        before = REGISTRY.get_sample_value("bookstore_http_request_queries_sum", {"view": view}) or 0
+        await self.async_client.get(reverse(view, args=[self.book.pk]))
+        self.assertGreater(
+            REGISTRY.get_sample_value("bookstore_http_request_queries_sum", {"view": view}), before
+        )
+
+
+class ServingTests(TestCase):
+    def serve(self, *args):
+        out = io.StringIO()
+        call_command("serve", "--dry-run", *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue().split()
+
+    @mock.patch("books.management.commands.serve.cpu_count", return_value=4)
+    def test_wsgi_workers_are_sized_to_the_cpus(self, cpu_count):
+        argv = self.serve("--threads", "2")
+        self.assertIn("gunicorn", argv)
+        self.assertEqual(argv[argv.index("--workers") + 1], "9")
+        self.assertEqual(argv[argv.index("--threads") + 1], "2")
+        self.assertTrue(any(arg.startswith("PROMETHEUS_MULTIPROC_DIR=") for arg in argv))
+
+    @override_settings(DB_POOL_MAX_SIZE=0)
+    @mock.patch("books.management.commands.serve.cpu_count", return_value=4)
+    def test_asgi_without_pool_drops_persistent_connections(self, cpu_count):
+        argv = self.serve("--asgi", "--bind", "127.0.0.1:8001")
+        self.assertIn("DB_CONN_MAX_AGE=0", argv)
+        self.assertEqual(argv[argv.index("--workers") + 1], "4")
+        self.assertEqual(argv[argv.index("--port") + 1], "8001")
+
+    @override_settings(DB_POOL_MAX_SIZE=10)
+    def test_asgi_with_pool(self):
+        argv = self.serve("--asgi", "--workers", "1")
+        self.assertFalse(any(arg.startswith(("DB_CONN_MAX_AGE=", "PROMETHEUS_MULTIPROC_DIR=")) for arg in argv))
+
+    @mock.patch("books.management.commands.serve.os.execvp")
+    def test_execs_the_server(self, execvp):
+        call_command("serve", "--workers", "1", stderr=io.StringIO())
+        execvp.assert_called_once()
+        self.assertEqual(execvp.call_args.args[0], "gunicorn")
+
+    def test_invalid_bind(self):
+        with self.assertRaises(CommandError):
+            call_command("serve", "--dry-run", "--bind", "nowhere", stdout=io.StringIO())
+
+    def test_health_checks(self):
+        self.assertEqual(self.client.get(reverse("healthz")).json(), {"status": "ok"})
+        response = self.client.get(reverse("readyz"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["checks"], {"database": "ok", "cache": "ok"})
+
+        with mock.patch("bookstore_manager.health.cache.get", side_effect=ConnectionError), \
+                self.assertLogs("bookstore_manager.health", level="ERROR"):
+            response = self.client.get(reverse("readyz"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["checks"]["cache"], "unavailable")
 
 
 class PurchaseBookAPITests(TestCase):
@@ -164,3 +1717,92 @@ class PurchaseBookAPITests(TestCase):
         data = response.json()
         self.assertEqual(data["detail"], "Insufficient stock available.")
         self.assertFalse(RestockEvent.objects.filter(book=self.book).exists())
+
+    def test_purchase_unknown_book(self):
+        """
+        Purchasing a book that does not exist returns 404.
+        """
+        url = reverse("book-buy-api", args=[self.book.pk + 1000])
+        response = self.client.post(url, {"quantity": 1}, content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(RestockEvent.objects.exists())
+
+
+@override_settings(RESTOCK_DELAY_DAYS="0")
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        caches["idempotency"].clear()
+        self.book = Book.objects.create(title="Retried", author="A", price=1.00, stock=5)
+        self.url = reverse("book-buy-api", args=[self.book.pk])
+
+    def buy(self, quantity=1, key="key-1"):
+        return self.client.post(
+            self.url, {"quantity": quantity}, content_type="application/json", headers={"Idempotency-Key": key}
+        )
+
+    def test_retry_replays_the_response_without_buying_again(self):
+        first = self.buy(2)
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(0):
+            retry = self.buy(2)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 3)
+        self.assertEqual(RestockEvent.objects.count(), 1)
+
+        # Another key buys again; the same key with another body is refused
+        self.assertEqual(self.buy(2, key="key-2").status_code, 201)
+        self.assertEqual(self.buy(3).status_code, 422)
+        self.assertEqual(self.client.post(self.url, {"quantity": 1}).status_code, 201)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 0)
+
+    def test_errors_are_replayed_but_server_errors_are_not(self):
+        self.assertEqual(self.buy(10).status_code, 400)
+        Book.objects.filter(pk=self.book.pk).update(stock=20)
+        self.assertEqual(self.buy(10).status_code, 400)
+
+        with mock.patch("books.api.views.purchase_book", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.buy(1, key="key-2")
+        self.assertEqual(self.buy(1, key="key-2").status_code, 201)
+
+    @override_settings(IDEMPOTENCY_WAIT=0)
+    def test_duplicate_of_a_running_request_is_collapsed(self):
+        duplicates = []
+
+        def purchase(*args):
+            duplicates.append(self.buy(1))
+            return purchase_book(*args)
+
+        with mock.patch("books.api.views.purchase_book", side_effect=purchase):
+            self.assertEqual(self.buy(1).status_code, 201)
+        self.assertEqual(duplicates[0].status_code, 409)
+        self.assertEqual(RestockEvent.objects.count(), 1)
+
+    async def test_async_purchase_retry_is_replayed(self):
+        url = reverse("books_api:async-book-buy", args=[self.book.pk])
+        responses = [
+            await self.async_client.post(
+                url, {"quantity": 2}, content_type="application/json", headers={"Idempotency-Key": "async-1"}
+            )
+            for _ in range(2)
+        ]
+        self.assertEqual([r.status_code for r in responses], [201, 201])
+        self.assertEqual(responses[1].json(), responses[0].json())
+        self.assertEqual(responses[1]["Idempotent-Replayed"], "true")
+        self.assertEqual((await Book.objects.aget(pk=self.book.pk)).stock, 3)
+        self.assertEqual(await RestockEvent.objects.acount(), 1)
+        response = await self.async_client.post(
+            url, {"quantity": 1}, content_type="application/json", headers={"Idempotency-Key": "async-1"}
+        )
+        self.assertEqual(response.status_code, 422)
+
+    def test_html_purchase_form(self):
+        self.client.force_login(User.objects.create_user("buyer", password="pass"))
+        url = reverse("books:buy", args=[self.book.pk])
+        for _ in range(2):
+            response = self.client.post(url, {"quantity": "2"}, headers={"Idempotency-Key": "form-1"})
+            self.assertEqual((response.status_code, response["Location"]), (302, reverse("books:detail", args=[self.book.pk])))
+        self.assertEqual(RestockEvent.objects.count(), 1)
+        long_key = self.client.post(url, {"quantity": "2"}, headers={"Idempotency-Key": "x" * 256})
+        self.assertEqual(long_key.status_code, 400)
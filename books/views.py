@@ -1,23 +1,55 @@
 from django.urls import reverse_lazy
 from django.shortcuts import get_object_or_404, redirect
-from django.utils import timezone
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.views.generic import (ListView, DetailView, CreateView, UpdateView, DeleteView)
+from django.http import Http404
+from django.views.generic import (ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView)
+from .idempotency import idempotent
 from .models import Book, RestockEvent
+from .pagination import InvalidCursor, cursor_url, keyset_page
+from .restock import schedule_restock
+from .shards import set_stock
 
 # Create your views here.
 @method_decorator(login_required, name='dispatch')
 class BookListView(LoginRequiredMixin, ListView):
     """
-    View to list all books in the inventory.
+    View to list the books in the inventory, keyset-paginated on the id
+    (?cursor=), so a deep page costs the same as the first one. Only the
+    columns the table shows are loaded, and each row is rendered from the
+    fragment cache until the book, its inventory summary or its shards
+    change.
     """
-    model = Book
+    queryset = Book.objects.select_related('inventory').with_shard_totals()
     template_name = 'books/book_list.html'
     context_object_name = 'books'
+    ordering = ('id',)
+    page_size = 50
+    columns = (
+        'title', 'author', 'price', 'stock', 'stock_shards', 'updated_at',
+        'inventory__pending_quantity', 'inventory__next_restock_at', 'inventory__updated_at',
+    )
+
+    def get_queryset(self):
+        try:
+            books, next_cursor = keyset_page(
+                self.queryset.only(*self.columns), self.ordering,
+                self.request.GET.get('cursor'), self.page_size,
+            )
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        self.next_url = next_cursor and cursor_url(self.request, 'cursor', next_cursor)
+        return books
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['next_url'] = self.next_url
+        ctx['first_url'] = 'cursor' in self.request.GET and self.request.path
+        ctx['fragment_timeout'] = settings.CATALOG_CACHE_TIMEOUT
+        return ctx
     
 @method_decorator(login_required, name='dispatch')
 class BookDetailView(DetailView):
@@ -66,6 +98,18 @@ class BookUpdateView(UpdateView):
         self.action = 'update'
         return ctx
 
+    def get_initial(self):
+        # The stock of a sharded book is held by its shards
+        return {**super().get_initial(), 'stock': self.object.available_stock}
+
+    def form_valid(self, form):
+        if not self.object.stock_shards:
+            return super().form_valid(form)
+        stock, form.instance.stock = form.instance.stock, 0
+        response = super().form_valid(form)
+        set_stock(self.object.pk, stock)
+        return response
+
 @method_decorator(login_required, name='dispatch')
 class BookDeleteView(DeleteView):
     """
@@ -77,30 +121,43 @@ class BookDeleteView(DeleteView):
     success_url = reverse_lazy('books:list')
     
 @method_decorator(login_required, name='dispatch')
-class RestockEventListView(ListView):
+class RestockEventListView(TemplateView):
     """
-    View to list all restock events.
+    View to list restock events: one keyset-paginated table of pending
+    events and one of executed events, each with its own cursor.
     """
-    model = RestockEvent
     template_name = 'books/event_list.html'
-    context_object_name = 'events'
     paginate_by = 50
-    
-    def get_queryset(self):
-        return RestockEvent.objects.filter(executed=False).order_by('scheduled_for')
-    
+
+    def get_feed(self, name, queryset, ordering):
+        cursor = self.request.GET.get(name)
+        try:
+            events, next_cursor = keyset_page(
+                queryset.select_related('book'), ordering, cursor, self.paginate_by
+            )
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        next_url = next_cursor and cursor_url(self.request, name, next_cursor)
+        return events, next_url
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx['pending_events'] = RestockEvent.objects.filter(executed=False).order_by('scheduled_for')
-        ctx['executed_events'] = RestockEvent.objects.filter(executed=True).order_by('-executed_at')
+        ctx['pending_events'], ctx['pending_next_url'] = self.get_feed(
+            'pending', RestockEvent.objects.filter(executed=False), ('scheduled_for', 'id')
+        )
+        ctx['executed_events'], ctx['executed_next_url'] = self.get_feed(
+            'executed', RestockEvent.objects.filter(executed=True), ('-executed_at', '-id')
+        )
         return ctx
     
 @login_required
+@idempotent
 def buy_stock(request, pk):
     """
     If there is stock available, subtract 1 from the stock and schedule a restock event.
     If there is no stock available, and there isn't a scheduled event: schedule a restock event.
     If there is no stock available, and there is a scheduled event: show a message that it's already scheduled.
+    A resubmission with the same Idempotency-Key header is redirected without ordering again.
     """
     book = get_object_or_404(Book, pk=pk)
     
@@ -110,18 +167,10 @@ def buy_stock(request, pk):
     except ValueError:
         quantity = 1
         
-    # Read delay days from settings
-    delay_days = int(settings.RESTOCK_DELAY_DAYS)
-    scheduled = timezone.now() + timezone.timedelta(days=delay_days)
-
-    # Always create a new event
-    RestockEvent.objects.create(
-        book=book,
-        scheduled_for=scheduled,
-        quantity=quantity
-    )
+    # Create a new event (or merge into a pending one when coalescing)
+    ev = schedule_restock(book, quantity)
     messages.success(
         request,
-        f"Order placed for {quantity}x “{book.title}”. Delivery on {scheduled:%Y-%m-%d}."
+        f"Order placed for {quantity}x “{book.title}”. Delivery on {ev.scheduled_for:%Y-%m-%d}."
     )
     return redirect('books:detail', pk=pk)
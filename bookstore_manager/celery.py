@@ -7,16 +7,9 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookstore_manager.settings')
 # Celery app instance
 app = Celery('bookstore_manager')
 
-# Load Celery settings from Django settings with a CELERY namespace
+# Load Celery settings (including the beat schedule, CELERY_BEAT_SCHEDULE)
+# from Django settings with a CELERY namespace
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
-
-# Schedule periodic tasks to check for restock events every minute
-app.conf.beat_schedule = {
-    'process_restock_events_every_minute': {
-        'task' : 'books.tasks.process_restock_events',
-        'schedule': 60.0,
-    },
-}
\ No newline at end of file
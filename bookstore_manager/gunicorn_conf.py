@@ -0,0 +1,13 @@
+"""
+Gunicorn settings used by `manage.py serve` (worker count, bind address
+and timeouts are passed on the command line).
+"""
+import os
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of dead workers from the shared metrics directory
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
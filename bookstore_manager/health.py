@@ -0,0 +1,44 @@
+"""
+Health checks for load balancers and container orchestration.
+"""
+import logging
+
+from django.core.cache import cache
+from django.db import connection
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+
+def liveness(request):
+    """
+    GET /healthz -> the process is up and serving requests.
+    """
+    return JsonResponse({'status': 'ok'})
+
+
+def readiness(request):
+    """
+    GET /readyz -> the process can serve traffic: the database and the
+    cache answer. 503 otherwise.
+    """
+    checks = {}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        checks['database'] = 'ok'
+    except Exception:
+        logger.exception("Readiness check: database unavailable")
+        checks['database'] = 'unavailable'
+    try:
+        cache.set('health:ready', 1, 10)
+        checks['cache'] = 'ok' if cache.get('health:ready') == 1 else 'unavailable'
+    except Exception:
+        logger.exception("Readiness check: cache unavailable")
+        checks['cache'] = 'unavailable'
+
+    ready = all(status == 'ok' for status in checks.values())
+    return JsonResponse(
+        {'status': 'ok' if ready else 'unavailable', 'checks': checks},
+        status=200 if ready else 503,
+    )
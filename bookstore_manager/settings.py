@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -40,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'corsheaders',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third-party apps
     'rest_framework',
@@ -51,6 +54,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books.metrics.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -92,12 +96,73 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('POSTGRES_HOST'),
         'PORT': os.getenv('POSTGRES_PORT'),
+        # Keep connections open between requests instead of paying the
+        # connection setup on every request; checked before being reused
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# With DB_POOL_MAX_SIZE, each process keeps a psycopg connection pool
+# instead (recommended under ASGI, where requests do not reuse a thread
+# and therefore cannot reuse a persistent connection)
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 0))
+if DB_POOL_MAX_SIZE:
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': 10,
+        },
+    }
+
+# Cache: Redis when CACHE_URL is set, local memory otherwise (e.g. tests)
+CACHE_URL = os.getenv('CACHE_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    } if CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Idempotency keys of purchase requests (see books.idempotency). Every
+    # entry expires after IDEMPOTENCY_TTL seconds; in local memory the
+    # store is also capped at IDEMPOTENCY_MAX_KEYS entries, in Redis by
+    # its maxmemory policy (volatile-* evicts these before the untimed
+    # write-behind purchase queue).
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+        'KEY_PREFIX': 'idempotency',
+    } if CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'idempotency',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('IDEMPOTENCY_MAX_KEYS', 10000))},
+    },
+}
+
+# Seconds the response of a purchase is replayed to retries carrying the
+# same Idempotency-Key header
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 86400))
+# Seconds a duplicate waits for the original request to finish before
+# getting 409 Conflict
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', 5))
+
+# Seconds a cached catalog response is kept (entries are also versioned)
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 300))
+
+# Build the book list and events feed responses from values() rows and
+# render them with orjson (same output, less CPU; see books.api.fastpath)
+API_FAST_SERIALIZATION = os.getenv('API_FAST_SERIALIZATION', 'True') == 'True'
+
 # Celery (broker and backend)
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
+# Redis redelivers unacknowledged tasks after this many seconds; it must
+# stay above RESTOCK_SWEEP_INTERVAL, the furthest ahead restock wake-ups
+# are enqueued, or every wake-up would be delivered several times.
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
 
 
 # Password validation
@@ -145,6 +210,65 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 RESTOCK_DELAY_DAYS = int(os.getenv('RESTOCK_DELAY_DAYS', 3))
 
+# Maximum number of restock events applied per transaction by the executor
+RESTOCK_BATCH_SIZE = int(os.getenv('RESTOCK_BATCH_SIZE', 1000))
+
+# Seconds between safety-net sweeps of the restock executor. Events are
+# normally executed by ETA tasks enqueued for their scheduled time.
+RESTOCK_SWEEP_INTERVAL = int(os.getenv('RESTOCK_SWEEP_INTERVAL', 900))
+
+# When non-zero, new orders of a book are merged into its pending restock
+# event scheduled within this many seconds before theirs (0 disables it)
+RESTOCK_COALESCE_WINDOW = int(os.getenv('RESTOCK_COALESCE_WINDOW', 0))
+
+# Write-behind purchases: PurchaseBookAPIView reserves stock against a
+# counter in the cache and answers at once; accepted orders are queued in
+# the cache and applied to the database in group commits every
+# PURCHASE_FLUSH_INTERVAL seconds (see books.purchase_queue). The cache
+# must be Redis (CACHE_URL), persisted, and shared by every process.
+PURCHASE_WRITE_BEHIND = os.getenv('PURCHASE_WRITE_BEHIND', 'False') == 'True'
+if PURCHASE_WRITE_BEHIND and not CACHE_URL:
+    # A local-memory queue would be private to each process
+    raise ImproperlyConfigured("PURCHASE_WRITE_BEHIND requires a shared cache: set CACHE_URL.")
+PURCHASE_FLUSH_INTERVAL = float(os.getenv('PURCHASE_FLUSH_INTERVAL', 1))
+# Maximum number of queued orders applied per transaction
+PURCHASE_FLUSH_BATCH_SIZE = int(os.getenv('PURCHASE_FLUSH_BATCH_SIZE', 1000))
+
+# Executed restock events older than this many days are rolled up into
+# per-book daily summaries and removed from the events table
+RESTOCK_RETENTION_DAYS = int(os.getenv('RESTOCK_RETENTION_DAYS', 30))
+
+# Periodic tasks (celery beat). Restock events are executed by ETA tasks
+# enqueued for their scheduled time; the low-frequency sweep is only a
+# safety net for lost tasks and enqueues the wake-ups of the events
+# falling due before the next sweep.
+CELERY_BEAT_SCHEDULE = {
+    'process_restock_events_sweep': {
+        'task': 'books.tasks.process_restock_events',
+        'schedule': float(RESTOCK_SWEEP_INTERVAL),
+    },
+    # Roll executed events past RESTOCK_RETENTION_DAYS into daily summaries
+    'archive_restock_events_daily': {
+        'task': 'books.tasks.archive_restock_events',
+        'schedule': 86400.0,
+    },
+}
+if PURCHASE_WRITE_BEHIND:
+    # Group commits of the write-behind purchase queue
+    CELERY_BEAT_SCHEDULE['flush_purchase_queue'] = {
+        'task': 'books.tasks.flush_purchase_queue',
+        'schedule': PURCHASE_FLUSH_INTERVAL,
+    }
+
+# Return per-request timings (total and SQL) in a Server-Timing header.
+# Request metrics are always recorded and exposed at /metrics.
+METRICS_DEBUG_HEADERS = os.getenv('METRICS_DEBUG_HEADERS', 'False') == 'True'
+# /metrics is served to staff users and to scrapers sending this token
+# as 'Authorization: Bearer <token>' (empty: staff users only)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Seconds the restock figures read from the database by /metrics are reused
+METRICS_CACHE_TIMEOUT = int(os.getenv('METRICS_CACHE_TIMEOUT', 15))
+
 # Authentication
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'books:list'
@@ -155,9 +279,10 @@ CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:5173',
 ]
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'books.pagination.EstimatedCountPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -165,6 +290,10 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Paginated lists count their rows exactly up to this many; beyond it
+# the count is the query planner's estimate (0 always counts exactly)
+API_COUNT_ESTIMATE_THRESHOLD = int(os.getenv('API_COUNT_ESTIMATE_THRESHOLD', 10000))
+
 CSRF_TRUSTED_ORIGINS = ['http://localhost:5173']
 CSRF_COOKIE_SAMESITE = None
 SESSION_COOKIE_SAMESITE = None
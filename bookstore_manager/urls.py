@@ -19,6 +19,8 @@ from django.urls import path, include
 from django.http import JsonResponse, HttpResponse
 from django.contrib.auth import views as auth_views
 from books.api.views import PurchaseBookAPIView
+from books.metrics import metrics_view
+from bookstore_manager.health import liveness, readiness
 
 urlpatterns = [
     # Authentication URLs
@@ -34,6 +36,13 @@ urlpatterns = [
     # Endpoint for purchasing books
     path('book/buy/<int:pk>/', PurchaseBookAPIView.as_view(), name='book-buy-api'),
     
+    # Health checks (liveness and readiness)
+    path('healthz', liveness, name='healthz'),
+    path('readyz', readiness, name='readyz'),
+
+    # Prometheus metrics (request durations and SQL per URL name)
+    path('metrics', metrics_view, name='metrics'),
+
     # Another app URLs
     path('admin/', admin.site.urls),
     path('', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
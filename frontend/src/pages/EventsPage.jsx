@@ -1,5 +1,5 @@
 import { useEffect, useState } from 'react';
-import { Container, Spinner, Alert, Table } from 'react-bootstrap';
+import { Container, Spinner, Alert, Table, Button } from 'react-bootstrap';
 
 export default function EventsPage() {
   const [data, setData] = useState({ pending_events: [], executed_events: [] });
@@ -22,7 +22,24 @@ export default function EventsPage() {
       });
   }, []);
 
-  const renderTable = (events, title) => (
+  // Follow the cursor of one feed and append its next page
+  const loadMore = (key) => {
+    fetch(data[`${key}_next`])
+      .then(res => {
+        if (!res.ok) throw new Error(`Status ${res.status}`);
+        return res.json();
+      })
+      .then(page => {
+        setData(prev => ({
+          ...prev,
+          [`${key}_events`]: [...prev[`${key}_events`], ...page.results],
+          [`${key}_next`]: page.next,
+        }));
+      })
+      .catch(err => setError(err.message));
+  };
+
+  const renderTable = (events, title, key) => (
     <>
       <h2 className="mt-4">{title}</h2>
       <Table striped bordered hover>
@@ -47,6 +64,9 @@ export default function EventsPage() {
           ))}
         </tbody>
       </Table>
+      {data[`${key}_next`] && (
+        <Button variant="secondary" onClick={() => loadMore(key)}>Load more</Button>
+      )}
     </>
   );
 
@@ -56,8 +76,8 @@ export default function EventsPage() {
   return (
     <Container>
       <h1>Restock Events</h1>
-      {renderTable(data.pending_events, 'Pending Events')}
-      {renderTable(data.executed_events, 'Executed Events')}
+      {renderTable(data.pending_events, 'Pending Events', 'pending')}
+      {renderTable(data.executed_events, 'Executed Events', 'executed')}
     </Container>
   );
 }
\ No newline at end of file